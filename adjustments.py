@@ -0,0 +1,230 @@
+"""除權息調整因子
+
+stock_data 只保存原始價格（下載時 auto_adjust=False），除息與分割事件記錄在 adjustment_factors，
+每筆事件的因子由除權息日前一個交易日的原始收盤價計算：
+    價格因子 = (1 / 分割比例) × (1 - 股利 / 前一日收盤價)
+某一天的調整後價格 = 原始價格 × 該日之後所有事件因子的乘積，讀取時才以向量化運算套用。
+新的除息事件只會新增一筆因子並清除該股票的快取，不需要重新下載歷史數據。
+由調整後價格衍生的 stock_indicators 與 screen_latest，在因子改變時於同一事務中刪除該股票的列，
+之後由 indicators.update_indicators / screener.refresh 以新的因子重新計算。
+legacy_prices 中的股票仍保存舊版下載的 Yahoo 調整後價格：讀取時不套用因子，也不計算衍生數據，
+staged_reload 以原始價格重新載入後移除標記。
+"""
+import threading
+
+import numpy as np
+from psycopg2 import sql
+
+import db_pool
+import metrics
+
+# 與 stock_data 一起寫入的事件欄位（frame_to_rows 產出，沒有事件時為 0）
+ACTION_FIELDS = {'dividend': 'Dividends', 'split': 'Stock Splits'}
+
+# 由調整後價格計算的衍生表（因子改變時刪除受影響股票的列）
+DERIVED_TABLES = ['stock_indicators', 'screen_latest']
+
+_factors = {}  # 股票代號 -> (事件日期天數, 價格因子後綴乘積, 成交量因子後綴乘積)
+_factors_lock = threading.Lock()
+_legacy = None  # legacy_prices 中的股票代號（None 表示尚未載入）
+
+
+def action_rows(rows):
+    """frame_to_rows 資料列中有除息或分割的列"""
+    return rows[(rows['dividend'] > 0) | ((rows['split'] > 0) & (rows['split'] != 1))]
+
+
+def record_actions(cur, rows, since, table='adjustment_factors', source='stock_data'):
+    """記錄本次寫入的除權息事件，並重新計算受影響事件的因子（在寫入 stock_data 的同一事務中呼叫）
+
+    事件因子依賴前一交易日的收盤價，因此本次寫入日期（含）之後的既有事件也一併重新計算
+    （例如回補了事件前一天的數據）；成本與這些股票在寫入日期之後的事件數成正比。
+
+    Args:
+        cur: psycopg2 游標
+        rows (pd.DataFrame): frame_to_rows 格式的資料列（含 dividend、split 欄位）
+        since (pd.Series): 股票代號 -> 本次寫入的最早日期
+        table (str): 因子表（分階段重新載入時為影子表）
+        source (str): 取得前一日收盤價的日線資料表
+
+    Returns:
+        set: 因子有新增或改變的股票代號（這些股票過去的調整後價格都已改變）
+    """
+    if rows.empty or 'dividend' not in rows:
+        return set()
+    events = action_rows(rows)
+    if not events.empty:
+        cur.execute(sql.SQL("""
+        INSERT INTO {} (ticker, date, dividend, split)
+        SELECT * FROM unnest(%s::varchar[], %s::date[], %s::real[], %s::real[])
+        ON CONFLICT (ticker, date) DO UPDATE SET dividend = EXCLUDED.dividend, split = EXCLUDED.split
+        """).format(sql.Identifier(table)), (events['ticker'].tolist(), events['date'].tolist(),
+                                             events['dividend'].astype(float).tolist(),
+                                             events['split'].astype(float).tolist()))
+
+    cur.execute(sql.SQL("""
+    UPDATE {table} a SET factor = n.factor
+    FROM (
+        SELECT e.ticker, e.date,
+               (CASE WHEN e.split > 0 THEN 1 / e.split ELSE 1 END)::double precision
+               * COALESCE(1 - e.dividend / NULLIF((
+                   SELECT s.close FROM {source} s
+                   WHERE s.ticker = e.ticker AND s.date < e.date ORDER BY s.date DESC LIMIT 1), 0), 1) AS factor
+        FROM unnest(%s::varchar[], %s::date[]) AS c(ticker, since)
+        JOIN {table} e ON e.ticker = c.ticker AND e.date >= c.since
+    ) n
+    WHERE a.ticker = n.ticker AND a.date = n.date AND a.factor IS DISTINCT FROM n.factor
+    RETURNING a.ticker
+    """).format(table=sql.Identifier(table), source=sql.Identifier(source)),
+        (since.index.tolist(), since.tolist()))
+    return {row[0] for row in cur.fetchall()}
+
+
+def invalidate_derived(cur, tickers):
+    """刪除以調整後價格計算的衍生數據（因子改變後，在同一事務中呼叫）
+
+    Args:
+        cur: psycopg2 游標
+        tickers (set): 因子改變的股票代號
+    """
+    if not tickers:
+        return
+    for table in DERIVED_TABLES:
+        cur.execute(sql.SQL("DELETE FROM {} WHERE ticker = ANY(%s)").format(sql.Identifier(table)),
+                    (list(tickers),))
+
+
+def invalidate(tickers):
+    """清除指定股票的因子快取（寫入通知時呼叫）"""
+    with _factors_lock:
+        for ticker in tickers:
+            _factors.pop(ticker, None)
+
+
+def clear():
+    """清除全部因子快取與 legacy 標記（整表重新載入後呼叫）"""
+    global _legacy
+    with _factors_lock:
+        _factors.clear()
+        _legacy = None
+
+
+@metrics.timed(metrics.DB_SECONDS, op='legacy_tickers')
+def legacy_tickers(refresh=False):
+    """仍保存 Yahoo 調整後價格的股票（legacy_prices）
+
+    Args:
+        refresh (bool): 重新查詢資料庫（其他進程可能已重新載入並移除標記）
+
+    Returns:
+        set: 股票代號
+    """
+    global _legacy
+    with _factors_lock:
+        if _legacy is not None and not refresh:
+            return _legacy
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT ticker FROM legacy_prices")
+            legacy = {row[0] for row in cur.fetchall()}
+        conn.commit()
+    with _factors_lock:
+        _legacy = legacy
+    return legacy
+
+
+def trusted(tickers):
+    """排除 legacy 股票（價格混有 Yahoo 調整後與原始價格，衍生數據不可信）
+
+    Args:
+        tickers (list): 股票代號列表
+
+    Returns:
+        list: 可計算衍生數據的股票代號（保持原順序）
+    """
+    legacy = legacy_tickers(refresh=True)
+    return [ticker for ticker in tickers if ticker not in legacy]
+
+
+@metrics.timed(metrics.DB_SECONDS, op='load_factors')
+def load_factors(tickers):
+    """取得股票的事件日期與因子後綴乘積（已快取的股票不查詢資料庫）
+
+    Args:
+        tickers (list): 股票代號列表
+
+    Returns:
+        dict: {股票代號: (事件日期天數陣列, 價格乘數陣列, 成交量乘數陣列)}，
+              乘數陣列長度為事件數 + 1，第 i 項為第 i 個事件（含）之後所有因子的乘積
+    """
+    with _factors_lock:
+        result = {ticker: _factors[ticker] for ticker in tickers if ticker in _factors}
+    missing = [ticker for ticker in tickers if ticker not in result]
+    if not missing:
+        return result
+
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            SELECT ticker, (date - DATE '1970-01-01'), factor, split FROM adjustment_factors
+            WHERE ticker = ANY(%s) ORDER BY ticker, date
+            """, (missing,))
+            rows = cur.fetchall()
+        conn.commit()
+
+    events = {ticker: [] for ticker in missing}  # 沒有事件的股票也快取，之後不再查詢
+    for ticker, day, factor, split in rows:
+        events[ticker].append((day, factor, split))
+    loaded = {}
+    for ticker, items in events.items():
+        days = np.array([day for day, _, _ in items], dtype='int64')
+        factors = np.array([factor for _, factor, _ in items], dtype='float64')
+        splits = np.array([split if split and split > 0 else 1.0 for _, _, split in items], dtype='float64')
+        loaded[ticker] = (days, _suffix_product(factors), _suffix_product(splits))
+    with _factors_lock:
+        _factors.update(loaded)
+    result.update(loaded)
+    return result
+
+
+def _suffix_product(values):
+    """第 i 項為 values[i:] 的乘積，最後附加 1（之後沒有事件）"""
+    return np.append(np.cumprod(values[::-1])[::-1], 1.0)
+
+
+def adjust(data):
+    """將原始價格轉為調整後價格
+
+    Args:
+        data (pd.DataFrame): read_db_tables.read_stock_data 格式（date 索引、ticker 欄位、價格欄位）
+
+    Returns:
+        pd.DataFrame: 相同格式；價格乘以之後事件的因子乘積，成交量乘以之後分割比例的乘積
+                      （legacy 股票已是調整後價格，維持原值）
+    """
+    if data.empty:
+        return data
+    positions = data.groupby('ticker', sort=False).indices  # 股票代號 -> 列位置
+    legacy = legacy_tickers()
+    factors = load_factors([ticker for ticker in positions if ticker not in legacy])
+    days = data.index.to_numpy().astype('datetime64[D]').astype('int64')
+    price = np.ones(len(data))
+    volume = np.ones(len(data))
+    for ticker, rows in positions.items():
+        if ticker in legacy:
+            continue
+        event_days, price_suffix, volume_suffix = factors[ticker]
+        if not len(event_days):
+            continue
+        after = np.searchsorted(event_days, days[rows], side='right')  # 當天之前（含當天）已發生的事件數
+        price[rows] = price_suffix[after]
+        volume[rows] = volume_suffix[after]
+
+    result = data.copy()
+    for column in ('open', 'high', 'low', 'close'):
+        if column in result:
+            result[column] = result[column].to_numpy(dtype='float64') * price
+    if 'volume' in result:
+        values = np.round(result['volume'].to_numpy(dtype='float64') * volume)
+        result['volume'] = values if np.isnan(values).any() else values.astype('int64')
+    return result
@@ -0,0 +1,98 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# 快取容量（可由 .env 覆蓋）
+API_CACHE_SIZE = int(os.getenv('API_CACHE_SIZE', 256))  # 最多快取的查詢結果數
+
+
+class LRUCache:
+    """線程安全、容量有限的 LRU 查詢快取
+
+    鍵的第一個元素必須是股票代號，寫入某支股票時可只清除該股票的快取。
+    每個項目記錄查詢時該股票在資料庫中的版本（db_status.data_version），取用時版本不同即視為未命中；
+    其他進程、分片子進程或其他實例的寫入也會改變版本，不依賴本進程的寫入通知。
+    """
+
+    def __init__(self, maxsize=API_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # 鍵 -> (版本, 值)，越後面越常用
+        self._modified = {}  # 股票代號 -> 最後修改時間 (UTC)，資料庫沒有版本時使用
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version=None):
+        """取得快取值，找不到或版本不同時返回 None
+
+        Args:
+            key (tuple): 快取鍵
+            version: 該股票目前的資料版本
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    del self._data[key]  # 已被其他寫入取代
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)  # 標記為最近使用
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, version=None):
+        """寫入快取，超過容量時淘汰最久未使用的項目
+
+        Args:
+            key (tuple): 快取鍵，第一個元素為股票代號
+            value: 快取值
+            version: 查詢資料庫「之前」取得的資料版本；查詢期間有寫入時版本已改變，下次取用不會命中
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate_tickers(self, tickers):
+        """清除指定股票的所有快取（本進程寫入後立即釋放記憶體），並更新其最後修改時間"""
+        tickers = set(tickers)
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        with self._lock:
+            for key in [key for key in self._data if key[0] in tickers]:
+                del self._data[key]
+            for ticker in tickers:
+                self._modified[ticker] = now
+
+    def last_modified(self, ticker, version=None):
+        """股票的最後修改時間
+
+        Args:
+            ticker (str): 股票代號
+            version (datetime): 資料版本（stock_summary 的最後寫入時間），沒有時以本進程的記錄為準
+        """
+        if version is not None:
+            return version.astimezone(timezone.utc).replace(microsecond=0)
+        with self._lock:
+            return self._modified.setdefault(ticker, datetime.now(timezone.utc).replace(microsecond=0))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize,
+                    "hits": self.hits, "misses": self.misses}
+
+
+def make_etag(body):
+    """以回應內容計算 ETag"""
+    return hashlib.sha1(body).hexdigest()
+
+
+CACHE = LRUCache()  # /api/stock 共用的查詢快取
@@ -1,21 +1,60 @@
 # 導入必要庫
-import yfinance as yf  # 用於從 Yahoo Finance 獲取金融數據
 import pandas as pd  # 用於數據處理和分析
-import psycopg2  # PostgreSQL 數據庫適配器
+from psycopg2.extras import execute_values  # PostgreSQL 多列批量插入
 from datetime import datetime, timedelta  # 處理日期和時間
 import csv  # 讀寫 CSV 文件
 import os  # 操作系統功能
-from flask import Flask, render_template, jsonify, request  # Web 框架及相關工具
+from flask import Flask, render_template, jsonify, request, Response  # Web 框架及相關工具
+import json  # 序列化 API 回應
 import threading  # 多線程支持
 import time  # 時間相關功能
 
 # 導入自定義模塊
+import db_pool  # 共用資料庫連接池
+import db_schema  # 資料表結構與遷移
 import drop_db_tables  # 刪除數據庫表的工具
+import batch_download  # 批次下載股票歷史數據
+import validate_codes  # 並行檢查股票代號
+import code_cache  # 股票代號檢查快取
+import bulk_load  # 以 COPY 批量寫入歷史數據
+import read_db_tables  # 讀取股票歷史數據
+import api_cache  # /api/stock 查詢快取
+import indicators  # 技術指標計算
+import update_pipeline  # 分階段更新管線
+import job_state  # 可續接的更新任務檢查點
+import shard_update  # 多進程分片更新
+import event_log  # 帶序號的進度事件日誌
+import snapshot_export  # Parquet/Arrow 快照匯出
+import data_sources  # 可替換的股票資料來源
+import metrics  # 計數器與延遲直方圖（/metrics）
+import db_status  # 以摘要表與系統目錄回報資料庫狀態
+import backfill  # 長區間歷史數據回補
+import scheduler  # 排程器、任務佇列與互斥鎖
+import screener  # 全市場最新 K 棒選股篩選
+import rollups  # 週線/月線彙總表
+import adjustments  # 除權息調整因子
+import staged_reload  # 影子表重新載入與原子切換
 from dotenv import load_dotenv  # 從 .env 文件加載環境變量
 
 # 加載環境變量
 load_dotenv()  # 從項目根目錄的 .env 文件加載敏感信息
 
+# 代號檢查並行設定（可由 .env 覆蓋）
+VALIDATION_WORKERS = int(os.getenv('VALIDATION_WORKERS', 8))  # 最大並行請求數
+VALIDATION_RATE = float(os.getenv('VALIDATION_RATE', 5))  # 每秒最多請求數
+VALIDATION_TIMEOUT = float(os.getenv('VALIDATION_TIMEOUT', 15))  # 單一請求逾時秒數
+WRITE_BATCH_TICKERS = int(os.getenv('WRITE_BATCH_TICKERS', 20))  # 每次交給轉換階段的股票數
+WRITE_CHUNK_ROWS = int(os.getenv('WRITE_CHUNK_ROWS', 50000))  # 每次 COPY 寫入的資料列數（限制轉換與寫入的峰值記憶體）
+
+# 更新管線設定（可由 .env 覆蓋）
+PIPELINE_CHUNK = int(os.getenv('PIPELINE_CHUNK', 50))  # 每次送入驗證階段的候選代號數
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 4))  # 階段之間佇列的容量（背壓上限）
+PIPELINE_VALIDATE_WORKERS = int(os.getenv('PIPELINE_VALIDATE_WORKERS', 1))  # 驗證階段線程數（每個線程內另有驗證線程池）
+PIPELINE_DOWNLOAD_WORKERS = int(os.getenv('PIPELINE_DOWNLOAD_WORKERS', 2))  # 下載階段線程數
+PIPELINE_TRANSFORM_WORKERS = int(os.getenv('PIPELINE_TRANSFORM_WORKERS', 1))  # 轉換階段線程數
+PIPELINE_WRITE_WORKERS = int(os.getenv('PIPELINE_WRITE_WORKERS', 2))  # 寫入階段線程數
+UPDATE_SHARDS = int(os.getenv('UPDATE_SHARDS', 1))  # 預設分片進程數（1=單進程）
+
 def is_stock_code(ticker):
     """檢查是否為有效的台股股票代號
     
@@ -26,22 +65,13 @@ def is_stock_code(ticker):
         bool: 是否為有效代號
     """
     try:
-        stock_info = yf.Ticker(ticker)  # 創建股票對象
-        
-        # 檢查是否存在市場價格數據
-        if stock_info.info['regularMarketPrice'] is not None:
-            return True
-        return False
-    
-    except KeyError:
-        print(f"錯誤：無法找到股票代號 {ticker} 的市場價格資訊。")
-        return False
-    except ValueError:
-        print(f"錯誤：股票代號 {ticker} 格式不正確。")
-        return False
-    except Exception as e:
-        print(f"發生未知錯誤：{e}")
-        return False
+        with metrics.CODE_CHECK_SECONDS.time():
+            valid = data_sources.get_source().is_stock_code(ticker)  # 由設定的資料來源判斷（預設 yfinance）
+    except Exception:
+        metrics.CODE_CHECKS.inc(result='error')
+        raise
+    metrics.CODE_CHECKS.inc(result='valid' if valid else 'invalid')
+    return valid
 
 def fetch_stock_data(ticker):
     """抓取指定股票近6個月歷史數據
@@ -53,10 +83,11 @@ def fetch_stock_data(ticker):
         pd.DataFrame: 包含 OHLCV 數據的 DataFrame
     """
     end_date = datetime.now()  # 當前日期
-    start_date = end_date - timedelta(days=180)  # 180天前日期
-    data = yf.download(ticker, start=start_date, end=end_date)  # 下載歷史數據
+    start_date = end_date - timedelta(days=batch_download.HISTORY_DAYS)  # 180天前日期
+    data = data_sources.get_source().history(ticker, start_date, end_date)  # 下載歷史數據
     return data
 
+@metrics.timed(metrics.DB_SECONDS, op='save_stock_codes')
 def save_stock_codes_to_postgresql(stock_codes):
     """將股票代號批量存入 PostgreSQL 數據庫
     
@@ -64,46 +95,27 @@ def save_stock_codes_to_postgresql(stock_codes):
         stock_codes (list): 股票代號列表
         
     工作流程：
-    1. 建立數據庫連接
-    2. 創建 stock_codes 表 (如果不存在)
+    1. 確認資料庫結構為最新 (由 db_schema 建立/升級資料表)
+    2. 從共用連接池借用連接
     3. 批量插入數據，忽略重複值
-    4. 提交事務並關閉連接
+    4. 提交事務並歸還連接
     """
     try:
-        # 建立數據庫連接
-        conn = psycopg2.connect(
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT')
-        )
-        cursor = conn.cursor()
+        db_schema.ensure_schema() # 套用尚未執行的結構遷移
+        with db_pool.connection() as conn: # 從共用連接池借用連接，離開時自動歸還
+            with conn.cursor() as cursor:
+                # 批量插入數據
+                execute_values(cursor, """
+                INSERT INTO stock_codes (ticker)
+                VALUES %s
+                ON CONFLICT (ticker) DO NOTHING
+                """, [(code,) for code in stock_codes])
 
-        # 創建股票代碼表
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS stock_codes (
-            id SERIAL PRIMARY KEY,  -- 自增主鍵
-            ticker VARCHAR(10) UNIQUE  -- 唯一股票代號
-        )
-        """)
-
-        # 批量插入數據
-        for code in stock_codes:
-            cursor.execute("""
-            INSERT INTO stock_codes (ticker)
-            VALUES (%s)
-            ON CONFLICT (ticker) DO NOTHING
-            """, (code,))
-
-        conn.commit()  # 提交事務
-        print("股票代號存儲成功")
+            conn.commit()  # 提交事務
+            print("股票代號存儲成功")
         
     except Exception as e:
         print(f"數據庫操作異常: {e}")
-    finally:
-        cursor.close()
-        conn.close()
 
 def save_stock_data_to_postgresql(data, ticker):
     """存儲單個股票歷史數據到數據庫
@@ -114,56 +126,12 @@ def save_stock_data_to_postgresql(data, ticker):
         
     注意事項：
     - 數據表 stock_data 包含外鍵約束
-    - 使用批量插入提高性能
+    - 整個 DataFrame 一次轉換後以 COPY 寫入，多支股票請改用 bulk_load.save_frames
     """
-    try:
-        conn = psycopg2.connect(
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT')
-        )
-        cursor = conn.cursor()
-
-        # 創建股票數據表
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS stock_data (
-            id SERIAL PRIMARY KEY,
-            date DATE,  -- 交易日期
-            open FLOAT,  -- 開盤價
-            high FLOAT,  -- 最高價
-            low FLOAT,  -- 最低價
-            close FLOAT,  -- 收盤價
-            volume INT,  -- 成交量
-            ticker VARCHAR(10) REFERENCES stock_codes(ticker)  -- 外鍵約束
-        )
-        """)
-
-        # 插入每行數據
-        for index, row in data.iterrows():
-            cursor.execute("""
-            INSERT INTO stock_data (date, open, high, low, close, volume, ticker)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (
-                index.date(), 
-                float(row['Open'].iloc[0]),
-                float(row['High'].iloc[0]),
-                float(row['Low'].iloc[0]),
-                float(row['Close'].iloc[0]),
-                int(row['Volume'].iloc[0]),
-                ticker
-            ))
-
-        conn.commit()
+    if bulk_load.save_frames([(ticker, data)]):
         print(f"{ticker} 數據存儲成功")
-        
-    except Exception as e:
-        print(f"數據存儲異常: {e}")
-    finally:
-        cursor.close()
-        conn.close()
 
+@metrics.timed(metrics.DB_SECONDS, op='check_database_is_null')
 def check_database_is_null():
     """檢查數據庫初始化狀態
     
@@ -171,82 +139,40 @@ def check_database_is_null():
         bool: True 表示數據庫為空需要初始化
     """
     try:
-        conn = psycopg2.connect(
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT')
-        )
-        cursor = conn.cursor()
-
-        # 檢查公共模式下的表數量
-        cursor.execute("""
-        SELECT COUNT(*) 
-        FROM information_schema.tables 
-        WHERE table_schema = 'public'
-        """)
-        table_count = cursor.fetchone()[0]
-
-        if table_count == 0:
-            return True
-
-        # 檢查 stock_codes 表存在性
-        cursor.execute("""
-        SELECT EXISTS (
-            SELECT 1 
-            FROM information_schema.tables 
-            WHERE table_name = 'stock_codes'
-        )
-        """)
-        exists = cursor.fetchone()[0]
-
-        if not exists:
-            return True
+        with db_pool.connection() as conn, conn.cursor() as cursor:
+            # 以系統目錄確認 stock_codes 表存在（不查 information_schema，成本固定）
+            cursor.execute("SELECT to_regclass('public.stock_codes') IS NOT NULL")
+            if not cursor.fetchone()[0]:
+                return True
 
-        # 檢查表是否為空
-        cursor.execute("SELECT COUNT(*) FROM stock_codes")
-        count = cursor.fetchone()[0]
-        return count == 0
+            # 只需知道是否有任何一列，EXISTS 找到第一列即停止，不做全表 COUNT
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM stock_codes)")
+            return not cursor.fetchone()[0]
         
     except Exception as e:
         print(f"數據庫檢查異常: {e}")
         return True
-    finally:
-        cursor.close()
-        conn.close()
 
 
 
+@metrics.timed(metrics.DB_SECONDS, op='get_last_updated_stock')
 def get_last_updated_stock():
-    """取得 stock_data 表中最後加入的股票代號及日期，並計算距今天數
+    """取得 stock_data 表中最後加入的股票代號及日期，並計算距今天數（讀取 stock_summary 摘要）
     
     Returns:
         dict: 包含股票代號(code)、最後更新日期(date)和距今天數(days)的字典
         None: 查詢失敗時返回
     """
     try:
-        # 導入依賴（通常應放在文件頂部，此處為保持函數獨立性）
-        import psycopg2
-        from datetime import datetime
-        
-        # 建立數據庫連接
-        conn = psycopg2.connect(
-            dbname=os.getenv('DB_NAME'),  # 從環境變量獲取數據庫名
-            user=os.getenv('DB_USER'),    # 數據庫用戶名
-            password=os.getenv('DB_PASSWORD'),  # 數據庫密碼
-            host=os.getenv('DB_HOST'),    # 數據庫主機地址
-            port=os.getenv('DB_PORT')     # 數據庫端口號
-        )
-        
-        # 使用上下文管理器自動管理游標
-        with conn.cursor() as cur:
-            # 查詢最新數據（按主鍵ID降序）
+        db_schema.ensure_schema()  # 舊資料庫首次查詢時建立並回填 stock_summary
+        # 從共用連接池借用連接，並使用上下文管理器自動管理游標
+        with db_pool.connection() as conn, conn.cursor() as cur:
+            # 查詢最新數據（讀每支股票一列的 stock_summary，不掃描 stock_data）
             cur.execute("""
-                SELECT ticker, date
-                FROM stock_data
-                ORDER BY id DESC  -- 按插入順序倒排
-                LIMIT 1           -- 只取最新一條
+                SELECT ticker, last_date
+                FROM stock_summary
+                ORDER BY last_date DESC, ticker DESC  -- 最新交易日中代號最大的一筆
+                LIMIT 1                               -- 只取最新一條
             """)
             result = cur.fetchone()  # 獲取單條結果
             
@@ -270,110 +196,426 @@ update_progress = {
     "current_batch": 0,         # 當前處理的批次序號（從0開始）
     "total_batches": 5,         # 總批次數（初始值可被覆蓋）
     "is_running": False,        # 流程運行狀態標誌位
-    "messages": [],             # 操作日誌隊列（需注意線程安全）
-    "start_idx": 0              # 新增：批次處理起始索引
+    "messages": event_log.EventLog(),  # 操作日誌（線程安全的環形緩衝區，帶序號）
+    "start_idx": 0,             # 新增：批次處理起始索引
+    "codes_per_sec": 0,         # 代號檢查吞吐量（代號/秒）
+    "pipeline": [],             # 各管線階段的吞吐量與佇列深度
+    "job_id": None              # 目前的更新任務編號（job_state）
 }
 
-def write_db_tables(total_stocks):
+def load_stock_codes(candidates, incremental=False, job_id=None):
+    """驗證候選代號並下載、寫入有效股票的歷史數據
+    
+    以管線方式執行：驗證 → 下載 → 轉換 → 寫入，各階段以有界佇列串接並同時運作，
+    網路下載與資料庫寫入互相重疊。
+    指定 job_id 時邊執行邊記錄檢查點，續接時略過已判定無效與已寫入的代號。
+    
+    Args:
+        candidates (list): 候選股票代號（依代號順序）
+        incremental (bool): True=只下載資料庫最新日期之後的數據並以 upsert 寫入
+        job_id (int): 更新任務編號（job_state），None 表示不記錄檢查點
+        
+    Returns:
+        list: 排序後的有效股票代號（中斷時只含已驗證的部分）
+    """
+    batch_size = 5 # 每批處理的數量（用於進度顯示）
+    log = update_progress["messages"].append # 各階段訊息寫入進度日誌
+
+    # 讀取代號檢查快取，首次使用時以 valid_stock_codes.csv 與 stock_codes 表預熱
+    cache = code_cache.load_validity_cache()
+    if not cache:
+        code_cache.save_validity_results(code_cache.warm_start(cache))
+    known_valid, to_check = code_cache.partition_codes(candidates, cache) # 未過期的快取結果不再檢查
+    known_valid, to_check = set(known_valid), set(to_check)
+    log(f"快取命中 {len(candidates) - len(to_check)} 個代號，需檢查 {len(to_check)} 個")
+
+    # 續接任務：檢查點中的結果優先於快取
+    checkpoint = job_state.load_items(job_id) # {代號: invalid / valid / done}
+    if checkpoint:
+        done_before = sum(state == 'done' for state in checkpoint.values())
+        log(f"續接任務 #{job_id}: 已完成 {done_before} 支股票，已驗證 {len(checkpoint)} 個代號")
+    known_valid |= {code for code, state in checkpoint.items() if state != 'invalid'}
+    to_check -= set(checkpoint)
+
+    valid_codes = [] # 所有有效代號（快取命中 + 本次檢查通過）
+    counters = {"done": 0, "saved": 0} # 已處理的候選代號數、已寫入的股票數
+    counters_lock = threading.Lock()
+    bucket = validate_codes.TokenBucket(VALIDATION_RATE) # 所有驗證請求共用的限速額度
+    begin = time.monotonic()
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage="validate")
+    def validate_stage(chunk):
+        """驗證階段：快取命中的代號直接通過，其餘以線程池並行檢查"""
+        results = {} # 本批檢查結果 {代號: (是否有效, 檢查時間)}
+        checked = validate_codes.validate_codes(
+            [code for code in chunk if code in to_check],
+            is_stock_code, # 自定義函數，檢查股票代號是否存在
+            max_workers=VALIDATION_WORKERS, # 最大並行請求數
+            timeout=VALIDATION_TIMEOUT, # 單一請求逾時秒數
+            stop_event=stop_event,
+            on_result=lambda code, ok: results.__setitem__(code, (ok, datetime.now())),
+            bucket=bucket,
+            log=log # 檢查失敗與逾時訊息送到進度事件日誌
+        )
+        valid = sorted([code for code in chunk if code in known_valid] + checked)
+        # 每批結束即保存檢查結果與檢查點，中斷或重啟後不必重新檢查
+        code_cache.save_validity_results(results)
+        job_state.record_items(job_id, {code: 'valid' if ok else 'invalid'
+                                        for code, (ok, _) in results.items()})
+        with counters_lock:
+            valid_codes.extend(valid)
+            counters["done"] += len(chunk)
+            done = counters["done"]
+        codes_per_sec = done / max(time.monotonic() - begin, 1e-9)
+        update_progress["current_batch"] = (done + batch_size - 1) // batch_size # 已完成批次數（向上取整）
+        update_progress["codes_per_sec"] = round(codes_per_sec, 2) # 每秒檢查的代號數
+        log(f"第 {update_progress['current_batch']} 批次完成 ({codes_per_sec:.2f} 代號/秒)")
+        pending = [code for code in valid if checkpoint.get(code) != 'done'] # 已寫入的股票不再下載
+        return [pending] if pending else []
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage="download")
+    def download_stage(codes):
+        """下載階段：以多股票批次請求抓取歷史數據，每湊滿 WRITE_BATCH_TICKERS 支就交給下一階段
+
+        以生成器逐組產出，轉換/寫入跟不上時下載在此暫停，已下載未寫入的數據不會無限累積。
+        """
+        options = {"stop_event": stop_event, "log": log}
+        if incremental: # 增量模式：依各股票最新日期只補抓缺少的交易日
+            batches = batch_download.iter_incremental_batches(
+                codes, bulk_load.get_latest_dates(codes), **options)
+        else:
+            batches = batch_download.iter_stock_data_batches(codes, **options)
+        pending, empty = [], {}
+        for code, stock_data in batches: # 逐支取出拆分後的 (股票代碼, 歷史數據)
+            if stock_data.empty: # 下載失敗或無數據的代碼不寫入
+                log(f"{code} 無歷史數據，略過")
+                empty[code] = 'done'
+                continue
+            pending.append((code, stock_data))
+            if len(pending) >= WRITE_BATCH_TICKERS:
+                yield pending
+                pending = []
+        if pending:
+            yield pending
+        if not stop_event.is_set(): # 中斷時未下載的代號也會是空的，不能記為完成
+            job_state.record_items(job_id, empty)
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage="transform")
+    def transform_stage(frames):
+        """轉換階段：逐支轉為型別化陣列，約每 WRITE_CHUNK_ROWS 列產出一段交給寫入階段（同一股票不跨段）"""
+        yield from bulk_load.iter_row_chunks(frames, WRITE_CHUNK_ROWS)
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage="write")
+    def write_stage(chunk):
+        """寫入階段：以一次 COPY 寫入（同一事務中補上 stock_codes 外鍵）"""
+        rows, finished = chunk # finished: 資料列全部在本段中的股票
+        states = dict.fromkeys(finished, 'done')
+        if rows.empty: # 過濾後沒有資料列的股票只記錄檢查點
+            job_state.record_items(job_id, states)
+            return
+        # 檢查點與數據同一事務提交；股票不跨段，多個寫入線程的提交順序不影響檢查點；重寫時以 (ticker, date) upsert，不會產生重複資料
+        if bulk_load.save_rows(rows, ensure_codes=True, before_commit=lambda cur: job_state.mark_items(
+                cur, job_id, states)):
+            with counters_lock:
+                counters["saved"] += len(finished)
+
+    pipeline = update_pipeline.Pipeline([
+        update_pipeline.Stage("validate", validate_stage, PIPELINE_VALIDATE_WORKERS, skip_on_stop=True),
+        update_pipeline.Stage("download", download_stage, PIPELINE_DOWNLOAD_WORKERS, skip_on_stop=True),
+        update_pipeline.Stage("transform", transform_stage, PIPELINE_TRANSFORM_WORKERS),
+        update_pipeline.Stage("write", write_stage, PIPELINE_WRITE_WORKERS),
+    ], queue_size=PIPELINE_QUEUE_SIZE, stop_event=stop_event, log=log)
+    chunks = (candidates[i:i + PIPELINE_CHUNK] for i in range(0, len(candidates), PIPELINE_CHUNK))
+    # 各階段吞吐量與佇列深度寫入進度字典，供 /update_progress 查詢
+    pipeline.run(chunks, on_stats=lambda stats: update_progress.__setitem__("pipeline", stats))
+
+    stock_codes = sorted(valid_codes) # 依代號排序
+    if stop_event.is_set(): # 用.is_set()檢查標誌是否為 True
+        log("用戶中斷: 管線已排空")
+        log(f"已驗證 {counters['done']}/{len(candidates)} 個代號，已寫入 {counters['saved']} 支股票")
+    return stock_codes
+
+
+def save_valid_codes(stock_codes):
+    """保存有效代號清單：CSV 檔、stock_codes 表，並視設定更新技術指標
+    
+    Args:
+        stock_codes (list): 排序後的有效股票代號
+    """
+    # 將有效的股票代碼列表寫入 CSV 檔案
+    with open('valid_stock_codes.csv', 'w', newline='') as csvfile: # 開啟檔案
+        writer = csv.writer(csvfile) # 建立寫入器
+        writer.writerow(['Stock Code']) # 寫入標題列
+        writer.writerows([[code] for code in stock_codes])  # 寫入所有代碼
+    
+    # 傳入有效的股票代碼，將有效的股票代碼列表保存至 PostgreSQL 資料庫（包含沒有歷史數據的代碼）
+    save_stock_codes_to_postgresql(stock_codes)
+
+    if indicators.PERSIST_INDICATORS: # 每次寫入後計算一次指標，查詢時不必重算
+        indicators.update_indicators(stock_codes, log=update_progress["messages"].append)
+
+
+def write_db_tables(total_stocks, incremental=False, job_id=None, shards=1):
     """批量處理股票數據寫入流程
     
     Args:
         total_stocks (int): 需要處理的股票總數
+        incremental (bool): True=只下載資料庫最新日期之後的數據並以 upsert 寫入
+        job_id (int): 更新任務編號（job_state），None 表示不記錄檢查點
+        shards (int): 分片進程數，大於 1 時將代號範圍分給多個進程同時處理
         
     Returns:
         bool: True=成功完成且未中斷, False=被中斷或失敗
     """
     try:
-        batch_size = 5 # 每批處理的數量
         start_idx = update_progress["start_idx"] # 從進度字典獲取起始索引
-        stock_codes = [] # 初始化空列表，用於儲存當前批次的股票代碼
-        
-
-
-        # 主批次處理循環
-        for i in range(update_progress["total_batches"]): # 歷遍所有批次
-            if stop_event.is_set(): # 用.is_set()檢查標誌是否為 True
-                update_progress["messages"].append("用戶中斷: 批次處理階段")
-                return False  # 立即返回中斷狀態
-
-            # 迴圈的迭代索引（從 0 開始），i + 1 轉換為人類可讀的批次編號（從 1 開始）
-            update_progress["current_batch"] = i + 1 # 更新當前批次編號
-            update_progress["messages"].append(f"正在處理第 {i+1} 批次") # 添加處理日誌
-            
-            time.sleep(1)
-            
-            current_start = start_idx + i * batch_size # 計算批次起始索引，範例start_idx=10, i=2, batch_size=5 → 10 + 2*5 = 20
-            # 計算批次結束位置，取小的防止最後一批次超出總數據量
-            # 範例current_start=20, batch_size=5, start_idx + total_stocks=23 → min(25,23)=23
-            current_end = min(current_start + batch_size, start_idx + total_stocks)  
-            
-            for num in range(current_start, current_end): # 遍歷當前批次範圍
-                ticker = f"{num:04d}.TW" # 將數字補零至 4 位，並加上台灣股票市場後綴.TW
-                if is_stock_code(ticker): # 自定義函數，檢查股票代號是否存在
-                    stock_codes.append(ticker) # 保留有效代碼到 stock_codes 列表中
-            
-            update_progress["messages"].append(f"第 {i+1} 批次完成")
-
+        if shards > 1: # 多進程分片：每個進程各自的連接池與限速額度，結果由本進程合併
+            stock_codes = shard_update.run_shards(
+                start_idx, total_stocks, shards, incremental, job_id,
+                progress=update_progress, stop_event=stop_event)
+            api_cache.CACHE.invalidate_tickers(stock_codes) # 子進程寫入不會觸發本進程的快取清除
+        else:
+            # 將數字補零至 4 位，並加上台灣股票市場後綴.TW
+            candidates = [f"{num:04d}.TW" for num in range(start_idx, start_idx + total_stocks)]
+            stock_codes = load_stock_codes(candidates, incremental, job_id)
 
+        if stop_event.is_set(): # 被中斷時不覆蓋有效代號清單
+            return False  # 返回中斷狀態
 
         # 最終保存階段
-        if not stop_event.is_set(): # 如果沒有收到停止訊號
-            # 將有效的股票代碼列表寫入 CSV 檔案
-            with open('valid_stock_codes.csv', 'w', newline='') as csvfile: # 開啟檔案
-                writer = csv.writer(csvfile) # 建立寫入器
-                writer.writerow(['Stock Code']) # 寫入標題列
-                writer.writerows([[code] for code in stock_codes])  # 寫入所有代碼
-            
-            # 傳入有效的股票代碼，將有效的股票代碼列表保存至 PostgreSQL 資料庫
-            save_stock_codes_to_postgresql(stock_codes)
-            
-            # 歷史數據抓取
-            # 使用 enumerate 函數逐一取出 stock_codes 的元素，生成 (編號, 股票代碼) 元組
-            # 參數 1 表示編號從 1 開始（預設為 0）
-            for idx, code in enumerate(stock_codes, 1):
-                if stop_event.is_set(): # 如果有收到停止訊號
-                    update_progress["messages"].append("用戶中斷: 歷史數據抓取階段")
-                    update_progress["messages"].append(f"第 {idx} 支股票 {code} 處理失敗")
-                    return False
-                
-                stock_data = fetch_stock_data(code) # 抓取單一股票歷史數據（包含開/高/低/收等欄位）
-                save_stock_data_to_postgresql(stock_data, code) # 將股票數據存入 PostgreSQL 資料庫
-                time.sleep(0.5)
-
-            return True  # 只有完整執行到這裡才返回成功
-        
-        else: # # 如果有收到停止訊號
-            update_progress["messages"].append("用戶中斷: 最終保存前")
-            return False
+        with metrics.STAGE_SECONDS.time(stage="save_valid_codes"):
+            save_valid_codes(stock_codes)
+        try: # 重新計算選股面板，篩選時不必逐支查詢；失敗不影響更新結果
+            with metrics.STAGE_SECONDS.time(stage="refresh_screen"):
+                screener.refresh(log=update_progress["messages"].append)
+        except Exception as e:
+            update_progress["messages"].append(f"選股面板更新失敗: {str(e)}")
+        if snapshot_export.EXPORT_AFTER_UPDATE: # 匯出欄式快照，分析時不必從資料庫逐支讀取
+            snapshot_export.export_snapshot(full=not incremental, log=update_progress["messages"].append)
+        return True  # 只有完整執行到這裡才返回成功
 
     except Exception as e:
         update_progress["messages"].append(f"處理失敗: {str(e)}")
 
         raise # 重新拋出異常，將原始異常傳遞給上層調用者
 
-def run_update_process(total_stocks):
+def run_update_process(total_stocks, incremental=False, resume=False, shards=1):
     """更新主流程控制器
     
     Args:
         total_stocks (int): 要處理的股票總數
+        incremental (bool): 是否使用增量更新模式
+        resume (bool): 是否續接最近一個未完成的任務（沒有時建立新任務）
+        shards (int): 分片進程數（1=在本進程執行）
+    
+    Returns:
+        tuple: (狀態, 訊息)，狀態為 done / stopped / failed，供任務記錄使用
     """
     update_progress["is_running"] = True  # 設置運行標誌
     update_progress["messages"].append("開始資料庫更新流程")
+    job_id = None
     
     try:            
-        if write_db_tables(total_stocks):  # 執行核心處理邏輯，返回True則顯示資料庫更新完成
-            update_progress["messages"].append("資料庫更新完成")
+        job = job_state.find_resumable_job() if resume else None
+        if job: # 沿用原任務的範圍與模式
+            job_id, total_stocks, incremental = job["job_id"], job["total"], job["incremental"]
+            update_progress["start_idx"] = job["start_idx"]
+            update_progress["total_batches"] = (total_stocks + 5 - 1) // 5
+            update_progress["messages"].append(
+                f"續接任務 #{job_id} ({job['start_idx']}-{job['start_idx'] + total_stocks}，上次狀態 {job['status']})")
         else:
-            update_progress["messages"].append(f"資料庫更新未完成") # 返回False則顯示資料庫更新未完成
+            if resume:
+                update_progress["messages"].append("沒有未完成的任務，建立新任務")
+            job_id = job_state.create_job(update_progress["start_idx"], total_stocks, incremental)
+        update_progress["job_id"] = job_id
+
+        if write_db_tables(total_stocks, incremental, job_id, shards):  # 執行核心處理邏輯，返回True則顯示資料庫更新完成
+            job_state.finish_job(job_id, 'done')
+            update_progress["messages"].append("資料庫更新完成")
+            return 'done', "資料庫更新完成"
+        job_state.finish_job(job_id, 'stopped') # 保留檢查點，之後可續接
+        update_progress["messages"].append(f"資料庫更新未完成") # 返回False則顯示資料庫更新未完成
+        return 'stopped', "資料庫更新未完成"
 
     except Exception as e:
+        job_state.finish_job(job_id, 'failed')
         update_progress["messages"].append(f"更新失敗: {str(e)}")
+        return 'failed', f"更新失敗: {str(e)}"
     finally:
         update_progress["is_running"] = False  # 重置狀態標誌
 
 
+def run_backfill_process(tickers, years):
+    """歷史回補流程控制器（與更新流程共用進度字典與停止信號）
+    
+    Args:
+        tickers (list): 股票代號列表，空列表表示 stock_codes 中的全部股票
+        years (int): 回補年數（含今年）
+    
+    Returns:
+        tuple: (狀態, 訊息)，狀態為 done / stopped / failed
+    """
+    update_progress["is_running"] = True  # 設置運行標誌
+    update_progress["messages"].append(f"開始回補 {years} 年歷史數據")
+    
+    def on_progress(summary):
+        update_progress["current_batch"] = summary["done"] # 已完成區段數
+        update_progress["total_batches"] = summary["units"] # 需要下載的區段數
+        update_progress["codes_per_sec"] = summary["tickers_per_sec"]
+    
+    try:
+        tickers = tickers or backfill.load_tickers()
+        result = backfill.run_backfill(tickers, years, stop_event=stop_event,
+                                       log=update_progress["messages"].append, on_progress=on_progress)
+        if result["stopped"]:
+            status, message = 'stopped', f"回補未完成: 已寫入 {result['rows']} 列，下次回補會略過已完成的年份"
+        else:
+            status, message = 'done', (f"回補完成: 寫入 {result['rows']} 列，下載失敗 {result['failed']} 支，"
+                                       f"略過 {result['skipped']} 個 (股票, 年份)")
+            api_cache.CACHE.clear()
+            screener.refresh(log=update_progress["messages"].append) # 回補可能補上最近的交易日
+    except Exception as e:
+        status, message = 'failed', f"回補失敗: {str(e)}"
+    update_progress["messages"].append(message) # 先送出結果訊息，前端看到 is_running=False 時已能取得
+    update_progress["is_running"] = False  # 重置狀態標誌
+    return status, message
+
+
+def run_reload_process(tickers):
+    """全量重新載入流程（寫入影子表後原子切換，期間查詢照常讀取舊資料）
+    
+    Args:
+        tickers (list): 股票代號列表，空列表表示目前 stock_summary 中的全部股票（其他股票保留現有數據）
+    
+    Returns:
+        tuple: (狀態, 訊息)，狀態為 done / stopped / failed
+    """
+    update_progress["is_running"] = True  # 設置運行標誌
+    
+    def on_progress(done, total):
+        update_progress["current_batch"] = done # 已載入股票數
+        update_progress["total_batches"] = total
+    
+    try:
+        current, first_date = staged_reload.current_range()  # 沿用目前的股票與歷史深度
+        tickers = tickers or current
+        update_progress["messages"].append(f"開始重新載入 {len(tickers)} 支股票")
+        result = staged_reload.run_reload(tickers, start_date=first_date, stop_event=stop_event,
+                                          log=update_progress["messages"].append, on_progress=on_progress)
+        if result["stopped"]:
+            status, message = 'stopped', "重新載入已停止，資料庫維持原狀"
+        else:
+            status, message = 'done', (f"重新載入完成: {result['tickers']} 支股票 {result['rows']} 列，"
+                                       f"切換耗時 {result['swap_seconds']} 秒")
+            api_cache.CACHE.clear()  # 整表替換，清空查詢快取
+            adjustments.clear()
+            if indicators.PERSIST_INDICATORS: # 切換時已清空以舊因子計算的指標
+                indicators.update_indicators(tickers, log=update_progress["messages"].append)
+            screener.refresh(log=update_progress["messages"].append)
+    except Exception as e:
+        status, message = 'failed', f"重新載入失敗: {str(e)}"
+    update_progress["messages"].append(message)
+    update_progress["is_running"] = False  # 重置狀態標誌
+    return status, message
 
 
+def parse_stock_range(user_input):
+    """解析股票範圍輸入
+    
+    Args:
+        user_input (str): '起始-結束' 或 '結束'（從 0 開始）
+    
+    Returns:
+        tuple: (起始代號, 股票總數)，格式錯誤時使用 0-20
+    """
+    try:
+        # in 是一個成員運算符（membership operator），用來判斷某個元素是否存在於一個「序列」或「集合」中
+        if '-' in user_input: # 檢查輸入是否包含連字符
+            start, end = map(int, user_input.split('-'))  # 將輸入按照'-'拆分為兩個數字
+        else:
+            start, end = 0, int(user_input)  # 如果只有一個數字，就假定從零開始到輸入的數字
+    except ValueError:  # 格式錯誤處理
+        start, end = 0, 20  # 使用默認值
+    return start, end - start  # 計算總股票數
+
+
+def reset_progress(start_idx=0, total_batches=0):
+    """開始新任務前重置停止標誌與進度字典
+    
+    Args:
+        start_idx (int): 起始代號
+        total_batches (int): 總批次數（未知時為 0）
+    """
+    stop_event.clear()  # 重置停止標誌，將標誌設為 False
+    update_progress.update({
+        "start_idx": start_idx,  # 設置起始索引
+        "current_batch": 0,  # 重置當前批次，固定設為 0，表示從第 0 批開始執行
+        "total_batches": total_batches,
+        "codes_per_sec": 0,  # 重置吞吐量
+        "pipeline": [],  # 重置管線統計
+        "job_id": None,  # 任務編號於線程中建立或續接
+        "is_running": True,  # 設置運行標誌，設為 True，表示任務啟動
+    })
+    update_progress["messages"].clear()  # 清空消息隊列（序號繼續遞增，舊游標仍然有效）
+
+
+def run_locked_job(job_id, process, *args):
+    """在背景線程執行流程，結束後記錄任務結果並釋放 scheduler.LOCK（鎖由呼叫端取得）
+    
+    Args:
+        job_id (int): job_queue 任務編號
+        process (callable): 返回 (狀態, 訊息) 的流程函數
+        *args: 傳給流程函數的參數
+    """
+    status, message = 'failed', None
+    try:
+        status, message = process(*args)
+    except Exception as e:
+        message = str(e)
+    finally:
+        update_progress["is_running"] = False
+        scheduler.finish(job_id, status, message)
+        scheduler.LOCK.release()
+
+
+def run_scheduled_update(params, incremental=False):
+    """排程任務：完整或增量更新（排程器已持有鎖）"""
+    start, total_stocks = parse_stock_range(str(params.get("range", "0-10000")))
+    reset_progress(start, (total_stocks + 5 - 1) // 5)
+    return run_update_process(total_stocks, incremental, bool(params.get("resume")),
+                              max(1, int(params.get("shards", UPDATE_SHARDS))))
+
+
+def run_scheduled_export(params):
+    """排程任務：匯出快照"""
+    rows = snapshot_export.export_snapshot(full=bool(params.get("full")), log=update_progress["messages"].append)
+    return 'done', f"快照匯出 {rows} 列"
+
+
+def run_scheduled_backfill(params):
+    """排程任務：歷史回補"""
+    reset_progress()
+    return run_backfill_process(list(params.get("tickers", [])), int(params.get("years", backfill.BACKFILL_YEARS)))
+
+
+def run_scheduled_reload(params):
+    """排程任務：全量重新載入"""
+    reset_progress()
+    return run_reload_process(list(params.get("tickers", [])))
+
+
+scheduler.register_runner('update', run_scheduled_update)
+scheduler.register_runner('incremental', lambda params: run_scheduled_update(params, incremental=True))
+scheduler.register_runner('export', run_scheduled_export)
+scheduler.register_runner('backfill', run_scheduled_backfill)
+scheduler.register_runner('reload', run_scheduled_reload)
+SCHEDULER = scheduler.Scheduler()  # 由 SCHEDULER_ENABLED 決定是否在啟動時執行
+
+
+# 更新線程寫入某支股票後，清除該股票的 API 查詢快取
+bulk_load.add_write_listener(api_cache.CACHE.invalidate_tickers)
+bulk_load.add_write_listener(adjustments.invalidate)  # 只清除有寫入（含新除權息事件）的股票
+
 # 初始化 Flask 應用
 app = Flask(__name__)  # 創建 Flask 應用實例
 
@@ -393,43 +635,32 @@ def update_database():
     Returns:
         Response: JSON 格式的回應，包含操作狀態
     """
-    # 檢查是否已有任務在執行
-    # 當檢測到 update_progress 字典中的 is_running 為 True 時，立即返回錯誤響應，阻止新任務啟動
-    if update_progress["is_running"]:
+    # 檢查是否已有任務在執行：進程內鎖 + PostgreSQL advisory lock，兩個同時到達的請求只有一個能取得
+    # （只檢查 is_running 旗標時，兩個請求可能在旗標設定前都通過檢查）
+    if not scheduler.LOCK.try_acquire():
         return jsonify({"status": "error", "message": "已有更新任務進行中"})
     
     # 解析用戶輸入範圍 (格式: '起始-結束')
     # 前端使用user_input: $('#newInput').val()傳遞參數user_input到後段，這裡用request.form.get取值
     user_input = request.form.get('user_input', '0-20')  # 默認範圍 0-20
-    
+    incremental = request.form.get('incremental') == '1'  # 勾選增量更新時只補抓缺少的交易日
+    resume = request.form.get('resume') == '1'  # 勾選續接時從上次未完成的任務繼續
     try:
-        # in 是一個成員運算符（membership operator），用來判斷某個元素是否存在於一個「序列」或「集合」中
-        if '-' in user_input: # 檢查輸入是否包含連字符
-            start, end = map(int, user_input.split('-'))  # 將輸入按照'-'拆分為兩個數字
-            total_stocks = end - start  # 計算總股票數
-        else:
-            start, end = 0, int(user_input)  # 如果只有一個數字，就假定從零開始到輸入的數字
-            total_stocks = end - start # 計算總股票數
-    except ValueError:  # 格式錯誤處理
-        start, end = 0, 20  # 使用默認值
-        total_stocks = end - start
+        shards = max(1, int(request.form.get('shards', UPDATE_SHARDS)))  # 分片進程數
+    except ValueError:
+        shards = UPDATE_SHARDS
+    start, total_stocks = parse_stock_range(user_input)
     
     # 初始化全局狀態變數
-    stop_event.clear()  # 重置停止標誌，將標誌設為 False
-    update_progress.update({
-        # 如果 user_input 包含 -（如 0-20），則使用 start 變數的值，否則預設為 0
-        "start_idx": start if '-' in user_input else 0,  # 設置起始索引
-        "current_batch": 0,  # 重置當前批次，固定設為 0，表示從第 0 批開始執行
-        # 範例total_stocks = 23 → (23 + 5 - 1) // 5 = 27 // 5 = 5 批次
-        "total_batches": (total_stocks + 5 - 1) // 5,  # 計算總批次數(每批5個)(向上取整)
-        "is_running": True,  # 設置運行標誌，設為 True，表示任務啟動
-        "messages": []  # 清空消息隊列
-    })
+    # 範例total_stocks = 23 → (23 + 5 - 1) // 5 = 27 // 5 = 5 批次
+    reset_progress(start, (total_stocks + 5 - 1) // 5)  # 計算總批次數(每批5個)(向上取整)
+    job_id = scheduler.start_job('incremental' if incremental else 'update', {
+        "range": user_input, "resume": resume, "shards": shards})  # 手動任務也寫入任務記錄
 
-    # 啟動後台更新線程
+    # 啟動後台更新線程（結束時記錄結果並釋放鎖）
     thread = threading.Thread(
-        target=run_update_process,  # 指定執行緒要跑的函數
-        args=(total_stocks,)  # 傳入參數（注意單參數需加逗號 ,）避免被當成數學計算的括號，而不是元組
+        target=run_locked_job,  # 指定執行緒要跑的函數
+        args=(job_id, run_update_process, total_stocks, incremental, resume, shards)  # 傳入參數（股票總數, 是否增量更新, 是否續接, 分片數）
     )
     # thread.start() 會讓 run_update_process 函數在獨立執行緒中運行，不阻塞主程式
     thread.start()  # 啟動線程
@@ -439,6 +670,61 @@ def update_database():
         "message": "批次更新已啟動"
     })
 
+@app.route('/backfill', methods=['POST'])
+def start_backfill():
+    """啟動歷史回補流程的 API 端點（進度沿用 /update_progress 與 /update_events）
+    
+    表單欄位 tickers 為以逗號或空白分隔的股票代號（留空表示 stock_codes 中的全部股票），
+    years 為回補年數。
+    
+    Returns:
+        Response: JSON 格式的回應，包含操作狀態
+    """
+    if not scheduler.LOCK.try_acquire(): # 與更新流程共用同一把鎖
+        return jsonify({"status": "error", "message": "已有更新任務進行中"})
+    
+    tickers = request.form.get('tickers', '').replace(',', ' ').split() # 例如 "2330.TW, 2317.TW"
+    try:
+        years = max(1, int(request.form.get('years', backfill.BACKFILL_YEARS)))
+    except ValueError:
+        years = backfill.BACKFILL_YEARS
+    
+    reset_progress()  # 區段數在比對資料庫後才知道
+    job_id = scheduler.start_job('backfill', {"tickers": tickers, "years": years})
+    
+    thread = threading.Thread(target=run_locked_job, args=(job_id, run_backfill_process, tickers, years))
+    thread.start()
+    
+    return jsonify({
+        "status": "started",
+        "message": "歷史回補已啟動"
+    })
+
+@app.route('/reload_database', methods=['POST'])
+def reload_database():
+    """啟動全量重新載入的 API 端點（取代「刪除資料庫 + 更新」，載入期間查詢不中斷）
+    
+    表單欄位 tickers 為以逗號或空白分隔的股票代號（留空表示目前資料庫中的全部股票），
+    只重新載入部分股票時，其他股票的數據在切換時保留。
+    
+    Returns:
+        Response: JSON 格式的回應，包含操作狀態
+    """
+    if not scheduler.LOCK.try_acquire(): # 與更新流程共用同一把鎖
+        return jsonify({"status": "error", "message": "已有更新任務進行中"})
+    
+    tickers = request.form.get('tickers', '').replace(',', ' ').split()
+    reset_progress()  # 股票數在讀取資料庫後才知道
+    job_id = scheduler.start_job('reload', {"tickers": tickers})
+    
+    thread = threading.Thread(target=run_locked_job, args=(job_id, run_reload_process, tickers))
+    thread.start()
+    
+    return jsonify({
+        "status": "started",
+        "message": "重新載入已啟動"
+    })
+
 @app.route('/check_database', methods=['POST'])
 def check_database():
     """資料庫狀態檢查 API
@@ -457,27 +743,132 @@ def check_database():
                 f"最後加入股票代號: {last_stock['code']}",
                 f"最後資料日期: {last_stock['date'].strftime('%Y-%m-%d')}",  # 格式化日期
                 f"距今天數: {last_stock['days']} 天",
-                "檢查完成"
             ])
+            try:
+                status = db_status.get_status()  # 只讀摘要表，不掃描 stock_data
+                output.extend([
+                    f"股票數: {status['tickers']}，資料列數: {status['rows']}",
+                    f"超過 {db_status.STALE_DAYS} 天未更新的股票: {status['stale_count']} 支",
+                ])
+                if status['legacy_tickers']: # 舊版保存的調整後價格，需重新載入才能套用除權息因子
+                    output.append(f"需重新載入的舊版價格股票: {status['legacy_tickers']} 支")
+            except Exception as e:
+                print(f"讀取資料庫狀態異常: {e}")
+            output.append("檢查完成")
         else:
             output.append("無法取得最後加入的股票資料")
 
     return jsonify({"messages": output})
 
+@app.route('/database_status', methods=['GET'])
+def database_status():
+    """資料庫狀態 API（股票數、列數、日期範圍、過期股票、各表大小）
+    
+    只讀取 stock_summary 與 pg_class 統計值，成本不隨 stock_data 大小增加。
+    查詢參數 detail=1 時附上每支股票的列數與日期範圍；stale_days 覆蓋過期門檻天數。
+    
+    Returns:
+        Response: 狀態 JSON，查詢失敗時返回 500
+    """
+    detail = request.args.get('detail', '').lower() in ('1', 'true', 'on')
+    stale_days = request.args.get('stale_days', default=db_status.STALE_DAYS, type=int)
+    try:
+        status = db_status.get_status(detail=detail, stale_days=stale_days)
+    except Exception as e:
+        print(f"讀取資料庫狀態異常: {e}")
+        return jsonify({"error": "讀取資料庫狀態失敗"}), 500
+    return jsonify(status)
+
+@app.route('/screen', methods=['GET'])
+def screen_stocks():
+    """全市場選股 API（以每支股票最新一根 K 棒篩選並排序）
+    
+    查詢參數:
+        filter: 篩選條件，例如 change_pct > 5 and vol_ratio >= 3 and close > sma_20
+        sort: 排序欄位（預設 change_pct），order=asc 時由小到大
+        limit: 返回筆數（預設 50）
+        fields: 以逗號分隔的輸出欄位，預設為全部
+    
+    Returns:
+        Response: {"as_of", "universe", "matched", "results", "elapsed_ms"}，條件不合法時返回 400
+    """
+    start = time.perf_counter()
+    fields = [name.strip() for name in request.args.get('fields', '').split(',') if name.strip()]
+    try:
+        result = screener.screen(request.args.get('filter'), request.args.get('sort', 'change_pct'),
+                                 request.args.get('order', 'desc').lower() != 'asc',
+                                 request.args.get('limit', default=screener.SCREEN_LIMIT, type=int), fields)
+    except ValueError as e:
+        return jsonify({"error": str(e), "columns": screener.SCREEN_COLUMNS}), 400
+    except Exception as e:
+        print(f"選股查詢異常: {e}")
+        return jsonify({"error": "選股查詢失敗"}), 500
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return jsonify(result)
+
 @app.route('/update_progress', methods=['GET'])
 def get_update_progress():
     """進度查詢 API
     
+    查詢參數 after=<序號> 時只返回該序號之後的訊息（每次最多 EVENT_PAGE_SIZE 筆），
+    未帶 after 時返回最近的訊息。
+    
     Returns:
         Response: 包含當前進度信息的 JSON 回應
     """
+    after = request.args.get('after', type=int) # 客戶端最後看到的訊息序號
+    events, last_seq = update_progress["messages"].since(after)
+    if events: # 一頁沒取完時，下次從這頁最後一筆繼續
+        last_seq = events[-1][0]
     return jsonify({
         "current": update_progress["current_batch"],  # 當前批次序號
         "total": update_progress["total_batches"],  # 總批次數
         "is_running": update_progress["is_running"],  # 運行狀態
-        "messages": update_progress["messages"]  # 操作日誌
+        "codes_per_sec": update_progress["codes_per_sec"],  # 代號檢查吞吐量
+        "pipeline": update_progress["pipeline"],  # 各階段吞吐量與佇列深度
+        "job_id": update_progress["job_id"],  # 目前的更新任務編號
+        "messages": [message for _, message in events],  # 操作日誌（只含新事件）
+        "last_seq": last_seq  # 下次查詢帶上 after=last_seq
     })
 
+@app.route('/update_events', methods=['GET'])
+def update_events():
+    """進度事件串流 API（Server-Sent Events）
+    
+    每個日誌事件以 message 事件送出（id 為序號，斷線重連時瀏覽器會帶上 Last-Event-ID），
+    進度每秒以 progress 事件送出，任務結束後送出 done 事件並關閉串流。
+    
+    Returns:
+        Response: text/event-stream 串流
+    """
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        after = 0
+
+    def stream():
+        nonlocal after
+        while True:
+            running = update_progress["is_running"] # 先記錄狀態，確保結束前的最後訊息都已送出
+            events, _ = update_progress["messages"].since(after, limit=None)
+            for seq, message in events:
+                yield f"id: {seq}\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+                after = seq
+            progress = {
+                "current": update_progress["current_batch"],
+                "total": update_progress["total_batches"],
+                "codes_per_sec": update_progress["codes_per_sec"],
+                "pipeline": update_progress["pipeline"],
+            }
+            yield f"event: progress\ndata: {json.dumps(progress, ensure_ascii=False)}\n\n"
+            if not running:
+                yield "event: done\ndata: {}\n\n"
+                return
+            update_progress["messages"].wait(after, timeout=1) # 有新事件時立即送出，否則每秒送一次進度
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/stop_update', methods=['POST'])
 def stop_update():
     """停止更新 API
@@ -491,6 +882,99 @@ def stop_update():
         "message": "已發送停止信號"
     })
 
+@app.route('/pool_stats', methods=['GET'])
+def get_pool_stats():
+    """連接池統計 API（監控用）
+    
+    Returns:
+        Response: 包含使用中/閒置/已建立連接數及等待次數的 JSON 回應
+    """
+    return jsonify(db_pool.pool_stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 指標 API
+
+    包含各管線階段、代號檢查、批次下載與資料庫操作的延遲直方圖與計數器，
+    以及連接池與更新任務狀態。
+
+    Returns:
+        Response: Prometheus 文字格式 (text/plain; version=0.0.4)
+    """
+    metrics.UPDATE_RUNNING.set(1 if update_progress["is_running"] else 0)
+    stats = db_pool.pool_stats()
+    for state in ("in_use", "idle"):
+        metrics.POOL_CONNECTIONS.set(stats[state], state=state)
+    for event in ("created", "discarded", "checkouts", "waits", "wait_seconds", "healthcheck_failures"):
+        metrics.POOL_EVENTS.set(stats[event], event=event)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/stock/<ticker>', methods=['GET'])
+def api_stock(ticker):
+    """股票歷史數據查詢 API
+    
+    查詢參數：
+    - start: 起始日期 (YYYY-MM-DD)，可省略
+    - end: 結束日期 (YYYY-MM-DD)，可省略
+    - fields: 逗號分隔的欄位，例如 close,volume，預設為全部 OHLCV
+    - interval: K 棒週期 1d / 1w / 2w / 1mo / 3mo / 1y，預設 1d；週線以上讀取彙總表，
+      dates 為週期起始日
+    - adjusted: 1 表示返回除權息調整後的價格（資料庫只保存原始價格，讀取時計算）
+    
+    相同查詢的結果保存在 LRU 快取中，以 stock_summary 的最後寫入時間作為版本，
+    任何進程或實例寫入該股票後即失效；回應帶有 ETag/Last-Modified，客戶端重複請求未變更的資料時返回 304。
+    
+    Returns:
+        Response: 以欄位為單位的 JSON（dates 與各欄位數值陣列）
+    """
+    start = request.args.get('start') or None
+    end = request.args.get('end') or None
+    fields = tuple(f.strip() for f in request.args.get('fields', '').split(',') if f.strip()) \
+        or tuple(read_db_tables.PRICE_COLUMNS)
+    interval = request.args.get('interval', '1d')
+    adjusted = request.args.get('adjusted', '').lower() in ('1', 'true', 'on')
+    
+    # 驗證參數，錯誤時返回 400
+    try:
+        for value in (start, end):
+            if value:
+                datetime.strptime(value, '%Y-%m-%d')
+        invalid = set(fields) - set(read_db_tables.PRICE_COLUMNS)
+        if invalid:
+            raise ValueError(f"不支援的欄位: {', '.join(sorted(invalid))}")
+        if interval not in rollups.INTERVALS:
+            raise ValueError(f"不支援的週期: {interval}（可用: {', '.join(rollups.INTERVALS)}）")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    key = (ticker, start, end, fields, interval, adjusted) # 快取鍵，第一個元素必須是股票代號
+    version = db_status.data_version(ticker) # 主鍵查詢，先於數據讀取：查詢期間有寫入時下次不會命中
+    cached = api_cache.CACHE.get(key, version)
+    if cached is None: # 快取未命中才查詢資料庫
+        if interval != '1d' or adjusted:
+            db_schema.ensure_schema() # 舊資料庫首次查詢時建立彙總表與因子表
+        data = rollups.read_bars(ticker, start, end, interval, list(fields), adjusted)
+        payload = {
+            "ticker": ticker,
+            "interval": interval,
+            "adjusted": adjusted,
+            "dates": data.index.strftime('%Y-%m-%d').tolist() if not data.empty else [],
+        }
+        for field in fields:
+            # NaN 不是合法的 JSON，以 null 表示
+            payload[field] = [None if pd.isna(value) else value for value in data[field].tolist()] \
+                if not data.empty else []
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        cached = (body, api_cache.make_etag(body))
+        api_cache.CACHE.put(key, cached, version)
+
+    body, etag = cached
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.last_modified = api_cache.CACHE.last_modified(ticker, version)
+    response.cache_control.no_cache = True # 客戶端每次需重新驗證，未變更時得到 304
+    return response.make_conditional(request)
+
 @app.route('/delete_database', methods=['POST'])
 def delete_database():
     """資料庫刪除 API
@@ -498,10 +982,67 @@ def delete_database():
     Returns:
         Response: 操作結果 JSON 回應
     """
-    drop_db_tables.drop_all_tables()  # 調用刪除表函數
+    if not scheduler.LOCK.try_acquire(): # 更新進行中刪除資料表會讓寫入失敗
+        return jsonify({"messages": ["已有更新任務進行中，無法刪除資料庫"]})
+    try:
+        drop_db_tables.drop_all_tables()  # 調用刪除表函數
+    finally:
+        scheduler.LOCK.release()
+    api_cache.CACHE.clear()  # 資料已刪除，清空查詢快取
+    adjustments.clear()
     return jsonify({"messages": ["資料庫已刪除"]})
 
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """任務記錄 API（排程與手動任務的狀態、開始/結束時間與耗時）
+    
+    查詢參數 limit（預設 50）、status、kind 可篩選。
+    
+    Returns:
+        Response: {"jobs": [...], "running": 本進程是否持有任務鎖}
+    """
+    limit = min(request.args.get('limit', default=50, type=int), 500)
+    try:
+        jobs = scheduler.history(limit, request.args.get('status'), request.args.get('kind'))
+    except Exception as e:
+        print(f"讀取任務記錄異常: {e}")
+        return jsonify({"error": "讀取任務記錄失敗"}), 500
+    return jsonify({"jobs": jobs, "running": scheduler.LOCK.locked()})
+
+@app.route('/jobs', methods=['POST'])
+def add_job():
+    """新增任務到佇列，由排程器依優先度執行
+    
+    表單欄位: kind（update / incremental / export / backfill / reload）、priority、off_peak（1=只在離峰時段執行）、
+    params（JSON 字串，例如 {"range": "0-20"}）
+    
+    Returns:
+        Response: 新增的任務編號，參數錯誤時返回 400
+    """
+    try:
+        params = json.loads(request.form.get('params') or '{}')
+        job_id = scheduler.enqueue(request.form.get('kind', ''), params,
+                                   int(request.form.get('priority', 0)), request.form.get('off_peak') == '1')
+    except ValueError as e: # JSONDecodeError 也是 ValueError
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "queued", "job_id": job_id})
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """取消等待中的任務"""
+    if scheduler.cancel(job_id):
+        return jsonify({"status": "cancelled", "job_id": job_id})
+    return jsonify({"status": "error", "message": "任務不存在或已開始執行"}), 409
+
+@app.route('/schedules', methods=['GET'])
+def list_schedules():
+    """排程定義與下一次執行時間"""
+    return jsonify({"schedules": scheduler.schedule_info(), "enabled": SCHEDULER.thread is not None,
+                    "off_peak": scheduler.SCHEDULER_OFF_PEAK})
+
 if __name__ == "__main__":
+    if scheduler.SCHEDULER_ENABLED: # 啟動排程線程（多個實例同時啟動時由 advisory lock 互斥）
+        SCHEDULER.start()
     # 啟動 Flask 開發服務器
     app.run(
         host='0.0.0.0',  # 監聽所有網絡接口
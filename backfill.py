@@ -0,0 +1,227 @@
+"""長區間歷史數據回補
+
+把 (年份, 一組股票) 當作一個區段，多個區段以線程池並行下載，所有線程共用同一個令牌桶限速；
+下載結果經 bulk_load.iter_row_chunks 分段以 COPY 寫入。已完整存在於 stock_data 的 (股票, 年份)，
+以及先前回補過的完整年份（記錄在 backfill_ranges）都不會再下載；下載結果為空的年份（上市前，
+或是被限流時的空回應）只在 BACKFILL_EMPTY_TTL_DAYS 天內略過，之後重新確認。
+同一股票可能同時由多個年份區段寫入，摘要與彙總的重算由 bulk_load.save_rows 的股票鎖依序進行。
+
+用法: python backfill.py [年數] [股票代號 ...]（未指定代號時回補 stock_codes 中的全部股票）
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+# 加載 .env 文件中的環境變數
+load_dotenv()
+
+import batch_download
+import bulk_load
+import db_pool
+import db_schema
+import metrics
+import validate_codes
+
+# 回補設定（可由 .env 覆蓋）
+BACKFILL_YEARS = int(os.getenv('BACKFILL_YEARS', 20))  # 預設回補的年數（含今年）
+BACKFILL_WORKERS = int(os.getenv('BACKFILL_WORKERS', 4))  # 同時下載的區段數
+BACKFILL_RATE = float(os.getenv('BACKFILL_RATE', 2.0))  # 所有線程合計每秒下載請求數
+BACKFILL_GROUP = int(os.getenv('BACKFILL_GROUP', 50))  # 每個區段的股票數（一次批次請求）
+BACKFILL_EMPTY_TTL_DAYS = int(os.getenv('BACKFILL_EMPTY_TTL_DAYS', 30))  # 空結果的 (股票, 年份) 多久後重新下載
+COVERAGE_SLACK_DAYS = 7  # 資料涵蓋到距年初/年底 7 天內即視為完整（年初、年底的休市日）
+
+
+def year_ranges(years, today=None):
+    """由今年往前 years 年的日期區間（新的年份在前，先補最常用的近期數據）
+
+    Args:
+        years (int): 年數（含今年）
+        today (date): 今天日期，預設為系統日期
+
+    Returns:
+        list: [(年份, 起始 datetime, 結束 datetime)]，結束日不含（與 yfinance 相同），今年只到明天
+    """
+    today = today or date.today()
+    ranges = []
+    for year in range(today.year, today.year - years, -1):
+        end = min(date(year + 1, 1, 1), today + timedelta(days=1))
+        ranges.append((year, datetime(year, 1, 1), datetime.combine(end, datetime.min.time())))
+    return ranges
+
+
+@metrics.timed(metrics.DB_SECONDS, op='backfill_completed')
+def completed_ranges(tickers, ranges, empty_ttl_days=BACKFILL_EMPTY_TTL_DAYS):
+    """已不需下載的 (股票, 年份)
+
+    Args:
+        tickers (list): 股票代號列表
+        ranges (list): year_ranges 的回傳結果
+        empty_ttl_days (int): 空結果的記錄在幾天內有效
+
+    Returns:
+        set: {(股票代號, 年份)}，包含 backfill_ranges 的記錄（空結果只含未過期者），
+             以及 stock_data 已涵蓋整年的組合
+    """
+    bounds = {year: (start.date(), end.date() - timedelta(days=1)) for year, start, end in ranges}
+    earliest = datetime.combine(min(start for start, _ in bounds.values()), datetime.min.time())
+    slack = timedelta(days=COVERAGE_SLACK_DAYS)
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            SELECT ticker, year FROM backfill_ranges
+            WHERE ticker = ANY(%s) AND year >= %s AND (NOT empty OR fetched_at > now() - make_interval(days => %s))
+            """, (list(tickers), earliest.year, empty_ttl_days))
+            done = set(cur.fetchall())
+            # 年份分區下每年只掃描對應分區的主鍵範圍
+            cur.execute("""
+            SELECT ticker, EXTRACT(YEAR FROM date)::int, MIN(date), MAX(date) FROM stock_data
+            WHERE ticker = ANY(%s) AND date >= %s GROUP BY 1, 2
+            """, (list(tickers), earliest))
+            for ticker, year, first, last in cur.fetchall():
+                start, end = bounds.get(year, (None, None))
+                if start and first <= start + slack and last >= end - slack:
+                    done.add((ticker, year))
+        conn.commit()
+    return done
+
+
+def plan_units(tickers, ranges, done, group=BACKFILL_GROUP):
+    """把尚未完成的 (股票, 年份) 依年份分組為下載區段
+
+    Returns:
+        list: [(年份, 起始, 結束, [股票代號])]
+    """
+    units = []
+    for year, start, end in ranges:
+        missing = [ticker for ticker in tickers if (ticker, year) not in done]
+        for i in range(0, len(missing), group):
+            units.append((year, start, end, missing[i:i + group]))
+    return units
+
+
+def mark_ranges(cur, year, tickers, empty=()):
+    """記錄已回補完成的 (股票, 年份)；今年的數據還會增加，不記錄（之後依 stock_data 涵蓋範圍判斷）
+
+    Args:
+        cur: psycopg2 游標
+        year (int): 年份
+        tickers (list): 股票代號列表
+        empty (set): 其中下載結果為空的股票（只在 BACKFILL_EMPTY_TTL_DAYS 內視為完成）
+    """
+    if not tickers or year >= date.today().year:
+        return
+    execute_values(cur, """
+    INSERT INTO backfill_ranges (ticker, year, empty) VALUES %s
+    ON CONFLICT (ticker, year) DO UPDATE SET fetched_at = now(), empty = EXCLUDED.empty
+    """, [(ticker, year, ticker in empty) for ticker in tickers])
+
+
+@metrics.timed(metrics.STAGE_SECONDS, stage='backfill')
+def run_unit(unit, bucket=None, stop_event=None, log=None):
+    """下載並寫入一個區段
+
+    Args:
+        unit (tuple): plan_units 的一個項目
+        bucket (validate_codes.TokenBucket): 共用限速器
+        stop_event (threading.Event): 停止信號
+        log (callable): 訊息輸出函數
+
+    Returns:
+        tuple: (寫入的資料列數, 下載失敗的股票數)；失敗的股票不記錄，下次回補會重試
+    """
+    year, start, end, tickers = unit
+    failed = set()
+    frames = batch_download.iter_stock_data_batches(
+        tickers, start_date=start, end_date=end,
+        retry_empty=False,  # 整組都還沒上市時結果為空，屬正常情況
+        stop_event=stop_event, log=log, bucket=bucket, on_failure=failed.update)
+    written = 0
+    for rows, finished in bulk_load.iter_row_chunks(frames):
+        finished = [ticker for ticker in finished if ticker not in failed]
+        empty = set(finished) - set(rows['ticker'])  # 空結果可能是限流，記錄有期限
+        if rows.empty: # 沒有數據的年份也記錄，期限內不再下載
+            with db_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    mark_ranges(cur, year, finished, empty)
+                conn.commit()
+            continue
+        # 回補記錄與數據同一事務提交
+        written += bulk_load.save_rows(rows, ensure_codes=True,
+                                       before_commit=lambda cur: mark_ranges(cur, year, finished, empty))
+    return written, len(failed)
+
+
+@metrics.timed(metrics.DB_SECONDS, op='backfill_tickers')
+def load_tickers():
+    """stock_codes 中的全部股票代號（預設的回補範圍）"""
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT ticker FROM stock_codes ORDER BY ticker")
+            tickers = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    return tickers
+
+
+def run_backfill(tickers, years=BACKFILL_YEARS, workers=BACKFILL_WORKERS, rate=BACKFILL_RATE,
+                 stop_event=None, log=None, on_progress=None):
+    """回補多支股票多年的歷史數據
+
+    Args:
+        tickers (list): 股票代號列表
+        years (int): 回補年數（含今年）
+        workers (int): 同時下載的區段數
+        rate (float): 所有線程合計每秒下載請求數
+        stop_event (threading.Event): 停止信號，設置後未開始的區段直接結束
+        log (callable): 訊息輸出函數
+        on_progress (callable): 每完成一個區段以目前統計呼叫一次
+
+    Returns:
+        dict: {"units", "done", "rows", "failed", "skipped", "tickers_per_sec", "stopped"}
+    """
+    log = log or print
+    stop_event = stop_event or threading.Event()
+    db_schema.ensure_schema()  # backfill_ranges 表由結構遷移建立
+
+    ranges = year_ranges(years)
+    units = plan_units(tickers, ranges, completed_ranges(tickers, ranges))
+    skipped = len(tickers) * len(ranges) - sum(len(unit[3]) for unit in units)
+    log(f"回補 {len(tickers)} 支股票 {years} 年: {len(units)} 個區段，略過已存在的 {skipped} 個 (股票, 年份)")
+
+    summary = {"units": len(units), "done": 0, "rows": 0, "failed": 0, "skipped": skipped,
+               "tickers_per_sec": 0, "stopped": False}
+    bucket = validate_codes.TokenBucket(rate)
+    begin, processed = time.monotonic(), 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(run_unit, unit, bucket, stop_event, log): unit for unit in units}
+        for future in as_completed(futures):
+            year, _, _, unit_tickers = futures[future]
+            try:
+                rows, failed = future.result()
+            except Exception as e:
+                log(f"{year} 年區段失敗: {e}")
+                rows, failed = 0, len(unit_tickers)
+            summary["rows"] += rows
+            if stop_event.is_set():
+                continue  # 停止後的區段沒有下載完，不計入進度
+            processed += len(unit_tickers)
+            summary["done"] += 1
+            summary["failed"] += failed
+            summary["tickers_per_sec"] = round(processed / max(time.monotonic() - begin, 1e-9), 2)
+            log(f"{year} 年 {len(unit_tickers)} 支股票完成，寫入 {rows} 列 ({summary['done']}/{summary['units']})")
+            if on_progress:
+                on_progress(dict(summary))
+    summary["stopped"] = stop_event.is_set()
+    return summary
+
+
+if __name__ == "__main__":
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else BACKFILL_YEARS
+    tickers = sys.argv[2:] or load_tickers()
+    result = run_backfill(tickers, years)
+    print(f"完成 {result['done']}/{result['units']} 個區段，寫入 {result['rows']} 列，"
+          f"失敗 {result['failed']} 支，略過 {result['skipped']} 個 (股票, 年份)")
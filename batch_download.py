@@ -0,0 +1,203 @@
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import data_sources
+import metrics
+
+HISTORY_DAYS = 180  # 預設抓取近 180 天歷史數據
+
+
+def download_chunk(tickers, start_date, end_date, downloader=None):
+    """以一次請求下載多支股票的歷史數據
+
+    Args:
+        tickers (list): 股票代號列表
+        start_date (datetime): 起始日期
+        end_date (datetime): 結束日期
+        downloader (callable): 與 yf.download 相同簽名的下載函數，預設使用 data_sources 設定的資料來源
+
+    Returns:
+        pd.DataFrame: 欄位為 (欄位名稱, 股票代號) 的寬表
+    """
+    tickers = list(tickers)
+    start = time.perf_counter()
+    try:
+        if downloader is None:
+            wide = data_sources.get_source().download(tickers, start_date, end_date)
+        else:
+            wide = downloader(
+                tickers,
+                start=start_date,
+                end=end_date,
+                group_by='column',  # 欄位第一層為 Open/High/...，第二層為股票代號
+                progress=False,     # 關閉進度列輸出
+                threads=True        # 由 yfinance 內部並行下載同一批次
+            )
+    except Exception:
+        metrics.DOWNLOAD_REQUESTS.inc(result='error')
+        raise
+    per_ticker = (time.perf_counter() - start) / max(len(tickers), 1)
+    for _ in tickers:  # 一次請求的耗時平均分給每支股票
+        metrics.DOWNLOAD_SECONDS.observe(per_ticker)
+    metrics.DOWNLOAD_REQUESTS.inc(result='ok')
+    metrics.TICKERS_DOWNLOADED.inc(len(tickers))
+    return wide
+
+
+def split_batch_frame(wide, tickers):
+    """將多股票寬表拆回單支股票的 DataFrame
+
+    拆出的 DataFrame 欄位維持 (欄位名稱, 股票代號) 的 MultiIndex，
+    與單支 yf.download 的回傳格式一致，可直接交給 save_stock_data_to_postgresql。
+
+    Args:
+        wide (pd.DataFrame): download_chunk 的回傳結果
+        tickers (list): 此批次的股票代號
+
+    Returns:
+        dict: {股票代號: pd.DataFrame}，無數據的代號對應空的 DataFrame
+    """
+    if wide is None or wide.empty:
+        return {ticker: pd.DataFrame() for ticker in tickers}
+
+    # 單支股票且欄位沒有代號層級時，補上代號層級
+    if not isinstance(wide.columns, pd.MultiIndex):
+        wide = pd.concat({tickers[0]: wide}, axis=1).swaplevel(0, 1, axis=1)
+
+    # 判斷代號位於哪一層（group_by='ticker' 時代號在第 0 層）
+    ticker_level = 1 if set(tickers) & set(wide.columns.get_level_values(1)) else 0
+    available = set(wide.columns.get_level_values(ticker_level))
+
+    frames = {}
+    for ticker in tickers:
+        if ticker not in available:
+            frames[ticker] = pd.DataFrame()
+            continue
+        frame = wide.xs(ticker, axis=1, level=ticker_level, drop_level=False)
+        if ticker_level == 0:
+            frame = frame.swaplevel(0, 1, axis=1)
+        # 多股票對齊日期時會產生整列 NaN，在此移除
+        frames[ticker] = frame.dropna(how='all')
+    return frames
+
+
+def iter_stock_data_batches(tickers, start_date=None, end_date=None, downloader=None,
+                            chunk_size=20, min_chunk_size=1, max_chunk_size=50,
+                            grow_step=5, max_retries=3, backoff=1.0, max_backoff=60.0,
+                            retry_empty=True, stop_event=None, log=None, sleep=None,
+                            bucket=None, on_failure=None):
+    """分批下載股票歷史數據，逐支產出 (股票代號, DataFrame)
+
+    批次大小採「成功逐步放大、失敗減半」的方式自動調整，
+    失敗時以指數退避等待後重試，取代固定的 time.sleep。
+
+    Args:
+        tickers (list): 股票代號列表
+        start_date (datetime): 起始日期，預設為 end_date 前 HISTORY_DAYS 天
+        end_date (datetime): 結束日期，預設為現在
+        downloader (callable): 與 yf.download 相同簽名的下載函數，預設使用 data_sources 設定的資料來源
+        chunk_size (int): 初始批次大小
+        min_chunk_size (int): 批次大小下限
+        max_chunk_size (int): 批次大小上限
+        grow_step (int): 每次成功後批次大小的增加量
+        max_retries (int): 同一批次的最大重試次數，超過則放棄該批次
+        backoff (float): 第一次重試前的等待秒數，之後每次加倍
+        max_backoff (float): 單次等待秒數上限
+        retry_empty (bool): 整批結果為空時是否視為失敗重試（增量更新時空結果屬正常情況）
+        stop_event (threading.Event): 停止信號，設置後在下一批次前結束
+        log (callable): 訊息輸出函數，例如 update_progress["messages"].append
+        sleep (callable): 等待函數，預設使用 stop_event.wait 或 time.sleep
+        bucket (validate_codes.TokenBucket): 共用限速器，每次下載請求前取得一個令牌（多線程共用請求速率）
+        on_failure (callable): 放棄批次時以該批代號列表呼叫，用來區分「下載失敗」與「沒有數據」
+
+    Yields:
+        tuple: (股票代號, pd.DataFrame)，下載失敗的代號產出空的 DataFrame
+    """
+    log = log or print
+    end_date = end_date or datetime.now()
+    start_date = start_date or end_date - timedelta(days=HISTORY_DAYS)
+
+    if sleep is None:
+        # 有停止信號時用 wait 等待，收到信號可立即醒來
+        sleep = stop_event.wait if stop_event is not None else time.sleep
+
+    pending = list(tickers)
+    pos = 0  # 下一批次的起始位置
+    size = max(min_chunk_size, min(chunk_size, max_chunk_size))  # 目前批次大小
+    failures = 0  # 目前批次連續失敗次數
+
+    while pos < len(pending):
+        if stop_event is not None and stop_event.is_set():
+            return
+
+        chunk = pending[pos:pos + size]
+        if bucket is not None and not bucket.acquire(stop_event):
+            return  # 等待令牌時收到停止信號
+        try:
+            wide = download_chunk(chunk, start_date, end_date, downloader)
+            if retry_empty and (wide is None or wide.empty):
+                raise ValueError("批次下載結果為空")
+        except Exception as e:
+            failures += 1
+            if failures > max_retries:
+                # 超過重試次數，放棄此批次並繼續下一批
+                log(f"批次下載失敗，略過 {len(chunk)} 支股票: {e}")
+                if on_failure is not None:
+                    on_failure(chunk)
+                for ticker in chunk:
+                    yield ticker, pd.DataFrame()
+                pos += len(chunk)
+                failures = 0
+                continue
+
+            wait = min(backoff * 2 ** (failures - 1), max_backoff)  # 指數退避
+            size = max(min_chunk_size, size // 2)  # 失敗時批次減半
+            log(f"批次下載失敗 ({e})，{wait:.1f} 秒後以每批 {size} 支重試")
+            sleep(wait)
+            continue
+
+        failures = 0
+        frames = split_batch_frame(wide, chunk)
+        for ticker in chunk:
+            yield ticker, frames[ticker]
+        pos += len(chunk)
+        size = min(max_chunk_size, size + grow_step)  # 成功後逐步放大批次
+
+
+def iter_incremental_batches(tickers, latest_dates, end_date=None, **kwargs):
+    """只下載每支股票資料庫中最新日期之後的數據
+
+    以各股票的起始日期分組，同一組共用一次批次下載；
+    資料庫中沒有記錄的股票從 end_date 前 HISTORY_DAYS 天開始。
+
+    Args:
+        tickers (list): 股票代號列表
+        latest_dates (dict): {股票代號: 資料庫中最新的交易日期 (date)}
+        end_date (datetime): 結束日期，預設為現在
+        **kwargs: 其餘參數傳給 iter_stock_data_batches
+
+    Yields:
+        tuple: (股票代號, pd.DataFrame)，已是最新的股票不會產出
+    """
+    end_date = end_date or datetime.now()
+    default_start = end_date - timedelta(days=HISTORY_DAYS)
+
+    groups = {}  # 起始日期 -> 股票代號列表
+    for ticker in tickers:
+        latest = latest_dates.get(ticker)
+        if latest is None:
+            start = default_start
+        else:
+            start = datetime.combine(latest + timedelta(days=1), datetime.min.time())
+            if start.date() >= end_date.date():
+                continue  # 已有最新數據，不需下載
+        groups.setdefault(start, []).append(ticker)
+
+    stop_event = kwargs.get('stop_event')
+    for start in sorted(groups):
+        if stop_event is not None and stop_event.is_set():
+            return
+        yield from iter_stock_data_batches(groups[start], start_date=start, end_date=end_date,
+                                           retry_empty=False, **kwargs)
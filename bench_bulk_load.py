@@ -0,0 +1,109 @@
+"""比較 stock_data 寫入方式的效能（rows/sec）
+
+使用 .env 中的資料庫設定（建議指向本機 PostgreSQL），在暫存表 bench_stock_data 上
+依序測試：逐列 INSERT（原本的寫法）、execute_values、COPY FROM STDIN。
+
+用法: python bench_bulk_load.py [股票數] [每支天數]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import bulk_load
+import db_pool
+
+BENCH_TABLE = 'bench_stock_data'
+
+
+def make_frames(n_tickers, n_days, seed=0):
+    """產生與 yf.download 相同格式（MultiIndex 欄位）的假數據"""
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=n_days, name='Date')
+    frames = []
+    for i in range(n_tickers):
+        ticker = f"{i:04d}.TW"
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_days)))
+        values = {
+            'Close': close,
+            'High': close * 1.01,
+            'Low': close * 0.99,
+            'Open': close * (1 + rng.normal(0, 0.003, n_days)),
+            'Volume': rng.integers(1_000, 5_000_000, n_days).astype('float64'),
+        }
+        data = pd.DataFrame(values, index=index)
+        data.columns = pd.MultiIndex.from_product([data.columns, [ticker]], names=['Price', 'Ticker'])
+        frames.append((ticker, data))
+    return frames
+
+
+def insert_row_by_row(cursor, frames):
+    """原本 save_stock_data_to_postgresql 的逐列 INSERT 寫法"""
+    for ticker, data in frames:
+        for index, row in data.iterrows():
+            cursor.execute(f"""
+            INSERT INTO {BENCH_TABLE} (date, open, high, low, close, volume, ticker)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (
+                index.date(),
+                float(row['Open'].iloc[0]),
+                float(row['High'].iloc[0]),
+                float(row['Low'].iloc[0]),
+                float(row['Close'].iloc[0]),
+                int(row['Volume'].iloc[0]),
+                ticker
+            ))
+
+
+def insert_execute_values(cursor, frames):
+    rows = pd.concat([bulk_load.frame_to_rows(data, ticker) for ticker, data in frames])
+    bulk_load.insert_rows(cursor, rows, BENCH_TABLE)
+
+
+def insert_copy(cursor, frames):
+    rows = pd.concat([bulk_load.frame_to_rows(data, ticker) for ticker, data in frames])
+    bulk_load.copy_rows(cursor, rows, BENCH_TABLE)
+
+
+def main():
+    n_tickers = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 120
+    frames = make_frames(n_tickers, n_days)
+    total_rows = n_tickers * n_days
+
+    conn = db_pool.connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {BENCH_TABLE} (
+                id SERIAL PRIMARY KEY,
+                date DATE, open FLOAT, high FLOAT, low FLOAT, close FLOAT,
+                volume BIGINT, ticker VARCHAR(10)
+            )
+            """)
+            conn.commit()
+
+            print(f"{n_tickers} 支股票 x {n_days} 天 = {total_rows} 列")
+            baseline = None
+            for name, method in [('逐列 INSERT', insert_row_by_row),
+                                 ('execute_values', insert_execute_values),
+                                 ('COPY', insert_copy)]:
+                cur.execute(f"TRUNCATE {BENCH_TABLE}")
+                conn.commit()
+                start = time.perf_counter()
+                method(cur, frames)
+                conn.commit()
+                elapsed = time.perf_counter() - start
+                rate = total_rows / elapsed
+                baseline = baseline or rate
+                print(f"{name:<16} {elapsed:8.3f} 秒 {rate:12.0f} rows/sec  x{rate / baseline:.1f}")
+
+            cur.execute(f"DROP TABLE {BENCH_TABLE}")
+            conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
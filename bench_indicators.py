@@ -0,0 +1,83 @@
+"""技術指標引擎效能測試：向量化面板計算 vs 逐列 Python 迴圈
+
+以假數據產生 N 支股票 x D 天的長表（不需資料庫），計算全部指標並與
+逐支、逐列迴圈的 SMA/RSI 寫法比較。
+
+用法: python bench_indicators.py [股票數] [天數]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import indicators
+
+
+def make_long_frame(n_tickers, n_days, seed=0):
+    """產生與 read_db_tables.read_stock_data 相同格式的長表"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=n_days, name='date')
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (n_days, n_tickers)), axis=0))
+    spread = np.abs(rng.normal(0, 0.01, (n_days, n_tickers)))
+    tickers = np.array([f"{i:04d}.TW" for i in range(n_tickers)], dtype=object)
+    return pd.DataFrame({
+        'ticker': np.tile(tickers, n_days),
+        'high': (close * (1 + spread)).ravel(),
+        'low': (close * (1 - spread)).ravel(),
+        'close': close.ravel(),
+    }, index=pd.DatetimeIndex(np.repeat(dates.to_numpy(), n_tickers), name='date'))
+
+
+def loop_sma_rsi(data, window=20, period=14):
+    """下游原本的寫法：逐支股票、逐列累加計算 SMA 與 RSI"""
+    out = {}
+    for ticker, group in data.groupby('ticker'):
+        closes = group['close'].tolist()
+        smas, rsis = [], []
+        avg_gain = avg_loss = None
+        for i, price in enumerate(closes):
+            smas.append(sum(closes[i - window + 1:i + 1]) / window if i >= window - 1 else None)
+            if i == 0:
+                rsis.append(None)
+                continue
+            change = price - closes[i - 1]
+            gain, loss = max(change, 0), max(-change, 0)
+            if avg_gain is None:
+                avg_gain, avg_loss = gain, loss
+            else:
+                avg_gain = (avg_gain * (period - 1) + gain) / period
+                avg_loss = (avg_loss * (period - 1) + loss) / period
+            rsis.append(100 - 100 / (1 + avg_gain / avg_loss) if avg_loss else 100)
+        out[ticker] = (smas, rsis)
+    return out
+
+
+def main():
+    n_tickers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    data = make_long_frame(n_tickers, n_days)
+    print(f"{n_tickers} 支股票 x {n_days} 天 = {len(data)} 列")
+
+    start = time.perf_counter()
+    result = indicators.compute_indicators(data)
+    vectorized = time.perf_counter() - start
+    print(f"向量化 ({len(indicators.INDICATOR_COLUMNS)} 個指標) {vectorized:8.3f} 秒  "
+          f"{len(data) / vectorized:12.0f} rows/sec  輸出 {result.shape}")
+
+    start = time.perf_counter()
+    close = indicators.to_panels(data, ['close'])['close']
+    indicators.sma(close, 20)
+    indicators.rsi(close, 14)
+    vectorized_pair = time.perf_counter() - start
+    print(f"向量化 (SMA + RSI)        {vectorized_pair:8.3f} 秒  {len(data) / vectorized_pair:12.0f} rows/sec")
+
+    start = time.perf_counter()
+    loop_sma_rsi(data)
+    looped = time.perf_counter() - start
+    print(f"逐列迴圈 (SMA + RSI)      {looped:8.3f} 秒  "
+          f"{len(data) / looped:12.0f} rows/sec  x{looped / vectorized_pair:.1f} 慢")
+
+
+if __name__ == "__main__":
+    main()
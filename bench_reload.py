@@ -0,0 +1,88 @@
+"""比較「刪除資料表後重新寫入」與「影子表分階段重新載入」的耗時與查詢可用性
+
+使用 .env 中的資料庫設定（會刪除並重建 stock_data 等資料表，只能指向測試用資料庫）。
+兩種方式載入相同的假數據，期間另一個線程持續以 read_stock_data 查詢一支股票，
+記錄查詢失敗/查無資料的次數與最長延遲。
+
+用法: python bench_reload.py [股票數] [每支天數]
+"""
+import sys
+import threading
+import time
+
+import bench_bulk_load
+import bulk_load
+import db_pool
+import db_schema
+import drop_db_tables
+import read_db_tables
+import staged_reload
+
+
+class Reader(threading.Thread):
+    """重新載入期間持續查詢的讀取端"""
+
+    def __init__(self, ticker):
+        super().__init__(daemon=True)
+        self.ticker = ticker
+        self.stop_event = threading.Event()
+        self.queries = self.errors = self.empty = 0
+        self.max_latency = 0.0
+
+    def run(self):
+        while not self.stop_event.is_set():
+            start = time.perf_counter()
+            try:
+                if read_db_tables.read_stock_data(self.ticker).empty:
+                    self.empty += 1
+            except Exception:
+                self.errors += 1
+            self.max_latency = max(self.max_latency, time.perf_counter() - start)
+            self.queries += 1
+            time.sleep(0.01)
+
+
+def save_codes(tickers):
+    db_schema.ensure_schema()
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO stock_codes (ticker) SELECT unnest(%s::varchar[]) ON CONFLICT DO NOTHING",
+                        (tickers,))
+        conn.commit()
+
+
+def drop_then_insert(frames):
+    """原本的流程：刪除全部資料表，重建結構後逐段寫入（寫入期間 stock_data 不存在或不完整）"""
+    drop_db_tables.drop_all_tables()
+    save_codes([ticker for ticker, _ in frames])
+    bulk_load.save_frames(frames)
+
+
+def staged(frames):
+    staged_reload.run_reload([ticker for ticker, _ in frames], frames=frames, log=lambda message: None)
+
+
+def main():
+    n_tickers = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    frames = bench_bulk_load.make_frames(n_tickers, n_days)
+    print(f"{n_tickers} 支股票 x {n_days} 天 = {n_tickers * n_days} 列")
+    save_codes([ticker for ticker, _ in frames])
+    bulk_load.save_frames(frames)  # 兩種方式都從已有完整數據的狀態開始
+
+    baseline = None
+    for name, method in [('刪除後重新寫入', drop_then_insert), ('影子表重新載入', staged)]:
+        reader = Reader(frames[0][0])
+        reader.start()
+        start = time.perf_counter()
+        method(frames)
+        elapsed = time.perf_counter() - start
+        reader.stop_event.set()
+        reader.join()
+        baseline = baseline or elapsed
+        print(f"{name:<10} {elapsed:8.3f} 秒  x{baseline / elapsed:.1f}  查詢 {reader.queries} 次，"
+              f"失敗 {reader.errors} 次，查無資料 {reader.empty} 次，最長 {reader.max_latency * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""多進程分片更新的擴展性測試（1 到 N 個分片進程）
+
+以 data_sources.SyntheticSource 取代 yfinance：代號檢查與下載各有固定延遲，
+其餘流程（驗證快取、管線、COPY 寫入）皆為實際程式碼。
+
+注意：每輪開始前會清空 code_validity 與 stock_data，請將 .env 指向測試用資料庫。
+
+用法: python bench_shards.py [代號數] [最多分片數]
+"""
+import os
+import sys
+import time
+
+import data_sources
+import db_pool
+import db_schema
+import shard_update
+
+CHECK_LATENCY = 0.02  # 假代號檢查延遲（秒）
+DOWNLOAD_LATENCY = 0.2  # 假批次下載延遲（秒）
+
+
+def install_source():
+    """在分片子進程中改用假數據來源（由 run_shards 的 setup 參數呼叫）"""
+    import code_cache
+
+    data_sources.set_source(data_sources.SyntheticSource(
+        check_latency=CHECK_LATENCY, download_latency=DOWNLOAD_LATENCY))
+    code_cache.warm_start = lambda cache, *args, **kwargs: {}  # 不以既有 CSV 預熱，每輪都實際檢查
+
+
+def reset_tables():
+    db_schema.ensure_schema()
+    with db_pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("TRUNCATE code_validity, stock_data")
+        conn.commit()
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    max_shards = int(sys.argv[2]) if len(sys.argv) > 2 else min(8, os.cpu_count() or 1)
+    print(f"{total} 個代號，CPU {os.cpu_count()} 核")
+
+    baseline = None
+    shards = 1
+    while shards <= max_shards:
+        reset_tables()
+        progress = {"messages": []}
+        start = time.perf_counter()
+        codes = shard_update.run_shards(1000, total, shards, progress=progress,
+                                        setup=install_source, rate=1000)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{shards:>2} 個分片: {elapsed:7.2f} 秒  {total / elapsed:8.1f} 代號/秒  "
+              f"有效 {len(codes)}  加速 x{baseline / elapsed:.2f}")
+        shards *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""完整更新流程（write_db_tables）基準測試
+
+以 data_sources.SyntheticSource 取代 yfinance（不需網路、結果固定），對 .env 設定的 PostgreSQL
+執行一次完整的 驗證 → 下載 → 轉換 → 寫入，報告代號/秒、資料列/秒、峰值記憶體，
+以及 metrics 中各階段與資料庫操作的耗時。
+
+注意：開始前會清空 code_validity 與 stock_data，請將 .env 指向測試用資料庫。
+
+用法: python bench_update.py [代號數] [檢查延遲秒數] [下載延遲秒數]
+"""
+import resource
+import sys
+import time
+
+import app
+import code_cache
+import data_sources
+import db_pool
+import db_schema
+import metrics
+
+
+def reset_tables():
+    db_schema.ensure_schema()
+    with db_pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("TRUNCATE code_validity, stock_data")
+        conn.commit()
+
+
+def report_histogram(title, histogram):
+    print(title)
+    for key, summary in sorted(histogram.summaries().items()):
+        name = ','.join(key) or histogram.name
+        average = summary["sum"] / summary["count"] * 1000 if summary["count"] else 0
+        print(f"  {name:<24} {summary['count']:>7} 次  合計 {summary['sum']:8.2f} 秒  平均 {average:8.2f} ms")
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    check_latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    download_latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+
+    data_sources.set_source(data_sources.SyntheticSource(
+        check_latency=check_latency, download_latency=download_latency))
+    code_cache.warm_start = lambda cache, *args, **kwargs: {}  # 不以既有 CSV 預熱，所有代號都實際檢查
+    app.VALIDATION_RATE = 1e6  # 假數據來源不需限速
+    app.save_valid_codes = lambda codes: app.save_stock_codes_to_postgresql(codes)  # 不覆蓋 valid_stock_codes.csv
+
+    reset_tables()
+    metrics.reset()
+    app.update_progress.update(start_idx=1000, current_batch=0)
+    app.stop_event.clear()
+
+    start = time.perf_counter()
+    ok = app.write_db_tables(total)
+    elapsed = time.perf_counter() - start
+
+    rows = metrics.ROWS_WRITTEN.value()
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux 以 KB 為單位
+    print(f"{total} 個代號，檢查延遲 {check_latency}s，下載延遲 {download_latency}s，完成={ok}")
+    print(f"耗時 {elapsed:.2f} 秒  {total / elapsed:.1f} 代號/秒  {rows / elapsed:.0f} 列/秒 "
+          f"({rows} 列)  峰值 RSS {peak_mb:.0f} MB")
+    report_histogram("各階段（每個管線項目）:", metrics.STAGE_SECONDS)
+    report_histogram("代號檢查:", metrics.CODE_CHECK_SECONDS)
+    report_histogram("下載（每支股票）:", metrics.DOWNLOAD_SECONDS)
+    report_histogram("資料庫操作:", metrics.DB_SECONDS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+import io
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+import db_pool
+import db_schema
+import adjustments
+import db_status
+import metrics
+import rollups
+
+# stock_data 寫入欄位順序（COPY 與 INSERT 共用）
+COLUMNS = ['date', 'open', 'high', 'low', 'close', 'volume', 'ticker']
+# frame_to_rows 產出的欄位：stock_data 欄位之後附上除權息事件（寫入 adjustment_factors）
+ROW_COLUMNS = COLUMNS + list(adjustments.ACTION_FIELDS)
+
+# OHLC 欄位對應的 yfinance 欄位名稱
+PRICE_FIELDS = {'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close'}
+CHUNK_ROWS = 50000  # iter_row_chunks 每段的預設資料列數
+TICKER_LOCK_SPACE = 7_301_002  # 寫入時股票 advisory lock 的第一個鍵（第二個鍵為代號的 hashtext）
+
+_write_listeners = []  # 寫入完成後要通知的函數，參數為本次寫入的股票代號列表
+
+
+def add_write_listener(listener):
+    """註冊寫入通知函數（例如清除查詢快取）
+
+    Args:
+        listener (callable): listener(tickers)，在 save_frames 提交後呼叫
+    """
+    _write_listeners.append(listener)
+
+
+def _notify_written(tickers):
+    for listener in _write_listeners:
+        try:
+            listener(tickers)
+        except Exception as e:
+            print(f"寫入通知失敗: {e}")
+
+
+def empty_rows():
+    """沒有資料列時的 DataFrame（欄位型別與 frame_to_rows 相同，合併時不會把欄位轉為 object）"""
+    return pd.DataFrame({'date': pd.Series(dtype=object),
+                         **{column: pd.Series(dtype=np.float32) for column in PRICE_FIELDS},
+                         'volume': pd.Series(dtype=np.int64), 'ticker': pd.Series(dtype=object),
+                         **{column: pd.Series(dtype=np.float32) for column in adjustments.ACTION_FIELDS}})[ROW_COLUMNS]
+
+
+def frame_to_rows(data, ticker):
+    """將 yf.download 的 DataFrame 一次性轉換為 stock_data 欄位格式
+
+    MultiIndex 欄位只讀取第一層名稱定位欄位，不複製整個 DataFrame；價格直接轉為與 REAL 欄位
+    相同的 float32 陣列，成交量轉為 int64。Dividends / Stock Splits 欄位（actions=True 時才有）
+    轉為 dividend / split，沒有時為 0。
+
+    Args:
+        data (pd.DataFrame): 包含 OHLCV 的股票數據（欄位可為 MultiIndex）
+        ticker (str): 股票代號
+
+    Returns:
+        pd.DataFrame: 欄位依序為 ROW_COLUMNS，已移除含 NaN 或成交量為 0 的列（停牌、對齊產生的空 K 棒）
+    """
+    if data is None or data.empty:
+        return empty_rows()
+
+    names = data.columns.get_level_values(0) if isinstance(data.columns, pd.MultiIndex) else data.columns
+    position = {name: idx for idx, name in enumerate(names)}  # Open/High/... 的欄位位置
+
+    prices = {column: data.iloc[:, position[field]].to_numpy(dtype=np.float32)
+              for column, field in PRICE_FIELDS.items()}
+    volume = data.iloc[:, position['Volume']].to_numpy(dtype=np.float64)
+    keep = ~np.isnan(volume) & (volume > 0)
+    for values in prices.values():
+        keep &= ~np.isnan(values)
+    actions = {column: np.nan_to_num(data.iloc[:, position[field]].to_numpy(dtype=np.float32)[keep])
+               if field in position else np.zeros(int(keep.sum()), dtype=np.float32)
+               for column, field in adjustments.ACTION_FIELDS.items()}
+
+    # 一次建立 DataFrame（逐欄指派每次都會重建內部區塊，反而較慢）
+    return pd.DataFrame({
+        'date': pd.DatetimeIndex(data.index)[keep].date,
+        **{column: values[keep] for column, values in prices.items()},
+        'volume': volume[keep].astype(np.int64),
+        'ticker': ticker,
+        **actions,
+    }, columns=ROW_COLUMNS)
+
+
+def iter_row_chunks(frames, chunk_rows=CHUNK_ROWS):
+    """逐支轉換股票數據，以約 chunk_rows 列為一段產出資料列
+
+    同一支股票的資料列一定在同一段中：加入下一支股票會超過 chunk_rows 時先產出目前的段落，
+    單支股票超過 chunk_rows 列時自成一段。每段提交後其中的股票即已完整寫入，
+    多個寫入線程不論以何種順序提交，檢查點都不會標記尚有段落未寫入的股票。
+    任何時刻只持有一支股票的轉換結果與未滿一段的資料列，峰值記憶體由 chunk_rows 與單支股票的列數決定，
+    與股票數量無關。
+
+    Args:
+        frames (iterable): (股票代號, pd.DataFrame) 的可迭代物件（可為生成器）
+        chunk_rows (int): 每段的資料列數上限（單支股票超過時除外）
+
+    Yields:
+        tuple: (pd.DataFrame, list)，frame_to_rows 格式的資料列，以及資料列全部在本段中的股票代號
+               （無有效資料列的股票也列入，附在下一個產出的段落中）
+    """
+    pending, size, done = [], 0, []
+    for ticker, data in frames:
+        rows = frame_to_rows(data, ticker)
+        if pending and size + len(rows) > chunk_rows:
+            yield pd.concat(pending, ignore_index=True), done
+            pending, size, done = [], 0, []
+        if len(rows):
+            pending.append(rows)
+            size += len(rows)
+        done.append(ticker)
+        if size >= chunk_rows:
+            yield pd.concat(pending, ignore_index=True), done
+            pending, size, done = [], 0, []
+    if pending or done:
+        rows = pd.concat(pending, ignore_index=True) if pending else empty_rows()
+        yield rows, done
+
+
+def rows_to_buffer(rows):
+    """將整批資料列轉換為 COPY 可讀取的 CSV 緩衝區
+
+    Args:
+        rows (pd.DataFrame): frame_to_rows 的回傳結果（可為多支股票合併）
+
+    Returns:
+        io.StringIO: 已移回開頭的 CSV 緩衝區（無標題列）
+    """
+    buffer = io.StringIO()
+    rows.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+@metrics.timed(metrics.DB_SECONDS, op='get_latest_dates')
+def get_latest_dates(tickers, table='stock_data'):
+    """查詢每支股票在資料庫中最新的交易日期
+
+    Args:
+        tickers (list): 股票代號列表
+        table (str): 資料表名稱
+
+    Returns:
+        dict: {股票代號: date}，沒有數據的股票不在結果中
+    """
+    try:
+        with db_pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT to_regclass(%s)", (table,))
+            if not cur.fetchone()[0]:
+                return {}
+            cur.execute(sql.SQL("""
+            SELECT ticker, MAX(date) FROM {} WHERE ticker = ANY(%s) GROUP BY ticker
+            """).format(sql.Identifier(table)), (list(tickers),))
+            return dict(cur.fetchall())
+    except Exception as e:
+        print(f"查詢最新日期異常: {e}")
+        return {}
+
+
+def copy_rows(cursor, rows, table='stock_data', columns=COLUMNS):
+    """以 COPY FROM STDIN 一次寫入所有資料列
+
+    Args:
+        cursor: psycopg2 游標
+        rows (pd.DataFrame): 欄位順序與 columns 相同的資料列
+        table (str): 目標資料表
+        columns (list): 寫入的欄位
+    """
+    statement = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+        sql.Identifier(table),
+        sql.SQL(', ').join(map(sql.Identifier, columns))
+    )
+    cursor.copy_expert(statement.as_string(cursor), rows_to_buffer(rows[list(columns)]))
+
+
+def _conflict_clause(columns, key):
+    """產生 ON CONFLICT (key) DO UPDATE SET 非鍵欄位 = EXCLUDED.欄位"""
+    updates = [sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c)) for c in columns if c not in key]
+    return sql.SQL(" ON CONFLICT ({}) DO UPDATE SET {}").format(
+        sql.SQL(', ').join(map(sql.Identifier, key)),
+        sql.SQL(', ').join(updates))
+
+
+def _inserted_counts(pairs):
+    """(key[0], 是否為新增) 的列表轉為每個鍵的新增列數（只有更新的鍵為 0）"""
+    counts = {}
+    for name, inserted in pairs:
+        counts[name] = counts.get(name, 0) + int(inserted)
+    return pd.Series(counts, dtype='int64')
+
+
+def insert_rows(cursor, rows, table='stock_data', page_size=1000, upsert=False,
+                columns=COLUMNS, key=('ticker', 'date'), count_inserted=False):
+    """以 execute_values 多列 INSERT 寫入（COPY 不可用時的備援）
+
+    Args:
+        cursor: psycopg2 游標
+        rows (pd.DataFrame): 欄位順序與 columns 相同的資料列
+        table (str): 目標資料表
+        page_size (int): 每條 INSERT 語句包含的列數
+        upsert (bool): key 已存在時更新其餘欄位
+        columns (list): 寫入的欄位
+        key (tuple): 唯一鍵欄位
+        count_inserted (bool): 回傳每個 key[0] 新增（而非更新）的列數
+
+    Returns:
+        pd.Series: count_inserted 時為 key[0] -> 新增列數，否則為 None
+    """
+    statement = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+        sql.Identifier(table),
+        sql.SQL(', ').join(map(sql.Identifier, columns))
+    )
+    if upsert:
+        rows = rows.drop_duplicates(subset=list(key), keep='last')
+        statement += _conflict_clause(columns, key)
+    if count_inserted:
+        # xmax = 0 表示本次新增的列，因衝突而更新的列不為 0
+        statement += sql.SQL(" RETURNING {}, (xmax = 0)").format(sql.Identifier(key[0]))
+    values = list(rows[list(columns)].itertuples(index=False, name=None))
+    result = execute_values(cursor, statement.as_string(cursor), values, page_size=page_size,
+                            fetch=count_inserted)
+    return _inserted_counts(result) if count_inserted else None
+
+
+def upsert_rows(cursor, rows, table='stock_data', columns=COLUMNS, key=('ticker', 'date'), count_inserted=False):
+    """以 COPY 寫入暫存表後合併進目標表，key 已存在時更新其餘欄位
+
+    Args:
+        cursor: psycopg2 游標
+        rows (pd.DataFrame): 欄位順序與 columns 相同的資料列
+        table (str): 目標資料表（需有 key 唯一索引）
+        columns (list): 寫入的欄位
+        key (tuple): 唯一鍵欄位
+        count_inserted (bool): 回傳每個 key[0] 新增（而非更新）的列數
+
+    Returns:
+        pd.Series: count_inserted 時為 key[0] -> 新增列數，否則為 None
+    """
+    staging = f"{table}_staging"
+    cursor.execute(sql.SQL("""
+    CREATE TEMP TABLE IF NOT EXISTS {staging}
+    (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+    """).format(staging=sql.Identifier(staging), table=sql.Identifier(table)))
+    # 同一批次內重複的鍵只保留最後一筆，避免 ON CONFLICT 更新同一列兩次
+    rows = rows.drop_duplicates(subset=list(key), keep='last')
+    copy_rows(cursor, rows, staging, columns)
+    column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+    statement = sql.SQL("INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging}").format(
+        table=sql.Identifier(table), columns=column_list, staging=sql.Identifier(staging)) \
+        + _conflict_clause(columns, key)
+    if not count_inserted:
+        cursor.execute(statement)
+        return None
+    # xmax = 0 表示本次新增的列，因衝突而更新的列不為 0；在資料庫中彙總，只傳回每個鍵一列
+    cursor.execute(sql.SQL("""
+    WITH written AS ({statement} RETURNING {name}, (xmax = 0) AS inserted)
+    SELECT {name}, COUNT(*) FILTER (WHERE inserted) FROM written GROUP BY {name}
+    """).format(statement=statement, name=sql.Identifier(key[0])))
+    return _inserted_counts(cursor.fetchall())
+
+
+def frames_to_rows(frames):
+    """將多支股票的 DataFrame 轉換並合併為 stock_data 資料列
+
+    Args:
+        frames (list): [(股票代號, pd.DataFrame), ...]
+
+    Returns:
+        pd.DataFrame: frame_to_rows 格式的資料列
+    """
+    if not frames:
+        return empty_rows()
+    return pd.concat([frame_to_rows(data, ticker) for ticker, data in frames], ignore_index=True)
+
+
+def lock_tickers(cur, tickers):
+    """以交易級 advisory lock 鎖住股票（提交或回滾時釋放）
+
+    週/月線與除權息因子都是依 stock_data 重新計算後整列覆蓋（摘要以增量累加，不受影響）；多個事務同時寫入同一支股票時，
+    後取得鎖的事務在前一個提交後才重算，讀得到對方已提交的數據。依鍵值排序取得，不會互相死鎖。
+
+    Args:
+        cur: psycopg2 游標
+        tickers (list): 股票代號
+    """
+    cur.execute("""
+    SELECT pg_advisory_xact_lock(%s, key)
+    FROM (SELECT DISTINCT hashtext(ticker) AS key FROM unnest(%s::text[]) AS t(ticker) ORDER BY key) keys
+    """, (TICKER_LOCK_SPACE, list(tickers)))
+
+
+@metrics.timed(metrics.DB_SECONDS, op='save_rows')
+def save_rows(rows, table='stock_data', ensure_codes=False, before_commit=None):
+    """將已轉換的資料列以一次 COPY 存入資料庫，已存在的 (ticker, date) 會被更新
+
+    Args:
+        rows (pd.DataFrame): frame_to_rows 格式的資料列
+        table (str): 目標資料表
+        ensure_codes (bool): 在同一事務中先把代號補進 stock_codes（滿足外鍵約束）
+        before_commit (callable): 提交前以同一游標呼叫 before_commit(cur)，例如記錄任務檢查點
+
+    Returns:
+        int: 寫入的資料列數，失敗時返回 0
+    """
+    if rows.empty:
+        return 0
+
+    tickers = rows['ticker'].unique().tolist()
+    try:
+        db_schema.ensure_schema()  # 資料表由 db_schema 建立與升級
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                created = db_schema.ensure_partitions(cur, {d.year for d in rows['date'].unique()}, table)
+                conn.commit()
+                db_schema.remember_partitions(created)  # 提交成功後才記錄，回滾時下次重新建立
+                if ensure_codes:
+                    cur.execute("""
+                    INSERT INTO stock_codes (ticker) SELECT unnest(%s::varchar[])
+                    ON CONFLICT (ticker) DO NOTHING
+                    """, (tickers,))
+                counting = table == 'stock_data'  # 摘要只加上新增的列數，不重新計算整支股票
+                try:
+                    inserted = upsert_rows(cur, rows, table, count_inserted=counting)
+                except psycopg2.Error as e:
+                    # 部分代理（如 pgbouncer 特定模式）不支援 COPY，改用多列 INSERT
+                    conn.rollback()
+                    print(f"COPY 失敗，改用 execute_values: {e}")
+                    if ensure_codes:
+                        execute_values(cur, """
+                        INSERT INTO stock_codes (ticker) VALUES %s ON CONFLICT (ticker) DO NOTHING
+                        """, [(ticker,) for ticker in tickers])
+                    inserted = insert_rows(cur, rows, table, upsert=True, count_inserted=counting)
+                if table == 'stock_data':
+                    lock_tickers(cur, tickers)  # 同一股票的重算依提交順序進行，最後提交者看得到全部數據
+                    dates = rows.groupby('ticker')['date']
+                    since = dates.min()  # 每支股票本次寫入的最早日期
+                    # 摘要與數據同一事務，狀態查詢不必掃描 stock_data
+                    db_status.refresh_summary(cur, since, dates.max(), inserted)
+                    rollups.refresh_rollups(cur, since)  # 只重算受影響的週/月
+                    changed = adjustments.record_actions(cur, rows, since)  # 除權息事件與原始價格同一事務
+                    adjustments.invalidate_derived(cur, changed)  # 以舊因子計算的指標與選股欄位不再有效
+                if before_commit:
+                    before_commit(cur)  # 與數據同一事務提交，兩者不會只成功一半
+            conn.commit()
+        metrics.ROWS_WRITTEN.inc(len(rows))
+        _notify_written(tickers)
+        return len(rows)
+    except Exception as e:
+        print(f"數據存儲異常: {e}")
+        return 0
+
+
+def save_frames(frames, table='stock_data'):
+    """將多支股票的歷史數據分段以 COPY 存入資料庫，已存在的 (ticker, date) 會被更新
+
+    約每 CHUNK_ROWS 列一次 COPY 與提交，長歷史區間也不會一次轉換全部數據。
+
+    Args:
+        frames (iterable): (股票代號, pd.DataFrame) 的可迭代物件
+        table (str): 目標資料表
+
+    Returns:
+        int: 寫入的資料列數，失敗的分段不計入
+    """
+    return sum(save_rows(rows, table) for rows, _ in iter_row_chunks(frames))
@@ -0,0 +1,134 @@
+import csv
+import os
+from datetime import datetime, timedelta
+
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+# 加載 .env 文件中的環境變數
+load_dotenv()
+
+import db_pool
+import db_schema
+import metrics
+
+# 有效代號與無效代號分別設定有效期限（可由 .env 覆蓋）
+POSITIVE_TTL = timedelta(days=float(os.getenv('CODE_CACHE_POSITIVE_DAYS', 30)))  # 有效代號快取天數
+NEGATIVE_TTL = timedelta(days=float(os.getenv('CODE_CACHE_NEGATIVE_DAYS', 14)))  # 無效代號快取天數
+
+
+@metrics.timed(metrics.DB_SECONDS, op='load_validity_cache')
+def load_validity_cache():
+    """從 code_validity 表讀取代號檢查快取
+
+    Returns:
+        dict: {股票代號: (是否有效, 檢查時間)}，讀取失敗時返回空字典
+    """
+    cache = {}
+    try:
+        db_schema.ensure_schema()  # code_validity 表由結構遷移建立
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT ticker, is_valid, checked_at FROM code_validity")
+                for ticker, is_valid, checked_at in cur.fetchall():
+                    cache[ticker] = (is_valid, checked_at)
+            conn.commit()
+    except Exception as e:
+        print(f"讀取代號快取異常: {e}")
+    return cache
+
+
+def warm_start(cache, csv_path='valid_stock_codes.csv', use_table=True):
+    """以既有的 CSV 檔與 stock_codes 表預熱快取（只補入快取中沒有的代號）
+
+    CSV 中的代號以檔案修改時間作為檢查時間；stock_codes 表沒有時間欄位，
+    以現在時間記錄。
+
+    Args:
+        cache (dict): load_validity_cache 的回傳結果，會被原地更新
+        csv_path (str): 有效代號 CSV 檔路徑
+        use_table (bool): 是否同時讀取 stock_codes 表
+
+    Returns:
+        dict: 新補入的 {股票代號: (True, 檢查時間)}，可交給 save_validity_results 持久化
+    """
+    seeded = {}
+
+    if csv_path and os.path.exists(csv_path):
+        checked_at = datetime.fromtimestamp(os.path.getmtime(csv_path))
+        with open(csv_path, newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            next(reader, None)  # 略過標題列
+            for row in reader:
+                if row and row[0] not in cache:
+                    cache[row[0]] = seeded[row[0]] = (True, checked_at)
+
+    if use_table:
+        try:
+            with db_pool.connection() as conn, conn.cursor() as cur:
+                cur.execute("SELECT to_regclass('public.stock_codes')")
+                if cur.fetchone()[0]:
+                    cur.execute("SELECT ticker FROM stock_codes")
+                    now = datetime.now()
+                    for (ticker,) in cur.fetchall():
+                        if ticker not in cache:
+                            cache[ticker] = seeded[ticker] = (True, now)
+        except Exception as e:
+            print(f"讀取 stock_codes 表異常: {e}")
+
+    return seeded
+
+
+def partition_codes(codes, cache, now=None, positive_ttl=POSITIVE_TTL, negative_ttl=NEGATIVE_TTL):
+    """依快取將代號分為「仍有效的已知有效代號」與「需要重新檢查的代號」
+
+    Args:
+        codes (list): 候選股票代號
+        cache (dict): {股票代號: (是否有效, 檢查時間)}
+        now (datetime): 比較基準時間，預設為現在
+        positive_ttl (timedelta): 有效代號的快取期限
+        negative_ttl (timedelta): 無效代號的快取期限
+
+    Returns:
+        tuple: (快取中仍有效的有效代號列表, 需要檢查的代號列表)，皆維持輸入順序
+    """
+    now = now or datetime.now()
+    known_valid = []
+    to_check = []
+    for code in codes:
+        entry = cache.get(code)
+        if entry is None:
+            to_check.append(code)
+            continue
+        is_valid, checked_at = entry
+        ttl = positive_ttl if is_valid else negative_ttl
+        if now - checked_at > ttl:
+            to_check.append(code)  # 快取過期，需要重新檢查
+        elif is_valid:
+            known_valid.append(code)
+        # 未過期的無效代號直接略過
+    return known_valid, to_check
+
+
+@metrics.timed(metrics.DB_SECONDS, op='save_validity_results')
+def save_validity_results(results):
+    """將代號檢查結果寫入 code_validity 表（已存在則更新）
+
+    Args:
+        results (dict): {股票代號: (是否有效, 檢查時間)}
+    """
+    if not results:
+        return
+    try:
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                # 一次送出所有結果
+                execute_values(cur, """
+                INSERT INTO code_validity (ticker, is_valid, checked_at)
+                VALUES %s
+                ON CONFLICT (ticker) DO UPDATE
+                SET is_valid = EXCLUDED.is_valid, checked_at = EXCLUDED.checked_at
+                """, [(ticker, bool(is_valid), checked_at)
+                      for ticker, (is_valid, checked_at) in results.items()])
+            conn.commit()
+    except Exception as e:
+        print(f"寫入代號快取異常: {e}")
@@ -0,0 +1,212 @@
+"""股票資料來源
+
+更新流程只透過 DataSource 的三個方法取得數據，實際來源由 DATA_SOURCE 設定：
+    yfinance   Yahoo Finance（預設）
+    synthetic  本機產生的固定假數據，可設定延遲與失敗率，供離線基準測試使用
+"""
+import json
+import os
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from dotenv import load_dotenv
+# 加載 .env 文件中的環境變數
+load_dotenv()
+
+DATA_SOURCE = os.getenv('DATA_SOURCE', 'yfinance')  # 使用的資料來源名稱
+
+FIELDS = ['Close', 'High', 'Low', 'Open', 'Volume']  # 與 yf.download 相同的欄位順序
+ACTION_FIELDS = ['Dividends', 'Stock Splits']  # actions=True 時附加的除權息欄位
+
+
+class DataSource:
+    """資料來源介面"""
+
+    name = 'base'
+
+    def is_stock_code(self, ticker):
+        """代號是否為有效股票"""
+        raise NotImplementedError
+
+    def download(self, tickers, start_date, end_date):
+        """一次下載多支股票的歷史數據
+
+        Returns:
+            pd.DataFrame: 以 Date 為索引、欄位為 (欄位名稱, 股票代號) 的寬表，與 yf.download(group_by='column') 相同；
+                價格為未調整的原始價格，並附上 Dividends / Stock Splits 欄位（由 adjustments 在讀取時調整）
+        """
+        raise NotImplementedError
+
+    def history(self, ticker, start_date, end_date):
+        """下載單支股票的歷史數據（格式同 download）"""
+        return self.download([ticker], start_date, end_date)
+
+
+class YFinanceSource(DataSource):
+    """Yahoo Finance 資料來源"""
+
+    name = 'yfinance'
+
+    def is_stock_code(self, ticker):
+        try:
+            stock_info = yf.Ticker(ticker)  # 創建股票對象
+
+            # 檢查是否存在市場價格數據
+            if stock_info.info['regularMarketPrice'] is not None:
+                return True
+            return False
+
+        except KeyError:
+            print(f"錯誤：無法找到股票代號 {ticker} 的市場價格資訊。")
+            return False
+        except ValueError as e:
+            if isinstance(e, json.JSONDecodeError):
+                raise  # 限流或連線中斷時回應不是 JSON，屬暫時性錯誤
+            print(f"錯誤：股票代號 {ticker} 格式不正確。")
+            return False
+        # 其餘錯誤（429 限流、逾時、網路錯誤）不代表代號無效，交由呼叫端處理，不寫入快取
+
+    def download(self, tickers, start_date, end_date):
+        return yf.download(
+            list(tickers),
+            start=start_date,
+            end=end_date,
+            group_by='column',  # 欄位第一層為 Open/High/...，第二層為股票代號
+            auto_adjust=False,  # 保存原始價格，除權息後不必重新下載歷史數據
+            actions=True,       # 附上 Dividends / Stock Splits
+            progress=False,     # 關閉進度列輸出
+            threads=True        # 由 yfinance 內部並行下載同一批次
+        )
+
+    def history(self, ticker, start_date, end_date):
+        return yf.download(ticker, start=start_date, end=end_date, auto_adjust=False, actions=True)  # 下載歷史數據
+
+
+class SyntheticSource(DataSource):
+    """本機產生的假數據來源，結果只由 seed 與代號決定
+
+    每支股票的價格是從 origin 開始的固定隨機漫步，不論下載哪個日期範圍，
+    同一天的數值都相同（增量更新與完整更新的結果一致）。每支股票每 250 個交易日除息一次（前一日收盤價的 3%）。
+    失敗依 (請求內容, 第幾次請求) 決定，同一請求重試時可能成功。
+
+    Args:
+        valid_ratio (float): 有效代號的比例
+        seed (int): 隨機種子
+        check_latency (float): is_stock_code 每次的延遲秒數
+        download_latency (float): download 每次請求的延遲秒數
+        failure_rate (float): 每次請求拋出 ConnectionError 的機率
+        origin (str): 隨機漫步的起始日期
+        sleep (callable): 延遲函數（測試時可替換）
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, valid_ratio=0.3, seed=0, check_latency=0.0, download_latency=0.0,
+                 failure_rate=0.0, origin='2015-01-01', sleep=time.sleep):
+        self.valid_ratio = valid_ratio
+        self.seed = seed
+        self.check_latency = check_latency
+        self.download_latency = download_latency
+        self.failure_rate = failure_rate
+        self.origin = pd.Timestamp(origin)
+        self.sleep = sleep
+        self._attempts = {}  # 請求內容 -> 已請求次數
+        self._lock = threading.Lock()
+
+    def _unit(self, *parts):
+        """由參數決定的 [0, 1) 亂數"""
+        key = ':'.join(str(part) for part in (self.seed,) + parts)
+        return zlib.crc32(key.encode()) / 2 ** 32
+
+    def _maybe_fail(self, *request):
+        if not self.failure_rate:
+            return
+        with self._lock:
+            attempt = self._attempts[request] = self._attempts.get(request, 0) + 1
+        if self._unit('fail', *request, attempt) < self.failure_rate:
+            raise ConnectionError(f"模擬請求失敗: {request[0]}")
+
+    def is_stock_code(self, ticker):
+        if self.check_latency:
+            self.sleep(self.check_latency)
+        self._maybe_fail('check', ticker)
+        return self._unit('valid', ticker) < self.valid_ratio
+
+    def _series(self, ticker, days):
+        """產生 origin 起 days 個交易日的 OHLCV"""
+        rng = np.random.default_rng(zlib.crc32(f"{self.seed}:{ticker}".encode()))
+        base = 10 + 490 * rng.random()  # 起始價格 10~500
+        close = base * np.exp(np.cumsum(rng.normal(0.0002, 0.02, days)))
+        open_ = np.concatenate([[base], close[:-1]]) * (1 + rng.normal(0, 0.005, days))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, days)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, days)))
+        volume = rng.lognormal(13, 1, days).round()
+        dividends = np.zeros(days)
+        ex_days = np.arange(1 + rng.integers(250), days, 250)  # 每年一次，第一次落在前 250 個交易日內
+        dividends[ex_days] = (close[ex_days - 1] * 0.03).round(2)
+        return {'Close': close, 'High': high, 'Low': low, 'Open': open_, 'Volume': volume,
+                'Dividends': dividends, 'Stock Splits': np.zeros(days)}
+
+    def download(self, tickers, start_date, end_date):
+        tickers = list(tickers)
+        if self.download_latency:
+            self.sleep(self.download_latency)
+        self._maybe_fail('download', ','.join(tickers), start_date, end_date)
+
+        end = pd.Timestamp(end_date).normalize()
+        start = max(pd.Timestamp(start_date).normalize(), self.origin)
+        days = pd.bdate_range(self.origin, end, inclusive='left', name='Date')  # 與 yfinance 相同，不含結束日
+        keep = days >= start
+        valid = [ticker for ticker in tickers if self._unit('valid', ticker) < self.valid_ratio]
+        if not valid or end <= start or not keep.any():  # 起訖相同時 bdate_range 仍會產出起始日
+            return pd.DataFrame()
+
+        series = {ticker: self._series(ticker, len(days)) for ticker in valid}
+        fields = FIELDS + ACTION_FIELDS
+        columns = pd.MultiIndex.from_product([fields, valid], names=['Price', 'Ticker'])
+        values = np.column_stack([series[ticker][field][keep] for field in fields for ticker in valid])
+        return pd.DataFrame(values, index=days[keep], columns=columns)
+
+
+def synthetic_from_env():
+    """依 .env 的 SYNTHETIC_* 設定建立假數據來源"""
+    return SyntheticSource(
+        valid_ratio=float(os.getenv('SYNTHETIC_VALID_RATIO', 0.3)),
+        seed=int(os.getenv('SYNTHETIC_SEED', 0)),
+        check_latency=float(os.getenv('SYNTHETIC_CHECK_LATENCY', 0)),
+        download_latency=float(os.getenv('SYNTHETIC_DOWNLOAD_LATENCY', 0)),
+        failure_rate=float(os.getenv('SYNTHETIC_FAILURE_RATE', 0)),
+    )
+
+
+# 可用的資料來源：名稱 -> 建立函數
+SOURCES = {
+    'yfinance': YFinanceSource,
+    'synthetic': synthetic_from_env,
+}
+
+_source = None  # 目前使用的資料來源（首次使用時依 DATA_SOURCE 建立）
+_source_lock = threading.Lock()
+
+
+def get_source():
+    """取得目前的資料來源"""
+    global _source
+    with _source_lock:
+        if _source is None:
+            if DATA_SOURCE not in SOURCES:
+                raise ValueError(f"不支援的資料來源: {DATA_SOURCE}（可用: {', '.join(SOURCES)}）")
+            _source = SOURCES[DATA_SOURCE]()
+        return _source
+
+
+def set_source(source):
+    """替換資料來源（例如基準測試改用 SyntheticSource）"""
+    global _source
+    with _source_lock:
+        _source = source
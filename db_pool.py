@@ -0,0 +1,214 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.pool
+from dotenv import load_dotenv
+# 加載 .env 文件中的環境變數
+load_dotenv()
+
+# 連接池設定（可由 .env 覆蓋）
+POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))  # 最少保留的連接數
+POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))  # 最多同時存在的連接數
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))  # 等待可用連接的最長秒數
+HEALTHCHECK_IDLE = float(os.getenv('DB_POOL_HEALTHCHECK_IDLE', 30))  # 閒置超過此秒數的連接在取出時先檢查
+
+
+def connect():
+    """以 .env 設定建立新的 PostgreSQL 連接"""
+    return psycopg2.connect(
+        dbname=os.getenv('DB_NAME'),  # 資料庫名稱
+        user=os.getenv('DB_USER'),  # 使用者名稱
+        password=os.getenv('DB_PASSWORD'),  # 密碼
+        host=os.getenv('DB_HOST'),  # 主機地址
+        port=os.getenv('DB_PORT')  # 端口號
+    )
+
+
+class ConnectionPool:
+    """線程安全的 PostgreSQL 連接池
+
+    - 連接數介於 minconn 與 maxconn 之間，用盡時等待其他線程歸還
+    - 取出閒置過久的連接時先以 SELECT 1 檢查，失效則重新連接
+    - 歸還時回滾未提交的事務；已斷線的連接直接丟棄
+    """
+
+    def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT,
+                 healthcheck_idle=HEALTHCHECK_IDLE, connect=connect):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._connect = connect
+        self._idle = []  # 閒置連接 [(連接, 歸還時間)]
+        self._in_use = set()  # 使用中的連接（建立中的以佔位物件表示）
+        self._cond = threading.Condition()
+        self._stats = {"created": 0, "discarded": 0, "checkouts": 0, "waits": 0,
+                       "wait_seconds": 0.0, "healthcheck_failures": 0}
+
+    def _open(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _healthy(self, conn, idle_since):
+        """檢查連接是否可用（閒置未超過門檻時只檢查 closed 旗標）"""
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """取出一個可用連接，池已滿時等待最多 timeout 秒
+
+        Raises:
+            psycopg2.pool.PoolError: 等待逾時
+        """
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if len(self._in_use) < self.maxconn:
+                    conn, idle_since = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise psycopg2.pool.PoolError("等待資料庫連接逾時")
+                if not waited:
+                    self._stats["waits"] += 1
+                    waited = True
+                wait_start = time.monotonic()
+                self._cond.wait(remaining)
+                self._stats["wait_seconds"] += time.monotonic() - wait_start
+            placeholder = object()  # 先佔位，避免建立連接期間超過上限
+            self._in_use.add(placeholder)
+            self._stats["checkouts"] += 1
+
+        try:
+            if conn is not None and not self._healthy(conn, idle_since):
+                with self._cond:
+                    self._stats["healthcheck_failures"] += 1
+                    self._stats["discarded"] += 1
+                self._close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = self._open()  # 新建或重新連接
+        except Exception:
+            with self._cond:
+                self._in_use.discard(placeholder)
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._in_use.discard(placeholder)
+            self._in_use.add(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """歸還連接；close=True 或連接已失效時直接關閉"""
+        if not close and not conn.closed:
+            try:
+                conn.rollback()  # 清除未提交的事務，讓下一個使用者拿到乾淨的連接
+            except psycopg2.Error:
+                close = True
+        with self._cond:
+            self._in_use.discard(conn)
+            if close or conn.closed or len(self._idle) >= self.maxconn:
+                self._stats["discarded"] += 1
+                discard = True
+            else:
+                self._idle.append((conn, time.monotonic()))
+                discard = False
+            self._cond.notify()
+        if discard:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """以 with 語法借用連接，離開時自動歸還
+
+        發生資料庫連線錯誤時丟棄該連接，其餘例外回滾後歸還。
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.putconn(conn, close=True)
+            raise
+        except BaseException:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def prefill(self):
+        """預先建立 minconn 個閒置連接"""
+        while True:
+            with self._cond:
+                if len(self._idle) + len(self._in_use) >= self.minconn:
+                    return
+            conn = self._open()
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+
+    def stats(self):
+        """返回連接池統計資料（供監控使用）"""
+        with self._cond:
+            return dict(self._stats, in_use=len(self._in_use), idle=len(self._idle),
+                        minconn=self.minconn, maxconn=self.maxconn)
+
+    def closeall(self):
+        """關閉所有閒置連接"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = None  # 全局共用連接池
+_pool_pid = None  # 建立連接池的進程 ID（fork 後的子進程需要自己的連接池）
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """取得全局共用連接池（首次呼叫時建立）"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool()
+            _pool_pid = os.getpid()
+            try:
+                _pool.prefill()
+            except psycopg2.Error as e:
+                print(f"預建資料庫連接失敗: {e}")  # 之後取用時會再嘗試連接
+        return _pool
+
+
+def connection():
+    """從全局連接池借用連接：with db_pool.connection() as conn: ..."""
+    return get_pool().connection()
+
+
+def pool_stats():
+    """返回全局連接池統計資料"""
+    return get_pool().stats()
@@ -0,0 +1,459 @@
+"""資料庫結構管理
+
+所有資料表的 DDL 集中在此，以版本化的遷移 (migration) 依序套用，
+既有資料庫會被原地升級。其他模組寫入前呼叫 ensure_schema() 即可。
+
+用法:
+    python db_schema.py            套用尚未執行的遷移
+    python db_schema.py partition  將既有 stock_data 轉換為依年份分區的資料表
+"""
+import os
+import sys
+import threading
+from datetime import datetime
+
+from psycopg2 import sql
+from dotenv import load_dotenv
+# 加載 .env 文件中的環境變數
+load_dotenv()
+
+import db_pool  # 共用資料庫連接池
+import rollups  # 週線/月線彙總表的計算
+
+# 新建 stock_data 時是否依年份做範圍分區（可由 .env 設定）
+PARTITIONED = os.getenv('STOCK_DATA_PARTITIONED', '0') == '1'
+
+MIGRATION_LOCK_ID = 7_301_001  # 遷移時使用的 advisory lock 編號，避免多個進程同時升級
+
+
+def _table_exists(cur, table):
+    cur.execute("SELECT to_regclass(%s)", (f"public.{table}",))
+    return cur.fetchone()[0] is not None
+
+
+def _column_exists(cur, table, column):
+    cur.execute("""
+    SELECT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s AND column_name = %s
+    )
+    """, (table, column))
+    return cur.fetchone()[0]
+
+
+def is_partitioned(cur, table='stock_data'):
+    """檢查資料表是否為分區表"""
+    cur.execute("""
+    SELECT EXISTS (
+        SELECT 1 FROM pg_partitioned_table p
+        JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = %s
+    )
+    """, (table,))
+    return cur.fetchone()[0]
+
+
+def create_stock_data_table(cur, table='stock_data', partitioned=None):
+    """以精簡型別建立 stock_data（主鍵為 (ticker, date)）
+
+    Args:
+        cur: psycopg2 游標
+        table (str): 資料表名稱
+        partitioned (bool): 是否依 date 做年份範圍分區，預設依 STOCK_DATA_PARTITIONED
+    """
+    if partitioned is None:
+        partitioned = PARTITIONED
+    cur.execute(sql.SQL("""
+    CREATE TABLE {table} (
+        ticker VARCHAR(10) NOT NULL REFERENCES stock_codes(ticker),  -- 股票代號（外鍵）
+        date DATE NOT NULL,  -- 交易日期
+        open REAL,  -- 開盤價
+        high REAL,  -- 最高價
+        low REAL,  -- 最低價
+        close REAL,  -- 收盤價
+        volume BIGINT,  -- 成交量（INT 在大量成交日會溢位）
+        PRIMARY KEY (ticker, date)
+    ) {partition}
+    """).format(
+        table=sql.Identifier(table),
+        partition=sql.SQL("PARTITION BY RANGE (date)") if partitioned else sql.SQL("")
+    ))
+    cur.execute(sql.SQL("CREATE INDEX {} ON {} (date)").format(
+        sql.Identifier(f"{table}_date_idx"), sql.Identifier(table)))
+
+
+def _migration_1_base_tables(cur):
+    """建立 stock_codes 與 code_validity"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stock_codes (
+        id SERIAL PRIMARY KEY,  -- 自增主鍵
+        ticker VARCHAR(10) UNIQUE  -- 唯一股票代號
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS code_validity (
+        ticker VARCHAR(10) PRIMARY KEY,  -- 股票代號
+        is_valid BOOLEAN NOT NULL,  -- 是否為有效代號
+        checked_at TIMESTAMP NOT NULL  -- 最後檢查時間
+    )
+    """)
+
+
+def _migration_2_compact_stock_data(cur):
+    """stock_data 改為 (ticker, date) 主鍵、REAL 價格與 BIGINT 成交量，並建立日期索引"""
+    if not _table_exists(cur, 'stock_data'):
+        create_stock_data_table(cur)
+        return
+
+    # 舊版以 SERIAL id 為主鍵，先移除重複的 (ticker, date)，保留最後寫入的一筆
+    if _column_exists(cur, 'stock_data', 'id'):
+        cur.execute("""
+        DELETE FROM stock_data a USING stock_data b
+        WHERE a.ticker = b.ticker AND a.date = b.date AND a.id < b.id
+        """)
+    cur.execute("DELETE FROM stock_data WHERE ticker IS NULL OR date IS NULL")
+    cur.execute("DROP INDEX IF EXISTS stock_data_ticker_date_key")
+    cur.execute("ALTER TABLE stock_data DROP CONSTRAINT IF EXISTS stock_data_pkey")
+    cur.execute("ALTER TABLE stock_data DROP COLUMN IF EXISTS id")
+    cur.execute("""
+    ALTER TABLE stock_data
+        ALTER COLUMN ticker SET NOT NULL,
+        ALTER COLUMN date SET NOT NULL,
+        ALTER COLUMN open TYPE REAL,
+        ALTER COLUMN high TYPE REAL,
+        ALTER COLUMN low TYPE REAL,
+        ALTER COLUMN close TYPE REAL,
+        ALTER COLUMN volume TYPE BIGINT,
+        ADD PRIMARY KEY (ticker, date)
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS stock_data_date_idx ON stock_data (date)")
+
+
+def _migration_3_stock_indicators(cur):
+    """建立技術指標衍生表 stock_indicators"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stock_indicators (
+        ticker VARCHAR(10) NOT NULL,  -- 股票代號
+        date DATE NOT NULL,  -- 交易日期
+        sma_5 REAL, sma_20 REAL, sma_60 REAL,  -- 簡單移動平均
+        ema_12 REAL, ema_26 REAL,  -- 指數移動平均
+        rsi_14 REAL,  -- 相對強弱指標
+        macd REAL, macd_signal REAL, macd_hist REAL,  -- MACD
+        bb_upper REAL, bb_lower REAL,  -- 布林通道上下軌
+        atr_14 REAL,  -- 平均真實區間
+        PRIMARY KEY (ticker, date)
+    )
+    """)
+
+
+def _migration_4_update_jobs(cur):
+    """建立更新任務檢查點 update_jobs 與 update_job_items"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS update_jobs (
+        job_id SERIAL PRIMARY KEY,  -- 任務編號
+        start_idx INTEGER NOT NULL,  -- 起始代號
+        total INTEGER NOT NULL,  -- 候選代號數
+        incremental BOOLEAN NOT NULL,  -- 是否為增量更新
+        status VARCHAR(10) NOT NULL DEFAULT 'running',  -- running / stopped / failed / done
+        created_at TIMESTAMP NOT NULL DEFAULT now(),  -- 建立時間
+        updated_at TIMESTAMP NOT NULL DEFAULT now()  -- 最後更新時間
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS update_job_items (
+        job_id INTEGER NOT NULL REFERENCES update_jobs (job_id) ON DELETE CASCADE,
+        ticker VARCHAR(10) NOT NULL,  -- 股票代號
+        state VARCHAR(8) NOT NULL,  -- invalid / valid / done
+        PRIMARY KEY (job_id, ticker)
+    )
+    """)
+
+
+def _migration_5_stock_summary(cur):
+    """建立每支股票的摘要表 stock_summary，並由既有的 stock_data 回填"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stock_summary (
+        ticker VARCHAR(10) PRIMARY KEY,  -- 股票代號
+        row_count INTEGER NOT NULL,  -- stock_data 中的交易日數
+        first_date DATE NOT NULL,  -- 最早交易日期
+        last_date DATE NOT NULL,  -- 最新交易日期
+        updated_at TIMESTAMP NOT NULL DEFAULT now()  -- 最後寫入時間
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS stock_summary_last_date_idx ON stock_summary (last_date)")
+    cur.execute("""
+    INSERT INTO stock_summary (ticker, row_count, first_date, last_date)
+    SELECT ticker, COUNT(*), MIN(date), MAX(date) FROM stock_data GROUP BY ticker
+    ON CONFLICT (ticker) DO NOTHING
+    """)
+
+
+def _migration_6_backfill_ranges(cur):
+    """建立 backfill_ranges：已回補完成的 (股票, 年份)，包含上市前沒有數據的年份"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS backfill_ranges (
+        ticker VARCHAR(10) NOT NULL,  -- 股票代號
+        year SMALLINT NOT NULL,  -- 回補的年份
+        fetched_at TIMESTAMP NOT NULL DEFAULT now(),  -- 下載完成時間
+        PRIMARY KEY (ticker, year)
+    )
+    """)
+
+
+def _migration_7_job_queue(cur):
+    """建立 job_queue：排程器與手動觸發的任務佇列及執行記錄"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS job_queue (
+        job_id SERIAL PRIMARY KEY,  -- 任務編號
+        kind VARCHAR(16) NOT NULL,  -- 任務類型：update / incremental / export / backfill / reload
+        params JSONB NOT NULL DEFAULT '{}',  -- 任務參數
+        priority SMALLINT NOT NULL DEFAULT 0,  -- 優先度，大者先執行
+        off_peak BOOLEAN NOT NULL DEFAULT FALSE,  -- 是否只在離峰時段開始
+        status VARCHAR(10) NOT NULL DEFAULT 'queued',  -- queued / running / done / stopped / failed / cancelled
+        schedule VARCHAR(32),  -- 排程名稱（手動任務為 NULL）
+        scheduled_for TIMESTAMP,  -- 排程預定時間
+        created_at TIMESTAMP NOT NULL,  -- 建立時間
+        started_at TIMESTAMP,  -- 開始時間
+        finished_at TIMESTAMP,  -- 結束時間
+        instance VARCHAR(64),  -- 執行的應用實例（主機:進程）
+        message TEXT,  -- 結果摘要或錯誤訊息
+        UNIQUE (schedule, scheduled_for)  -- 同一排程時間只新增一次（多實例共用）
+    )
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS job_queue_queued_idx ON job_queue (priority DESC, job_id)
+    WHERE status = 'queued'
+    """)
+
+
+def _migration_8_screen_latest(cur):
+    """建立 screen_latest：選股用的每支股票最新一根 K 棒與衍生欄位（由 screener.refresh 整表替換）"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS screen_latest (
+        ticker VARCHAR(10) PRIMARY KEY,  -- 股票代號
+        date DATE NOT NULL,  -- 最新一根 K 棒的日期
+        open REAL, high REAL, low REAL, close REAL,  -- 最新一根 K 棒的價格
+        volume DOUBLE PRECISION,  -- 最新一根 K 棒的成交量
+        prev_close REAL,  -- 前一交易日收盤價
+        change_pct REAL,  -- 漲跌幅 (%)
+        vol_avg_20 DOUBLE PRECISION,  -- 不含當天的 20 日均量
+        vol_ratio REAL,  -- 成交量 / 20 日均量
+        sma_5 REAL, sma_20 REAL, sma_60 REAL,  -- 移動平均
+        rsi_14 REAL,  -- 14 日 RSI
+        macd_hist REAL,  -- MACD 柱狀值
+        atr_14 REAL,  -- 14 日 ATR
+        high_n REAL, low_n REAL,  -- 面板期間的最高價與最低價
+        pct_from_high REAL,  -- 距面板期間最高價 (%)
+        bars SMALLINT,  -- 面板期間的交易日數
+        refreshed_at TIMESTAMP NOT NULL  -- 計算時間（查詢端以此判斷是否需重新載入）
+    )
+    """)
+
+
+def _migration_9_rollups(cur):
+    """建立週線/月線彙總表 stock_weekly 與 stock_monthly，並由既有的 stock_data 回填"""
+    for table in rollups.ROLLUP_TABLES:
+        cur.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {table} (
+            ticker VARCHAR(10) NOT NULL,  -- 股票代號
+            date DATE NOT NULL,  -- 週期起始日（週為星期一、月為 1 日）
+            open REAL,  -- 週期內第一個交易日的開盤價
+            high REAL,  -- 週期內最高價
+            low REAL,  -- 週期內最低價
+            close REAL,  -- 週期內最後一個交易日的收盤價
+            volume BIGINT,  -- 週期內成交量合計
+            bars SMALLINT NOT NULL,  -- 週期內的交易日數
+            last_date DATE NOT NULL,  -- 週期內最後一個交易日
+            PRIMARY KEY (ticker, date)
+        )
+        """).format(table=sql.Identifier(table)))
+    rollups.refresh_rollups(cur)
+
+
+def _migration_10_adjustment_factors(cur):
+    """建立除權息事件與調整因子表 adjustment_factors"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS adjustment_factors (
+        ticker VARCHAR(10) NOT NULL,  -- 股票代號
+        date DATE NOT NULL,  -- 除權息日
+        dividend REAL NOT NULL DEFAULT 0,  -- 每股現金股利
+        split REAL NOT NULL DEFAULT 0,  -- 分割比例（2 表示 1 股分為 2 股，0 表示沒有分割）
+        factor DOUBLE PRECISION NOT NULL DEFAULT 1,  -- 套用於此日之前價格的因子
+        PRIMARY KEY (ticker, date)
+    )
+    """)
+
+
+def _migration_11_summary_changed_from(cur):
+    """stock_summary 加上 changed_from：上次快照匯出後最早被寫入的日期（快照增量匯出用來找出需重寫的年份）"""
+    cur.execute("ALTER TABLE stock_summary ADD COLUMN IF NOT EXISTS changed_from DATE")
+    # 不知道既有快照與資料庫的差異，視為全部變更（下次增量匯出會重寫全部年份）
+    cur.execute("UPDATE stock_summary SET changed_from = first_date")
+
+
+def _migration_12_backfill_empty_ranges(cur):
+    """backfill_ranges 加上 empty：下載結果為空的 (股票, 年份) 只在 BACKFILL_EMPTY_TTL_DAYS 內視為完成
+
+    空結果也可能是 yfinance 限流，既有記錄無法區分，一律視為空結果（之後會重新確認一次）。
+    """
+    cur.execute("ALTER TABLE backfill_ranges ADD COLUMN IF NOT EXISTS empty BOOLEAN NOT NULL DEFAULT TRUE")
+    cur.execute("ALTER TABLE backfill_ranges ALTER COLUMN empty SET DEFAULT FALSE")
+
+
+def _migration_13_legacy_prices(cur):
+    """建立 legacy_prices：仍保存 Yahoo 調整後價格的股票
+
+    第 10 版之前下載時 auto_adjust=True，stock_data 保存的是已調整的價格；既有數據無法區分原始與
+    調整後價格，已有數據的股票一律標記。adjustments.adjust 不對這些股票套用因子（避免重複調整），
+    選股與指標也不計算，直到 staged_reload 以原始價格重新載入後移除標記。
+    """
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS legacy_prices (
+        ticker VARCHAR(10) PRIMARY KEY,  -- 股票代號
+        flagged_at TIMESTAMP NOT NULL DEFAULT now()  -- 標記時間
+    )
+    """)
+    cur.execute("INSERT INTO legacy_prices (ticker) SELECT ticker FROM stock_summary ON CONFLICT (ticker) DO NOTHING")
+
+
+# 版本化遷移列表：(版本, 名稱, 函數)，只能在尾端追加，不可修改已發佈的項目
+MIGRATIONS = [
+    (1, 'base tables', _migration_1_base_tables),
+    (2, 'compact stock_data', _migration_2_compact_stock_data),
+    (3, 'stock_indicators', _migration_3_stock_indicators),
+    (4, 'update jobs', _migration_4_update_jobs),
+    (5, 'stock summary', _migration_5_stock_summary),
+    (6, 'backfill ranges', _migration_6_backfill_ranges),
+    (7, 'job queue', _migration_7_job_queue),
+    (8, 'screen latest', _migration_8_screen_latest),
+    (9, 'weekly and monthly rollups', _migration_9_rollups),
+    (10, 'adjustment factors', _migration_10_adjustment_factors),
+    (11, 'summary changed_from', _migration_11_summary_changed_from),
+    (12, 'backfill empty ranges', _migration_12_backfill_empty_ranges),
+    (13, 'legacy adjusted prices', _migration_13_legacy_prices),
+]
+
+_ensured = False  # 本進程是否已確認結構為最新
+_ensure_lock = threading.Lock()
+_partition_years = set()  # 已確認存在的 (資料表, 年份) 分區（不同分區表的同一年份分開記錄）
+
+
+def migrate():
+    """套用所有尚未執行的遷移
+
+    Returns:
+        list: 本次套用的遷移版本
+    """
+    applied = []
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,  -- 遷移版本
+                name TEXT NOT NULL,  -- 遷移名稱
+                applied_at TIMESTAMP NOT NULL  -- 套用時間
+            )
+            """)
+            cur.execute("SELECT version FROM schema_migrations")
+            done = {row[0] for row in cur.fetchall()}
+            for version, name, migration in MIGRATIONS:
+                if version in done:
+                    continue
+                migration(cur)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, %s)",
+                    (version, name, datetime.now()))
+                applied.append(version)
+                print(f"已套用遷移 {version}: {name}")
+        conn.commit()  # 所有遷移在同一事務中完成，失敗時整體回滾
+    return applied
+
+
+def ensure_schema():
+    """確保資料庫結構為最新（每個進程只實際檢查一次）"""
+    global _ensured
+    if _ensured:
+        return
+    with _ensure_lock:
+        if not _ensured:
+            migrate()
+            _ensured = True
+
+
+def reset():
+    """資料表被刪除後呼叫，下次寫入時重新建立結構"""
+    global _ensured
+    with _ensure_lock:
+        _ensured = False
+        _partition_years.clear()
+
+
+def ensure_partitions(cur, years, table='stock_data'):
+    """為分區表建立指定年份的分區（非分區表時不做任何事）
+
+    分區在呼叫端的事務中建立，事務可能回滾，因此不直接寫入快取：
+    呼叫端提交成功後以回傳值呼叫 remember_partitions。
+
+    Args:
+        cur: psycopg2 游標
+        years (iterable): 需要的年份
+        table (str): 資料表名稱
+
+    Returns:
+        set: 本次確認的 {(資料表, 年份)}（非分區表也記錄，避免重複檢查）
+    """
+    missing = {year for year in years if (table, year) not in _partition_years}
+    if not missing:
+        return set()
+    if is_partitioned(cur, table):
+        for year in sorted(missing):
+            cur.execute(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table}
+            FOR VALUES FROM (%s) TO (%s)
+            """).format(partition=sql.Identifier(f"{table}_{year}"), table=sql.Identifier(table)),
+                (f"{year}-01-01", f"{year + 1}-01-01"))
+    return {(table, year) for year in missing}
+
+
+def remember_partitions(keys):
+    """記錄已提交的分區（ensure_partitions 的回傳值），之後的寫入不再檢查"""
+    _partition_years.update(keys)
+
+
+def convert_to_partitioned(table='stock_data'):
+    """將既有的 stock_data 原地轉換為依年份分區的資料表（在同一事務中完成）"""
+    ensure_schema()
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            if is_partitioned(cur, table):
+                print(f"{table} 已是分區表")
+                return
+            legacy = f"{table}_unpartitioned"
+            cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(
+                sql.Identifier(table), sql.Identifier(legacy)))
+            # 舊表的約束與索引名稱需讓出，新表才能使用相同名稱
+            cur.execute(sql.SQL("ALTER TABLE {} RENAME CONSTRAINT {} TO {}").format(
+                sql.Identifier(legacy), sql.Identifier(f"{table}_pkey"), sql.Identifier(f"{legacy}_pkey")))
+            cur.execute(sql.SQL("ALTER INDEX IF EXISTS {} RENAME TO {}").format(
+                sql.Identifier(f"{table}_date_idx"), sql.Identifier(f"{legacy}_date_idx")))
+            create_stock_data_table(cur, table, partitioned=True)
+
+            cur.execute(sql.SQL(
+                "SELECT DISTINCT EXTRACT(YEAR FROM date)::int FROM {}").format(sql.Identifier(legacy)))
+            _partition_years.difference_update({key for key in _partition_years if key[0] == table})
+            created = ensure_partitions(cur, [row[0] for row in cur.fetchall()], table)
+            cur.execute(sql.SQL("INSERT INTO {} SELECT ticker, date, open, high, low, close, volume FROM {}")
+                        .format(sql.Identifier(table), sql.Identifier(legacy)))
+            cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(legacy)))
+        conn.commit()
+        remember_partitions(created)
+        print(f"{table} 已轉換為分區表")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'partition':
+        convert_to_partitioned()
+    else:
+        print(f"已套用遷移: {migrate() or '無'}")
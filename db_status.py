@@ -0,0 +1,178 @@
+import os
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+# 加載 .env 文件中的環境變數
+load_dotenv()
+
+import db_pool
+import metrics
+
+# 狀態查詢設定（可由 .env 覆蓋）
+STALE_DAYS = int(os.getenv('STATUS_STALE_DAYS', 7))  # 最新日期落後全體最新日期超過此天數視為過期
+STALE_LIMIT = int(os.getenv('STATUS_STALE_LIMIT', 200))  # 最多列出的過期股票數
+
+# 回報大小的資料表（分區表會加總所有分區）
+STATUS_TABLES = ['stock_data', 'stock_codes', 'code_validity', 'stock_summary', 'stock_indicators',
+                 'screen_latest', 'stock_weekly', 'stock_monthly', 'adjustment_factors']
+
+
+def _day(value):
+    """日期轉為 YYYY-MM-DD 字串（與 /api/stock 的日期格式一致）"""
+    return value.strftime('%Y-%m-%d') if value else None
+
+
+def refresh_summary(cur, since, until, inserted):
+    """以本次寫入更新指定股票的摘要（在寫入 stock_data 的同一事務中呼叫）
+
+    不重新計數：列數加上本次新增（而非更新）的列數，日期範圍與本次寫入的範圍合併，
+    成本只與本次寫入的股票數有關，與股票的歷史長度無關。多個事務同時寫入同一支股票時，
+    各自的增量在摘要列上依序累加。changed_from 保留上次快照匯出後最早被寫入的日期，
+    供 snapshot_export 找出需重寫的年份。數據被外部修改後以 rebuild_summary 重建。
+
+    Args:
+        cur: psycopg2 游標
+        since (pd.Series): 股票代號 -> 本次寫入的最早日期
+        until (pd.Series): 股票代號 -> 本次寫入的最晚日期
+        inserted (pd.Series): 股票代號 -> 本次新增的列數（bulk_load.upsert_rows 的回傳值）
+    """
+    if since.empty:
+        return
+    inserted = inserted.reindex(since.index, fill_value=0)
+    cur.execute("""
+    INSERT INTO stock_summary (ticker, row_count, first_date, last_date, updated_at, changed_from)
+    SELECT c.ticker, c.inserted, c.since, c.until, now(), c.since
+    FROM unnest(%s::varchar[], %s::int[], %s::date[], %s::date[]) AS c(ticker, inserted, since, until)
+    ON CONFLICT (ticker) DO UPDATE SET
+        row_count = stock_summary.row_count + EXCLUDED.row_count,
+        first_date = LEAST(stock_summary.first_date, EXCLUDED.first_date),
+        last_date = GREATEST(stock_summary.last_date, EXCLUDED.last_date),
+        updated_at = EXCLUDED.updated_at,
+        changed_from = LEAST(stock_summary.changed_from, EXCLUDED.changed_from)
+    """, (since.index.tolist(), [int(count) for count in inserted], since.tolist(),
+          until.reindex(since.index).tolist()))
+
+
+@metrics.timed(metrics.DB_SECONDS, op='data_version')
+def data_version(ticker):
+    """股票的資料版本：stock_summary 的最後寫入時間（與數據同一事務更新，任何進程的寫入都會改變）
+
+    Args:
+        ticker (str): 股票代號
+
+    Returns:
+        datetime: 含時區的最後寫入時間；沒有數據或資料表尚未建立時為 None
+    """
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('public.stock_summary') IS NOT NULL")
+            version = None
+            if cur.fetchone()[0]:
+                cur.execute("""
+                SELECT updated_at AT TIME ZONE current_setting('TimeZone') FROM stock_summary WHERE ticker = %s
+                """, (ticker,))
+                row = cur.fetchone()
+                version = row[0] if row else None
+        conn.commit()
+    return version
+
+
+def table_sizes(cur, tables=STATUS_TABLES):
+    """以 pg_class 統計值取得各表的估計列數與磁碟大小（不掃描資料表）
+
+    Returns:
+        dict: {表名: {"estimated_rows": 估計列數（尚未 ANALYZE 時為 None）, "total_bytes": 含索引的大小}}
+    """
+    cur.execute("""
+    SELECT parent.relname,
+           SUM(CASE WHEN c.reltuples < 0 THEN NULL ELSE c.reltuples END)::bigint,
+           SUM(pg_total_relation_size(c.oid))::bigint
+    FROM pg_class parent
+    JOIN pg_namespace n ON n.oid = parent.relnamespace AND n.nspname = 'public'
+    LEFT JOIN pg_inherits i ON i.inhparent = parent.oid
+    JOIN pg_class c ON c.oid = COALESCE(i.inhrelid, parent.oid)
+    WHERE parent.relname = ANY(%s)
+    GROUP BY parent.relname
+    """, (list(tables),))
+    return {name: {"estimated_rows": rows, "total_bytes": size} for name, rows, size in cur.fetchall()}
+
+
+@metrics.timed(metrics.DB_SECONDS, op='get_status')
+def get_status(detail=False, stale_days=STALE_DAYS):
+    """資料庫狀態摘要（只讀取 stock_summary 與系統目錄）
+
+    Args:
+        detail (bool): 是否附上每支股票的列數與日期範圍
+        stale_days (int): 過期門檻天數
+
+    Returns:
+        dict: {"empty", "tickers", "rows", "first_date", "last_date", "latest", "days_since_update",
+               "stale_count", "stale", "legacy_tickers", "tables", ["per_ticker"]}；資料表尚未建立時 empty 為 True
+              legacy_tickers 為仍保存舊版調整後價格、需重新載入的股票數
+    """
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('public.stock_summary') IS NOT NULL")
+            if not cur.fetchone()[0]:
+                conn.commit()
+                return {"empty": True, "tables": {}}
+
+            cur.execute("SELECT COUNT(*), SUM(row_count), MIN(first_date), MAX(last_date) FROM stock_summary")
+            tickers, rows, first_date, last_date = cur.fetchone()
+            status = {
+                "empty": not tickers,
+                "tickers": tickers,
+                "rows": int(rows or 0),
+                "first_date": _day(first_date),
+                "last_date": _day(last_date),
+                "latest": None,
+                "days_since_update": (datetime.now().date() - last_date).days if last_date else None,
+                "stale_count": 0,
+                "stale": [],
+            }
+
+            if last_date:
+                # 最新交易日中代號最大的一筆（與 get_last_updated_stock 相同定義）
+                cur.execute("""
+                SELECT ticker, last_date FROM stock_summary
+                ORDER BY last_date DESC, ticker DESC LIMIT 1
+                """)
+                ticker, date = cur.fetchone()
+                status["latest"] = {"ticker": ticker, "date": _day(date)}
+
+                threshold = last_date - timedelta(days=stale_days)
+                cur.execute("SELECT COUNT(*) FROM stock_summary WHERE last_date < %s", (threshold,))
+                status["stale_count"] = cur.fetchone()[0]
+                cur.execute("""
+                SELECT ticker, last_date FROM stock_summary WHERE last_date < %s
+                ORDER BY last_date, ticker LIMIT %s
+                """, (threshold, STALE_LIMIT))
+                status["stale"] = [{"ticker": t, "last_date": _day(d)} for t, d in cur.fetchall()]
+
+            cur.execute("SELECT to_regclass('public.legacy_prices') IS NOT NULL")
+            if cur.fetchone()[0]:
+                cur.execute("SELECT COUNT(*) FROM legacy_prices")
+                status["legacy_tickers"] = cur.fetchone()[0]
+            else:
+                status["legacy_tickers"] = 0
+
+            if detail:
+                cur.execute("SELECT ticker, row_count, first_date, last_date FROM stock_summary ORDER BY ticker")
+                status["per_ticker"] = [{"ticker": t, "rows": n, "first_date": _day(f), "last_date": _day(l)}
+                                        for t, n, f, l in cur.fetchall()]
+
+            status["tables"] = table_sizes(cur)
+        conn.commit()
+    return status
+
+
+def rebuild_summary():
+    """由 stock_data 完整重建 stock_summary（資料被外部修改後使用）"""
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM stock_summary")
+            cur.execute("""
+            INSERT INTO stock_summary (ticker, row_count, first_date, last_date, changed_from)
+            SELECT ticker, COUNT(*), MIN(date), MAX(date), MIN(date) FROM stock_data GROUP BY ticker
+            """)
+        conn.commit()
@@ -1,64 +1,42 @@
 import psycopg2
+from psycopg2 import sql
 
-import os
 from dotenv import load_dotenv
 # 加載 .env 文件中的環境變數
 load_dotenv()
 
+import db_pool  # 共用資料庫連接池
+import db_schema  # 資料表結構與遷移
+
 def drop_all_tables():
     """刪除 PostgreSQL 資料庫中的所有資料表。
 
-    此函數連接到指定的 PostgreSQL 資料庫，獲取所有資料表名稱，並逐一刪除它們。
+    此函數連接到指定的 PostgreSQL 資料庫，獲取所有資料表名稱，並以單一 DROP TABLE 語句一次刪除
+    （同一事務內完成，不逐表往返，也不會刪到一半留下不完整的結構）。
+    只需要重新載入數據時，使用 staged_reload 在影子表中載入後原子切換，讀取端不會中斷。
     """
     try:
-        # 連接到 PostgreSQL 資料庫
-        conn = psycopg2.connect(
-            dbname = os.getenv('DB_NAME'), # 資料庫名稱
-            user = os.getenv('DB_USER'), # 使用者名稱
-            password = os.getenv('DB_PASSWORD'), # 密碼
-            host = os.getenv('DB_HOST'), # 主機地址
-            port = os.getenv('DB_PORT') # 端口號
-        )
-        
-        # 創建一個游標對象，用於執行 SQL 查詢
-        cursor = conn.cursor()
-
-        # 獲取所有資料表名稱
-        cursor.execute("""
-            SELECT tablename FROM pg_tables --pg_tables包含了資料庫中所有資料表
-            WHERE schemaname = 'public';  -- 只查詢 public 的資料表
-        """)
-        tables = cursor.fetchall()  # 獲取所有資料表名稱的列表
+        # 從共用連接池借用連接，並創建一個游標對象，用於執行 SQL 查詢
+        with db_pool.connection() as conn, conn.cursor() as cursor:
+            # 獲取所有資料表名稱（分區由父表一起刪除，不另外列出）
+            cursor.execute("""
+                SELECT c.relname FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition;
+            """)
+            tables = [row[0] for row in cursor.fetchall()]  # 獲取所有資料表名稱的列表
+
+            if tables:
+                # 一條語句刪除所有資料表，CASCADE 一併處理外鍵依賴
+                cursor.execute(sql.SQL("DROP TABLE IF EXISTS {} CASCADE").format(
+                    sql.SQL(', ').join(map(sql.Identifier, tables))))
+            # 提交變更，確保所有刪除操作生效
+            conn.commit()
+            db_schema.reset()  # 下次寫入時重新建立資料表
 
-        # 刪除所有資料表
         for table in tables:
-            cursor.execute(f"DROP TABLE IF EXISTS {table[0]} CASCADE;")  # 刪除資料表，若存在則刪除
-            print(f"已刪除資料表: {table[0]}")  # 輸出已刪除的資料表名稱
-
-        # 提交變更，確保所有刪除操作生效
-        conn.commit()
-
-        # 確認資料表已被刪除
-        cursor.execute("""
-            SELECT tablename FROM pg_tables
-            WHERE schemaname = 'public';  -- 再次查詢以確認是否還有資料表存在
-        """)
-        remaining_tables = cursor.fetchall()  # 獲取剩餘的資料表名稱
-
-        # 檢查是否還有資料表存在
-        if not remaining_tables:
-            print("所有資料表已成功刪除。")  # 如果沒有剩餘資料表，則輸出成功訊息
-        else:
-            print("仍有資料表存在：")  # 如果還有資料表，則輸出剩餘資料表名稱
-            for remaining in remaining_tables:
-                print(remaining[0])  # 輸出每個剩餘的資料表名稱
+            print(f"已刪除資料表: {table}")  # 輸出已刪除的資料表名稱
+        print("所有資料表已成功刪除。")
 
     except (Exception, psycopg2.DatabaseError) as error:
         print("發生錯誤：", error)  # 捕捉並輸出任何錯誤訊息
-    finally:
-        # 確保游標和連接在結束時被關閉
-        if cursor:
-            cursor.close()  # 關閉游標
-        if conn:
-            conn.close()  # 關閉資料庫連接
-
@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import deque
+
+# 事件日誌容量與每次查詢返回的上限（可由 .env 覆蓋）
+EVENT_LOG_SIZE = int(os.getenv('EVENT_LOG_SIZE', 1000))  # 最多保留的事件數，超過時丟棄最舊的
+EVENT_PAGE_SIZE = int(os.getenv('EVENT_PAGE_SIZE', 200))  # 每次查詢最多返回的事件數
+
+
+class EventLog:
+    """線程安全、容量有限的事件日誌（環形緩衝區）
+
+    每個事件有遞增的序號，客戶端記住最後看到的序號，之後只取新事件，
+    回應大小與任務長度無關。clear() 只清空內容，序號繼續遞增。
+    """
+
+    def __init__(self, maxlen=EVENT_LOG_SIZE):
+        self._events = deque(maxlen=maxlen)  # (序號, 訊息)
+        self._seq = 0  # 最後一個事件的序號
+        self._cond = threading.Condition()
+
+    def append(self, message):
+        """新增事件並喚醒等待中的串流
+
+        Returns:
+            int: 事件序號
+        """
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, str(message)))
+            self._cond.notify_all()
+            return self._seq
+
+    def since(self, after=None, limit=EVENT_PAGE_SIZE):
+        """取得序號大於 after 的事件
+
+        Args:
+            after (int): 客戶端最後看到的序號；None 表示只要最近的 limit 個事件
+            limit (int): 最多返回的事件數，None 表示不限
+
+        Returns:
+            tuple: ([(序號, 訊息), ...] 依序號排列, 目前最後的序號)
+        """
+        with self._cond:
+            if after is None:
+                events = list(self._events)[-limit:] if limit else list(self._events)
+                return events, self._seq
+            if after > self._seq:
+                after = 0  # 序號比伺服器新（例如伺服器已重啟），從頭開始
+            # 事件依序號連續存放，直接由序號差計算起點，不必逐一比較
+            first = self._events[0][0] if self._events else self._seq + 1
+            start = max(0, after + 1 - first)
+            stop = start + limit if limit else len(self._events)
+            events = [self._events[i] for i in range(start, min(stop, len(self._events)))]
+            return events, self._seq
+
+    def wait(self, after, timeout=None):
+        """等待序號大於 after 的事件出現
+
+        Returns:
+            bool: True=有新事件, False=逾時
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq > after, timeout)
+
+    def last_seq(self):
+        with self._cond:
+            return self._seq
+
+    def clear(self):
+        with self._cond:
+            self._events.clear()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._events)
@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import adjustments
+import bulk_load
+import db_pool
+import db_schema
+import metrics
+import read_db_tables
+
+# 寫入 stock_indicators 的指標欄位
+INDICATOR_COLUMNS = ['sma_5', 'sma_20', 'sma_60', 'ema_12', 'ema_26', 'rsi_14',
+                     'macd', 'macd_signal', 'macd_hist', 'bb_upper', 'bb_lower', 'atr_14']
+
+# 是否在 write_db_tables 完成後計算並保存指標（可由 .env 設定）
+PERSIST_INDICATORS = os.getenv('PERSIST_INDICATORS', '0') == '1'
+
+
+def to_panels(data, fields):
+    """將長表（date 索引 + ticker 欄位）一次轉為多個 日期×股票 的面板
+
+    Args:
+        data (pd.DataFrame): read_db_tables.read_stock_data 的回傳結果
+        fields (list): 欄位名稱，例如 ['high', 'low', 'close']
+
+    Returns:
+        dict: {欄位名稱: 面板}，面板索引為日期、欄位為股票代號；某股票當天無交易時為 NaN
+    """
+    wide = data.set_index('ticker', append=True)[list(fields)].unstack('ticker')
+    return {field: wide[field] for field in fields}
+
+
+def sma(close, window=20):
+    """簡單移動平均（視窗內有缺值時為 NaN）"""
+    return close.rolling(window, min_periods=window).mean()
+
+
+def ema(close, span):
+    """指數移動平均"""
+    return close.ewm(span=span, adjust=False, ignore_na=True).mean()
+
+
+def rsi(close, period=14):
+    """相對強弱指標（Wilder 平滑）"""
+    delta = close.diff()
+    gain = delta.clip(lower=0)
+    loss = -delta.clip(upper=0)
+    avg_gain = gain.ewm(alpha=1 / period, adjust=False, min_periods=period, ignore_na=True).mean()
+    avg_loss = loss.ewm(alpha=1 / period, adjust=False, min_periods=period, ignore_na=True).mean()
+    rs = avg_gain / avg_loss
+    return 100 - 100 / (1 + rs)
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    """MACD 指標
+
+    Returns:
+        tuple: (MACD 線, 訊號線, 柱狀圖)
+    """
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = line.ewm(span=signal, adjust=False, ignore_na=True).mean()
+    return line, signal_line, line - signal_line
+
+
+def bollinger(close, window=20, num_std=2.0):
+    """布林通道
+
+    Returns:
+        tuple: (中軌, 上軌, 下軌)
+    """
+    mid = sma(close, window)
+    std = close.rolling(window, min_periods=window).std(ddof=0)
+    return mid, mid + num_std * std, mid - num_std * std
+
+
+def atr(high, low, close, period=14):
+    """平均真實區間（Wilder 平滑）"""
+    prev_close = close.shift(1)
+    true_range = np.fmax(high - low, np.fmax((high - prev_close).abs(), (low - prev_close).abs()))
+    return true_range.ewm(alpha=1 / period, adjust=False, min_periods=period, ignore_na=True).mean()
+
+
+def compute_indicators(data):
+    """一次計算多支股票的所有技術指標
+
+    各指標在 日期×股票 面板上以 rolling/ewm 整欄運算，不逐列迴圈。
+
+    Args:
+        data (pd.DataFrame): 含 ticker, high, low, close 欄位、以 date 為索引的長表
+
+    Returns:
+        pd.DataFrame: 以 date 為索引，含 ticker 與 INDICATOR_COLUMNS 欄位；只保留有收盤價的日期
+    """
+    if data.empty:
+        return pd.DataFrame(columns=['ticker'] + INDICATOR_COLUMNS, index=pd.DatetimeIndex([], name='date'))
+
+    panels = to_panels(data, ['high', 'low', 'close'])
+    close, high, low = panels['close'], panels['high'], panels['low']
+
+    macd_line, macd_signal, macd_hist = macd(close)
+    _, bb_upper, bb_lower = bollinger(close)
+    results = {
+        'sma_5': sma(close, 5),
+        'sma_20': sma(close, 20),
+        'sma_60': sma(close, 60),
+        'ema_12': ema(close, 12),
+        'ema_26': ema(close, 26),
+        'rsi_14': rsi(close, 14),
+        'macd': macd_line,
+        'macd_signal': macd_signal,
+        'macd_hist': macd_hist,
+        'bb_upper': bb_upper,
+        'bb_lower': bb_lower,
+        'atr_14': atr(high, low, close, 14),
+    }
+
+    # 面板攤平回長表：日期重複、代號平鋪，並去掉當天無交易的格子
+    n_dates, n_tickers = close.shape
+    keep = ~np.isnan(close.to_numpy(dtype='float64').ravel())
+    columns = {'ticker': np.tile(close.columns.to_numpy(dtype=object), n_dates)[keep]}
+    for name in INDICATOR_COLUMNS:
+        columns[name] = results[name].to_numpy(dtype='float64').ravel()[keep]
+    index = pd.DatetimeIndex(np.repeat(close.index.to_numpy(), n_tickers)[keep], name='date')
+    return pd.DataFrame(columns, index=index)
+
+
+@metrics.timed(metrics.DB_SECONDS, op='update_indicators')
+def update_indicators(tickers, chunk_size=200, log=None):
+    """讀取股票歷史數據、以除權息調整後的價格計算指標並寫入 stock_indicators 表
+
+    Args:
+        tickers (list): 股票代號列表（legacy_prices 中的股票重新載入前略過）
+        chunk_size (int): 每次讀取與計算的股票數（控制記憶體用量）
+        log (callable): 訊息輸出函數
+
+    Returns:
+        int: 寫入的資料列數
+    """
+    log = log or print
+    columns = ['ticker', 'date'] + INDICATOR_COLUMNS
+    written = 0
+    db_schema.ensure_schema()
+    tickers = adjustments.trusted(tickers)
+    for i in range(0, len(tickers), chunk_size):
+        chunk = tickers[i:i + chunk_size]
+        # stock_data 保存原始價格，除權息日會造成價格跳空，先調整再計算
+        data = adjustments.adjust(read_db_tables.read_stock_data(chunk, columns=['high', 'low', 'close']))
+        result = compute_indicators(data)
+        if result.empty:
+            continue
+        rows = result.reset_index()
+        rows['date'] = rows['date'].dt.date
+        try:
+            with db_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    bulk_load.upsert_rows(cur, rows, 'stock_indicators', columns)
+                conn.commit()
+            written += len(rows)
+        except Exception as e:
+            log(f"指標寫入異常: {e}")
+    log(f"技術指標已更新: {len(tickers)} 支股票，{written} 列")
+    return written
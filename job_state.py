@@ -0,0 +1,143 @@
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+# 加載 .env 文件中的環境變數
+load_dotenv()
+
+import db_pool
+import db_schema
+import metrics
+
+# 未完成的任務狀態：重啟或中斷後可續接
+RESUMABLE_STATUSES = ('running', 'stopped', 'failed')
+
+
+@metrics.timed(metrics.DB_SECONDS, op='create_job')
+def create_job(start_idx, total, incremental):
+    """建立新的更新任務
+
+    Args:
+        start_idx (int): 起始代號
+        total (int): 候選代號數
+        incremental (bool): 是否為增量更新
+
+    Returns:
+        int: 任務編號，寫入失敗時返回 None（更新流程照常執行，只是無法續接）
+    """
+    try:
+        db_schema.ensure_schema()  # update_jobs 表由結構遷移建立
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                INSERT INTO update_jobs (start_idx, total, incremental)
+                VALUES (%s, %s, %s) RETURNING job_id
+                """, (start_idx, total, incremental))
+                job_id = cur.fetchone()[0]
+            conn.commit()
+        return job_id
+    except Exception as e:
+        print(f"建立更新任務異常: {e}")
+        return None
+
+
+@metrics.timed(metrics.DB_SECONDS, op='find_resumable_job')
+def find_resumable_job():
+    """找出最近一個未完成的任務（進程重啟時仍為 running 的任務也算）
+
+    Returns:
+        dict: {"job_id", "start_idx", "total", "incremental", "status"}，沒有時返回 None
+    """
+    try:
+        db_schema.ensure_schema()
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                SELECT job_id, start_idx, total, incremental, status FROM update_jobs
+                WHERE status IN %s ORDER BY job_id DESC LIMIT 1
+                """, (RESUMABLE_STATUSES,))
+                row = cur.fetchone()
+            conn.commit()
+    except Exception as e:
+        print(f"讀取更新任務異常: {e}")
+        return None
+    if row is None:
+        return None
+    return dict(zip(("job_id", "start_idx", "total", "incremental", "status"), row))
+
+
+@metrics.timed(metrics.DB_SECONDS, op='load_job_items')
+def load_items(job_id):
+    """讀取任務的檢查點
+
+    Returns:
+        dict: {股票代號: 狀態}，狀態為 invalid（無效）、valid（有效但未寫入）或 done（已寫入）
+    """
+    if job_id is None:
+        return {}
+    try:
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT ticker, state FROM update_job_items WHERE job_id = %s", (job_id,))
+                items = dict(cur.fetchall())
+            conn.commit()
+        return items
+    except Exception as e:
+        print(f"讀取任務檢查點異常: {e}")
+        return {}
+
+
+def mark_items(cur, job_id, states):
+    """以指定游標記錄檢查點（由呼叫端決定提交時機，可與數據寫入同一事務）
+
+    Args:
+        cur: psycopg2 游標
+        job_id (int): 任務編號
+        states (dict): {股票代號: 狀態}
+    """
+    if job_id is None or not states:
+        return
+    execute_values(cur, """
+    INSERT INTO update_job_items (job_id, ticker, state) VALUES %s
+    ON CONFLICT (job_id, ticker) DO UPDATE SET state = EXCLUDED.state
+    """, [(job_id, ticker, state) for ticker, state in states.items()])
+    cur.execute("UPDATE update_jobs SET updated_at = now() WHERE job_id = %s", (job_id,))
+
+
+@metrics.timed(metrics.DB_SECONDS, op='record_job_items')
+def record_items(job_id, states):
+    """記錄檢查點並立即提交
+
+    Args:
+        job_id (int): 任務編號
+        states (dict): {股票代號: 狀態}
+    """
+    if job_id is None or not states:
+        return
+    try:
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                mark_items(cur, job_id, states)
+            conn.commit()
+    except Exception as e:
+        print(f"寫入任務檢查點異常: {e}")
+
+
+@metrics.timed(metrics.DB_SECONDS, op='finish_job')
+def finish_job(job_id, status):
+    """更新任務狀態；完成的任務刪除其檢查點，不佔用空間
+
+    Args:
+        job_id (int): 任務編號
+        status (str): stopped / failed / done
+    """
+    if job_id is None:
+        return
+    try:
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE update_jobs SET status = %s, updated_at = now() WHERE job_id = %s",
+                            (status, job_id))
+                if status == 'done':
+                    cur.execute("DELETE FROM update_job_items WHERE job_id = %s", (job_id,))
+            conn.commit()
+    except Exception as e:
+        print(f"更新任務狀態異常: {e}")
@@ -0,0 +1,66 @@
+"""/api/stock 延遲測試：比較有無 LRU 快取時的 p50/p99
+
+以 Flask test client 在本進程內發送請求（不需另外啟動伺服器），
+資料庫使用 .env 設定，需先有 stock_data 數據。
+
+用法: python load_test_api.py [請求數] [股票代號,...]
+"""
+import sys
+import time
+
+import numpy as np
+
+import api_cache
+import app
+import read_db_tables
+
+
+def run(client, tickers, requests, headers_for=None):
+    """依序請求並記錄每次延遲（毫秒）"""
+    latencies = []
+    statuses = {}
+    for i in range(requests):
+        ticker = tickers[i % len(tickers)]
+        headers = headers_for(ticker) if headers_for else {}
+        start = time.perf_counter()
+        response = client.get(f'/api/stock/{ticker}', headers=headers)
+        latencies.append((time.perf_counter() - start) * 1000)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return np.array(latencies), statuses
+
+
+def report(name, latencies, statuses):
+    print(f"{name:<20} p50 {np.percentile(latencies, 50):8.2f} ms  "
+          f"p99 {np.percentile(latencies, 99):8.2f} ms  狀態 {statuses}")
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    if len(sys.argv) > 2:
+        tickers = sys.argv[2].split(',')
+    else:
+        sample = read_db_tables.read_stock_data([f"{i:04d}.TW" for i in range(10000)], columns=['close'])
+        tickers = sorted(sample['ticker'].unique())[:10] if not sample.empty else ['2330.TW']
+    print(f"{requests} 次請求，熱門股票: {', '.join(tickers)}")
+
+    client = app.app.test_client()
+
+    # 無快取：容量設為 0，每次都查詢 PostgreSQL
+    api_cache.CACHE.maxsize = 0
+    api_cache.CACHE.clear()
+    report("無快取", *run(client, tickers, requests))
+
+    # 有快取：先預熱，之後由記憶體返回
+    api_cache.CACHE.maxsize = api_cache.API_CACHE_SIZE
+    run(client, tickers, len(tickers))
+    report("LRU 快取", *run(client, tickers, requests))
+
+    # 條件請求：帶上 ETag，未變更時返回 304 且不傳送內容
+    etags = {t: client.get(f'/api/stock/{t}').headers['ETag'] for t in tickers}
+    report("快取 + ETag (304)", *run(client, tickers, requests,
+                                    headers_for=lambda t: {'If-None-Match': etags[t]}))
+    print(f"快取統計: {api_cache.CACHE.stats()}")
+
+
+if __name__ == "__main__":
+    main()
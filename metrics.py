@@ -0,0 +1,202 @@
+"""進程內計數器與延遲直方圖，以 Prometheus 文字格式輸出（/metrics）
+
+只記錄本進程的數值；分片模式下子進程的數據不會出現在主進程的 /metrics 中。
+"""
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+# 延遲直方圖的預設區間上限（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REGISTRY = []  # 已註冊的指標，依註冊順序輸出
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}  # 標籤值 tuple -> 數值
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} 需要標籤 {self.label_names}，收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self._header()
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """只增不減的計數器"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """可任意設定的數值"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """延遲直方圖：各區間累計次數、總和與次數"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            idx = bisect.bisect_left(self.buckets, value)  # 第一個 >= value 的區間
+            if idx < len(self.buckets):
+                state["buckets"][idx] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """計時區塊（發生例外時也會記錄）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def summaries(self):
+        """{標籤值 tuple: {"count": 次數, "sum": 總秒數}}，供基準測試彙總"""
+        with self._lock:
+            return {key: {"count": state["count"], "sum": state["sum"]} for key, state in self._values.items()}
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, dict(state, buckets=list(state["buckets"])))
+                           for key, state in self._values.items())
+        lines = self._header()
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["buckets"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', '+Inf')])} {state['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {state['count']}")
+        return lines
+
+
+def timed(histogram, **labels):
+    """裝飾器：記錄函數每次執行的秒數
+
+    生成器函數記錄的是生成器自身執行的累計秒數（不含呼叫端處理每個產出項的時間），
+    在生成器結束或被關閉時記錄一次。
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                elapsed = 0.0
+                generator = func(*args, **kwargs)
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            value = next(generator)
+                        except StopIteration:
+                            return
+                        finally:
+                            elapsed += time.perf_counter() - start
+                        yield value
+                finally:
+                    generator.close()
+                    histogram.observe(elapsed, **labels)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render():
+    """所有指標的 Prometheus 文字格式"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """清空所有指標的數值（基準測試每輪開始前使用）"""
+    for metric in REGISTRY:
+        metric.clear()
+
+
+# 更新流程各階段與資料庫操作的指標
+STAGE_SECONDS = Histogram('stock_update_stage_seconds', '每個管線項目在各階段的處理秒數', ['stage'])
+CODE_CHECK_SECONDS = Histogram('stock_code_check_seconds', '單一代號檢查的秒數')
+CODE_CHECKS = Counter('stock_code_checks_total', '代號檢查次數', ['result'])
+DOWNLOAD_SECONDS = Histogram('stock_download_seconds_per_ticker', '批次下載耗時平均到每支股票的秒數')
+DOWNLOAD_REQUESTS = Counter('stock_download_requests_total', '批次下載請求數', ['result'])
+TICKERS_DOWNLOADED = Counter('stock_download_tickers_total', '批次下載請求的股票數')
+DB_SECONDS = Histogram('stock_db_seconds', '資料庫操作的秒數', ['op'])
+ROWS_WRITTEN = Counter('stock_rows_written_total', '寫入 stock_data 的資料列數')
+UPDATE_RUNNING = Gauge('stock_update_running', '是否有更新任務執行中')
+POOL_CONNECTIONS = Gauge('stock_db_pool_connections', '連接池中的連接數', ['state'])
+POOL_EVENTS = Gauge('stock_db_pool_events', '連接池累計事件數', ['event'])
@@ -1,13 +1,18 @@
+import numpy as np
 import psycopg2
 import pandas as pd
+from psycopg2 import sql
 
-import os
 from dotenv import load_dotenv
 # 加載 .env 文件中的環境變數
 load_dotenv()
 
+import db_pool  # 共用資料庫連接池
+import metrics  # 資料庫操作耗時
 
 
+
+@metrics.timed(metrics.DB_SECONDS, op='fetch_stock_data')
 def fetch_stock_data(ticker):
     """根據股票代碼從 PostgreSQL 資料庫中獲取股票數據。
 
@@ -18,29 +23,19 @@ def fetch_stock_data(ticker):
     pd.DataFrame: 包含股票數據的 DataFrame
     """
     try:
-        # 連接到 PostgreSQL 資料庫
-        conn = psycopg2.connect(
-            dbname = os.getenv('DB_NAME'), # 資料庫名稱
-            user = os.getenv('DB_USER'), # 使用者名稱
-            password = os.getenv('DB_PASSWORD'), # 密碼
-            host = os.getenv('DB_HOST'), # 主機地址
-            port = os.getenv('DB_PORT') # 端口號
-        )
-
-        # 創建一個游標對象
-        cursor = conn.cursor()
-
-        # 定義查詢語句
-        query = "SELECT * FROM stock_data WHERE ticker = %s;"
+        # 從共用連接池借用連接，並創建一個游標對象
+        with db_pool.connection() as conn, conn.cursor() as cursor:
+            # 定義查詢語句
+            query = "SELECT * FROM stock_data WHERE ticker = %s;"
 
-        # 執行查詢
-        cursor.execute(query, (ticker,))
+            # 執行查詢
+            cursor.execute(query, (ticker,))
 
-        # 獲取查詢結果
-        rows = cursor.fetchall()
+            # 獲取查詢結果
+            rows = cursor.fetchall()
 
-        # 獲取欄位名稱
-        colnames = [desc[0] for desc in cursor.description]
+            # 獲取欄位名稱
+            colnames = [desc[0] for desc in cursor.description]
 
         # 將結果轉換為 Pandas DataFrame
         df = pd.DataFrame(rows, columns=colnames)
@@ -53,14 +48,107 @@ def fetch_stock_data(ticker):
         print("發生錯誤：", e)
         df = pd.DataFrame()  # 返回空的 DataFrame
 
-    finally:
-        # 確保游標和連接在結束時被關閉
-        if cursor:
-            cursor.close()  # 關閉游標
-        if conn:
-            conn.close()  # 關閉資料庫連接
-
     return df
 
 
 
+# 可查詢的價格欄位（防止欄位名稱注入）
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def _build_query(tickers, start=None, end=None, columns=None, table='stock_data'):
+    """組合查詢語句與參數
+
+    日期以距 1970-01-01 的天數取出，之後可直接轉為 datetime64，不必逐筆解析 date 物件。
+    table 可為 stock_data 或欄位相同的週線/月線彙總表（date 為週期起始日）。
+    """
+    columns = list(columns or PRICE_COLUMNS)
+    invalid = set(columns) - set(PRICE_COLUMNS)
+    if invalid:
+        raise ValueError(f"不支援的欄位: {sorted(invalid)}")
+
+    query = sql.SQL("SELECT ticker, (date - DATE '1970-01-01') AS day, {columns} FROM {table} "
+                    "WHERE ticker = ANY(%s)").format(
+        columns=sql.SQL(', ').join(map(sql.Identifier, columns)), table=sql.Identifier(table))
+    params = [list(tickers)]
+    if start is not None:
+        query += sql.SQL(" AND date >= %s")
+        params.append(start)
+    if end is not None:
+        query += sql.SQL(" AND date <= %s")
+        params.append(end)
+    query += sql.SQL(" ORDER BY ticker, date")
+    return query, params, columns
+
+
+def _rows_to_frame(rows, columns):
+    """將一批查詢結果依欄位轉為 DataFrame（以 zip 一次轉置，不逐列建立 Series）"""
+    if not rows:
+        return pd.DataFrame(columns=['ticker'] + columns,
+                            index=pd.DatetimeIndex([], name='date'))
+    tickers, days, *values = zip(*rows)
+    data = {'ticker': np.array(tickers, dtype=object)}
+    for name, column in zip(columns, values):
+        array = np.array(column, dtype='float64')  # NULL 會轉為 NaN
+        if name == 'volume' and not np.isnan(array).any():
+            array = array.astype('int64')
+        data[name] = array
+    index = pd.DatetimeIndex(np.array(days, dtype='int64').astype('datetime64[D]').astype('datetime64[ns]'),
+                             name='date')
+    return pd.DataFrame(data, index=index)
+
+
+def iter_stock_data(tickers, start=None, end=None, columns=None, chunk_size=50000, table='stock_data'):
+    """以伺服器端游標分段讀取股票數據（生成器模式，記憶體用量與 chunk_size 成正比）
+
+    參數:
+    tickers (str | list): 股票代碼或代碼列表，例如 ['2308.TW', '2330.TW']
+    start (date | str): 起始日期（含），None 表示不限
+    end (date | str): 結束日期（含），None 表示不限
+    columns (list): 要讀取的欄位，預設為 open/high/low/close/volume
+    chunk_size (int): 每次從伺服器取回的列數
+    table (str): 讀取的資料表，stock_data 或 stock_weekly / stock_monthly
+
+    返回:
+    generator: 逐段產出以 date 為 DatetimeIndex、含 ticker 欄位的 DataFrame
+    """
+    if isinstance(tickers, str):
+        tickers = [tickers]
+    query, params, columns = _build_query(tickers, start, end, columns, table)
+
+    with db_pool.connection() as conn:
+        # 具名游標 = 伺服器端游標，結果留在 PostgreSQL 端分段傳回
+        with conn.cursor(name='read_stock_data') as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield _rows_to_frame(rows, columns)
+
+
+@metrics.timed(metrics.DB_SECONDS, op='read_stock_data')
+def read_stock_data(tickers, start=None, end=None, columns=None, chunk_size=50000, table='stock_data'):
+    """讀取一支或多支股票在日期範圍內的數據
+
+    參數:
+    tickers (str | list): 股票代碼或代碼列表
+    start (date | str): 起始日期（含），None 表示不限
+    end (date | str): 結束日期（含），None 表示不限
+    columns (list): 要讀取的欄位，預設為 open/high/low/close/volume
+    chunk_size (int): 每次從伺服器取回的列數
+    table (str): 讀取的資料表，stock_data 或 stock_weekly / stock_monthly
+
+    返回:
+    pd.DataFrame: 以 date 為 DatetimeIndex、含 ticker 欄位的 DataFrame，失敗時為空的 DataFrame
+    """
+    try:
+        chunks = list(iter_stock_data(tickers, start, end, columns, chunk_size, table))
+    except psycopg2.DatabaseError as e:
+        print("資料庫錯誤：", e)
+        return pd.DataFrame()
+
+    if not chunks:
+        return _rows_to_frame([], list(columns or PRICE_COLUMNS))
+    return pd.concat(chunks) if len(chunks) > 1 else chunks[0]
@@ -0,0 +1,139 @@
+"""週線/月線彙總表
+
+寫入 stock_data 的同一事務中，只重新計算本次寫入涉及的週期（每支股票最早寫入日期所在的週/月之後），
+讀取時依查詢週期選用最粗的彙總表：週線讀 stock_weekly、月線/季線/年線讀 stock_monthly，
+長區間圖表讀取的列數約為日線的 1/5 ~ 1/20。
+"""
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+
+import adjustments
+import metrics
+import read_db_tables
+
+# 彙總表：表名 -> PostgreSQL date_trunc 單位（週由星期一開始）
+ROLLUP_TABLES = {'stock_weekly': 'week', 'stock_monthly': 'month'}
+
+# 可查詢的 K 棒週期 -> (來源資料表, 週期單位, 單位數)；來源為能整除該週期的最粗資料表
+INTERVALS = {
+    '1d': ('stock_data', 'day', 1),
+    '1w': ('stock_weekly', 'week', 1),
+    '2w': ('stock_weekly', 'week', 2),
+    '1mo': ('stock_monthly', 'month', 1),
+    '3mo': ('stock_monthly', 'month', 3),
+    '1y': ('stock_monthly', 'month', 12),
+}
+
+MONDAY = 4  # 1970-01-05（星期一）距 1970-01-01 的天數，多週週期以此對齊
+
+# 由日線彙總各欄位的方式（也用於由週線/月線再彙總）
+AGGREGATIONS = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'}
+
+
+def refresh_rollups(cur, since=None, source='stock_data', suffix=''):
+    """重新計算受影響週期的週線與月線（在寫入 stock_data 的同一事務中呼叫）
+
+    Args:
+        cur: psycopg2 游標
+        since (pd.Series): 股票代號 -> 本次寫入的最早日期；None 表示由 source 完整重建
+        source (str): 日線來源資料表（分階段重新載入時為影子表）
+        suffix (str): 彙總表名稱的後綴（分階段重新載入時寫入影子彙總表）
+    """
+    if since is not None and since.empty:
+        return
+    for table, unit in ROLLUP_TABLES.items():
+        if since is None:
+            rows = sql.SQL("{} s").format(sql.Identifier(source))
+            params = {"unit": unit}
+        else:
+            # 只掃描這些股票在 (ticker, date) 主鍵上、受影響週期起始日之後的範圍
+            rows = sql.SQL("""
+            unnest(%(tickers)s::varchar[], %(since)s::date[]) AS c(ticker, since)
+            JOIN {} s ON s.ticker = c.ticker AND s.date >= date_trunc(%(unit)s, c.since)::date
+            """).format(sql.Identifier(source))
+            params = {"unit": unit, "tickers": since.index.tolist(), "since": since.tolist()}
+        cur.execute(sql.SQL("""
+        INSERT INTO {table} (ticker, date, open, high, low, close, volume, bars, last_date)
+        SELECT s.ticker, date_trunc(%(unit)s, s.date)::date,
+               (array_agg(s.open ORDER BY s.date))[1], MAX(s.high), MIN(s.low),
+               (array_agg(s.close ORDER BY s.date DESC))[1], SUM(s.volume)::bigint, COUNT(*), MAX(s.date)
+        FROM {rows}
+        GROUP BY 1, 2
+        ON CONFLICT (ticker, date) DO UPDATE SET
+            open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low, close = EXCLUDED.close,
+            volume = EXCLUDED.volume, bars = EXCLUDED.bars, last_date = EXCLUDED.last_date
+        """).format(table=sql.Identifier(table + suffix), rows=rows), params)
+
+
+def period_starts(days, unit, count=1):
+    """每個日期所在週期的起始日（多週以 1970-01-05 起每 count 週對齊，多月以每年 1 月起每 count 個月對齊）
+
+    Args:
+        days (np.ndarray): datetime64 日期陣列
+        unit (str): day / week / month
+        count (int): 每個週期的單位數
+
+    Returns:
+        np.ndarray: datetime64[D] 週期起始日
+    """
+    days = np.asarray(days, dtype='datetime64[D]')
+    if unit == 'week':
+        offset = days.astype('int64') - MONDAY
+        return (offset - offset % (7 * count) + MONDAY).astype('datetime64[D]')
+    if unit == 'month':
+        months = days.astype('datetime64[M]').astype('int64')
+        return (months - months % count).astype('datetime64[M]').astype('datetime64[D]')
+    return days
+
+
+def resample_bars(data, unit, count):
+    """把日線或彙總表的 K 棒合併為 count 個單位的週期（例如月線合併為季線）
+
+    Args:
+        data (pd.DataFrame): read_stock_data 格式（date 索引、ticker 欄位），依 ticker、date 排序
+
+    Returns:
+        pd.DataFrame: 相同格式，date 為新週期的起始日
+    """
+    if data.empty:
+        return data
+    columns = [column for column in data.columns if column != 'ticker']
+    period = pd.DatetimeIndex(period_starts(data.index.to_numpy(), unit, count).astype('datetime64[ns]'),
+                              name='date')
+    grouped = data.groupby([data['ticker'], period], sort=False)[columns]
+    result = grouped.agg({column: AGGREGATIONS[column] for column in columns}).reset_index(level='ticker')
+    return result[['ticker'] + columns]
+
+
+@metrics.timed(metrics.DB_SECONDS, op='read_bars')
+def read_bars(tickers, start=None, end=None, interval='1d', columns=None, adjusted=False):
+    """讀取指定週期的 K 棒，選用能滿足該週期的最粗資料表
+
+    起始日期會對齊到所在週期的起始日，第一根 K 棒包含整個週期。
+    adjusted=True 時讀取原始日線套用除權息因子後再彙總（事件可能落在週期中間，彙總表無法直接調整）。
+
+    Args:
+        tickers (str | list): 股票代號或代號列表
+        start (date | str): 起始日期（含），None 表示不限
+        end (date | str): 結束日期（含），None 表示不限
+        interval (str): INTERVALS 中的週期，例如 1d / 1w / 1mo / 3mo
+        columns (list): 要讀取的欄位，預設為 open/high/low/close/volume
+        adjusted (bool): 是否返回除權息調整後的價格
+
+    Returns:
+        pd.DataFrame: 與 read_db_tables.read_stock_data 相同格式，date 為週期起始日
+
+    Raises:
+        ValueError: 不支援的週期
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"不支援的週期: {interval}（可用: {', '.join(INTERVALS)}）")
+    table, unit, count = INTERVALS[interval]
+    if start is not None and unit != 'day':
+        start = period_starts([np.datetime64(pd.Timestamp(start).date())], unit, count)[0].item()
+    if adjusted:
+        data = adjustments.adjust(read_db_tables.read_stock_data(tickers, start, end, columns))
+        return data if unit == 'day' else resample_bars(data, unit, count)
+    data = read_db_tables.read_stock_data(tickers, start, end, columns, table=table)
+    return data if count == 1 else resample_bars(data, unit, count)
@@ -0,0 +1,477 @@
+"""排程器與持久化任務佇列
+
+- 排程以 cron 格式（分 時 日 月 星期）定義，到期時在 job_queue 表新增一筆任務；
+  (排程名稱, 預定時間) 有唯一約束，多個應用實例同時檢查也只會新增一次
+- 任務依優先度（大者先）與建立順序執行；off_peak 任務只在離峰時段（SCHEDULER_OFF_PEAK）內開始
+- 執行任務前取得 JobLock：進程內以 threading.Lock、跨實例以 PostgreSQL advisory lock 互斥，
+  手動觸發的更新（/update_database、/backfill）也使用同一把鎖
+- 每筆任務記錄開始/結束時間、狀態與訊息，供 /jobs 查詢
+"""
+import json
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+# 加載 .env 文件中的環境變數
+load_dotenv()
+
+import db_pool
+import db_schema
+import metrics
+
+# 排程器設定（可由 .env 覆蓋）
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', '0') == '1'  # 應用啟動時是否啟動排程線程
+SCHEDULER_INTERVAL = float(os.getenv('SCHEDULER_INTERVAL', 30))  # 檢查排程與佇列的間隔秒數
+SCHEDULER_OFF_PEAK = os.getenv('SCHEDULER_OFF_PEAK', '01:00-06:00')  # 離峰時段（本地時間，可跨午夜）
+SCHEDULER_CATCHUP_HOURS = float(os.getenv('SCHEDULER_CATCHUP_HOURS', 24))  # 應用停機期間錯過的排程，在此時數內仍補執行
+LOCK_KEY = int(os.getenv('SCHEDULER_LOCK_KEY', 74280021))  # advisory lock 鍵值（同一資料庫的所有實例共用）
+
+# 預設排程：每月 1 日完整更新、平日增量更新、每週六匯出快照（可用 SCHEDULES 環境變數以 JSON 覆蓋）
+DEFAULT_SCHEDULES = [
+    {"name": "monthly_update", "cron": "0 2 1 * *", "kind": "update",
+     "params": {"range": "0-10000"}, "priority": 10, "off_peak": True},
+    {"name": "daily_incremental", "cron": "30 1 * * 2-6", "kind": "incremental",
+     "params": {"range": "0-10000"}, "priority": 5, "off_peak": True},
+    {"name": "weekly_export", "cron": "0 5 * * 6", "kind": "export",
+     "params": {"full": False}, "priority": 1, "off_peak": True},
+]
+SCHEDULES = json.loads(os.getenv('SCHEDULES')) if os.getenv('SCHEDULES') else DEFAULT_SCHEDULES
+
+INSTANCE = f"{socket.gethostname()}:{os.getpid()}"  # 寫入任務記錄，辨識由哪個實例執行
+
+
+JOB_COLUMNS = ("job_id", "kind", "params", "priority", "off_peak", "status", "schedule", "scheduled_for",
+               "created_at", "started_at", "finished_at", "instance", "message")
+
+
+class CronExpr:
+    """cron 格式的排程時間：分 時 日 月 星期
+
+    每欄支援 *、數值、範圍 a-b、列表 a,b 與間隔 */n、a-b/n；星期 0 與 7 都代表星期日。
+    日與星期都有限制時，符合其中之一即可（與 cron 相同）。
+    """
+
+    FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+    SEARCH_DAYS = 366 * 5  # 搜尋上限（例如 2 月 30 日永遠不會發生）
+
+    def __init__(self, expr):
+        self.expr = expr
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron 格式需要 5 個欄位: {expr}")
+        for (name, low, high), text in zip(self.FIELDS, parts):
+            setattr(self, name, self._parse(text, low, high))
+        if 7 in self.weekday:
+            self.weekday = (self.weekday - {7}) | {0}
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse(text, low, high):
+        values = set()
+        for part in text.split(','):
+            body, _, step = part.partition('/')
+            step = int(step) if step else 1
+            if body == '*':
+                start, end = low, high
+            elif '-' in body:
+                start, end = map(int, body.split('-'))
+            else:
+                start = int(body)
+                end = high if step > 1 else start  # 5/10 表示從 5 開始每 10 個單位
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"cron 欄位超出範圍: {part}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        if moment.month not in self.month:
+            return False
+        day = moment.day in self.day
+        weekday = (moment.weekday() + 1) % 7 in self.weekday  # Python 星期一為 0，cron 星期日為 0
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def matches(self, moment):
+        return self._day_matches(moment) and moment.hour in self.hour and moment.minute in self.minute
+
+    def previous(self, moment):
+        """不晚於 moment 的最近一次排程時間，找不到時返回 None"""
+        current = moment.replace(second=0, microsecond=0)
+        limit = current - timedelta(days=self.SEARCH_DAYS)
+        while current > limit:
+            if not self._day_matches(current):
+                current = current.replace(hour=0, minute=0) - timedelta(minutes=1)  # 前一天 23:59
+            elif current.hour not in self.hour:
+                current = current.replace(minute=0) - timedelta(minutes=1)  # 前一小時 59 分
+            elif current.minute not in self.minute:
+                current -= timedelta(minutes=1)
+            else:
+                return current
+        return None
+
+    def next(self, moment):
+        """晚於 moment 的下一次排程時間，找不到時返回 None"""
+        current = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = current + timedelta(days=self.SEARCH_DAYS)
+        while current < limit:
+            if not self._day_matches(current):
+                current = current.replace(hour=0, minute=0) + timedelta(days=1)
+            elif current.hour not in self.hour:
+                current = current.replace(minute=0) + timedelta(hours=1)
+            elif current.minute not in self.minute:
+                current += timedelta(minutes=1)
+            else:
+                return current
+        return None
+
+
+def in_window(window, moment):
+    """moment 是否落在 'HH:MM-HH:MM' 時段內（結束時間早於開始時間表示跨午夜），空字串表示不限制"""
+    if not window:
+        return True
+    start, end = (datetime.strptime(part.strip(), '%H:%M').time() for part in window.split('-'))
+    now = moment.time()
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
+
+
+class JobLock:
+    """更新類任務的互斥鎖
+
+    先取得進程內的 threading.Lock，再以專用連接取得 session 級的 pg_try_advisory_lock；
+    持有期間連接保持開啟，進程結束或斷線時 PostgreSQL 自動釋放，不會留下死鎖。
+    取得與釋放可以在不同線程（例如請求線程取得、背景更新線程釋放）。
+    """
+
+    def __init__(self, key=LOCK_KEY, connect=db_pool.connect):
+        self.key = key
+        self._connect = connect
+        self._local = threading.Lock()
+        self._conn = None
+
+    def try_acquire(self):
+        """立即嘗試取得鎖
+
+        Returns:
+            bool: True=取得，False=本進程或其他實例已有任務執行中
+        """
+        if not self._local.acquire(blocking=False):
+            return False
+        try:
+            conn = self._connect()
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (self.key,))
+                locked = cur.fetchone()[0]
+        except Exception as e:
+            print(f"取得任務鎖異常: {e}")
+            self._local.release()
+            return False
+        if not locked:
+            conn.close()
+            self._local.release()
+            return False
+        self._conn = conn
+        return True
+
+    def release(self):
+        """釋放鎖（關閉專用連接即釋放 advisory lock）"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception as e:
+                print(f"釋放任務鎖異常: {e}")
+        self._local.release()
+
+    def locked(self):
+        """本進程是否持有鎖"""
+        return self._local.locked()
+
+
+LOCK = JobLock()
+
+_runners = {}  # 任務類型 -> 執行函數 runner(params)，返回 (狀態, 訊息)
+
+
+def register_runner(kind, runner):
+    """註冊任務類型的執行函數
+
+    Args:
+        kind (str): 任務類型，例如 update / incremental / export / backfill / reload
+        runner (callable): runner(params) -> (狀態, 訊息)，狀態為 done / stopped / failed
+    """
+    _runners[kind] = runner
+
+
+def _row_to_job(row):
+    job = dict(zip(JOB_COLUMNS, row))
+    started, finished = job["started_at"], job["finished_at"]
+    job["duration_seconds"] = round((finished - started).total_seconds(), 1) if started and finished else None
+    for key in ("scheduled_for", "created_at", "started_at", "finished_at"):
+        if job[key] is not None:
+            job[key] = job[key].strftime('%Y-%m-%d %H:%M:%S')
+    return job
+
+
+@metrics.timed(metrics.DB_SECONDS, op='enqueue_job')
+def enqueue(kind, params=None, priority=0, off_peak=False, schedule=None, scheduled_for=None, now=None):
+    """新增一筆等待中的任務
+
+    Args:
+        kind (str): 任務類型
+        params (dict): 任務參數
+        priority (int): 優先度，大者先執行
+        off_peak (bool): 是否只在離峰時段開始
+        schedule (str): 排程名稱（手動新增時為 None）
+        scheduled_for (datetime): 排程預定時間
+        now (datetime): 建立時間，預設為現在
+
+    Returns:
+        int: 任務編號；同一排程時間已存在時返回 None
+    """
+    if kind not in _runners:
+        raise ValueError(f"不支援的任務類型: {kind}（可用: {', '.join(sorted(_runners))}）")
+    db_schema.ensure_schema()  # job_queue 表由結構遷移建立
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            INSERT INTO job_queue (kind, params, priority, off_peak, schedule, scheduled_for, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (schedule, scheduled_for) DO NOTHING
+            RETURNING job_id
+            """, (kind, json.dumps(params or {}), priority, off_peak, schedule, scheduled_for,
+                  now or datetime.now()))
+            row = cur.fetchone()
+        conn.commit()
+    return row[0] if row else None
+
+
+def enqueue_due(now=None, schedules=None, catchup_hours=None):
+    """為已到期的排程新增任務（每個排程只看最近一次預定時間）
+
+    Args:
+        now (datetime): 目前時間，預設為現在
+        schedules (list): 排程定義，預設為 SCHEDULES
+        catchup_hours (float): 預定時間距今超過此時數就不補執行，預設為 SCHEDULER_CATCHUP_HOURS
+
+    Returns:
+        list: 新增的任務編號
+    """
+    now = now or datetime.now()
+    catchup = timedelta(hours=SCHEDULER_CATCHUP_HOURS if catchup_hours is None else catchup_hours)
+    created = []
+    for schedule in SCHEDULES if schedules is None else schedules:
+        if schedule["kind"] not in _runners:
+            print(f"排程 {schedule['name']} 的任務類型 {schedule['kind']} 未註冊，略過")
+            continue
+        due = CronExpr(schedule["cron"]).previous(now)
+        if due is None or now - due > catchup:
+            continue
+        job_id = enqueue(schedule["kind"], schedule.get("params"), schedule.get("priority", 0),
+                         schedule.get("off_peak", False), schedule["name"], due, now)
+        if job_id is not None:
+            created.append(job_id)
+    return created
+
+
+@metrics.timed(metrics.DB_SECONDS, op='claim_job')
+def claim_next(now=None, window=None):
+    """取出下一筆可執行的任務並標記為 running（呼叫端須持有 LOCK）
+
+    持有鎖時不可能有其他任務在執行，殘留的 running 記錄（進程中斷）先標記為 failed。
+
+    Args:
+        now (datetime): 目前時間
+        window (str): 離峰時段，預設為 SCHEDULER_OFF_PEAK
+
+    Returns:
+        dict: 任務記錄，沒有可執行的任務時返回 None
+    """
+    now = now or datetime.now()
+    off_peak_ok = in_window(SCHEDULER_OFF_PEAK if window is None else window, now)
+    db_schema.ensure_schema()
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            UPDATE job_queue SET status = 'failed', finished_at = %s, message = '執行中的進程已中斷'
+            WHERE status = 'running'
+            """, (now,))
+            cur.execute(f"""
+            UPDATE job_queue SET status = 'running', started_at = %s, instance = %s
+            WHERE job_id = (
+                SELECT job_id FROM job_queue
+                WHERE status = 'queued' AND (NOT off_peak OR %s)
+                ORDER BY priority DESC, job_id LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {', '.join(JOB_COLUMNS)}
+            """, (now, INSTANCE, off_peak_ok))
+            row = cur.fetchone()
+        conn.commit()
+    return _row_to_job(row) if row else None
+
+
+@metrics.timed(metrics.DB_SECONDS, op='start_job')
+def start_job(kind, params=None):
+    """記錄一筆立即開始執行的任務（手動觸發，呼叫端須持有 LOCK）
+
+    Returns:
+        int: 任務編號，寫入失敗時返回 None（任務照常執行，只是沒有記錄）
+    """
+    try:
+        db_schema.ensure_schema()
+        now = datetime.now()
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                INSERT INTO job_queue (kind, params, priority, status, created_at, started_at, instance)
+                VALUES (%s, %s, 0, 'running', %s, %s, %s) RETURNING job_id
+                """, (kind, json.dumps(params or {}), now, now, INSTANCE))
+                job_id = cur.fetchone()[0]
+            conn.commit()
+        return job_id
+    except Exception as e:
+        print(f"記錄任務異常: {e}")
+        return None
+
+
+@metrics.timed(metrics.DB_SECONDS, op='finish_queue_job')
+def finish(job_id, status, message=None):
+    """記錄任務結果
+
+    Args:
+        job_id (int): 任務編號
+        status (str): done / stopped / failed
+        message (str): 結果摘要或錯誤訊息
+    """
+    if job_id is None:
+        return
+    try:
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                UPDATE job_queue SET status = %s, finished_at = %s, message = %s WHERE job_id = %s
+                """, (status, datetime.now(), message, job_id))
+            conn.commit()
+    except Exception as e:
+        print(f"記錄任務結果異常: {e}")
+
+
+def cancel(job_id):
+    """取消等待中的任務
+
+    Returns:
+        bool: 是否取消成功（已開始或已結束的任務無法取消）
+    """
+    db_schema.ensure_schema()
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            UPDATE job_queue SET status = 'cancelled', finished_at = %s
+            WHERE job_id = %s AND status = 'queued'
+            """, (datetime.now(), job_id))
+            cancelled = cur.rowcount == 1
+        conn.commit()
+    return cancelled
+
+
+def run_job(job):
+    """執行已取出的任務並記錄結果"""
+    runner = _runners.get(job["kind"])
+    if runner is None:
+        finish(job["job_id"], 'failed', f"不支援的任務類型: {job['kind']}")
+        return
+    try:
+        status, message = runner(job["params"])
+    except Exception as e:
+        status, message = 'failed', str(e)
+    finish(job["job_id"], status, message)
+
+
+def tick(now=None):
+    """檢查一次排程與佇列：新增到期的任務，並在取得鎖時執行一筆任務
+
+    Returns:
+        dict: 執行的任務記錄，沒有執行時返回 None
+    """
+    now = now or datetime.now()
+    try:
+        enqueue_due(now)
+    except Exception as e:
+        print(f"新增排程任務異常: {e}")
+    if not LOCK.try_acquire():
+        return None  # 已有任務在本進程或其他實例執行
+    try:
+        job = claim_next(now)
+        if job is not None:
+            run_job(job)
+        return job
+    finally:
+        LOCK.release()
+
+
+@metrics.timed(metrics.DB_SECONDS, op='job_history')
+def history(limit=50, status=None, kind=None):
+    """查詢任務記錄（新的在前）
+
+    Args:
+        limit (int): 最多返回的筆數
+        status (str): 只看指定狀態
+        kind (str): 只看指定類型
+
+    Returns:
+        list: 任務記錄，含 duration_seconds（未結束時為 None）
+    """
+    db_schema.ensure_schema()
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+            SELECT {', '.join(JOB_COLUMNS)} FROM job_queue
+            WHERE (%(status)s IS NULL OR status = %(status)s) AND (%(kind)s IS NULL OR kind = %(kind)s)
+            ORDER BY job_id DESC LIMIT %(limit)s
+            """, {"status": status, "kind": kind, "limit": limit})
+            rows = cur.fetchall()
+        conn.commit()
+    return [_row_to_job(row) for row in rows]
+
+
+def schedule_info(now=None):
+    """各排程的定義與下一次執行時間"""
+    now = now or datetime.now()
+    result = []
+    for schedule in SCHEDULES:
+        upcoming = CronExpr(schedule["cron"]).next(now)
+        result.append(dict(schedule, next_run=upcoming.strftime('%Y-%m-%d %H:%M') if upcoming else None))
+    return result
+
+
+class Scheduler:
+    """每 interval 秒呼叫一次 tick() 的背景線程"""
+
+    def __init__(self, interval=SCHEDULER_INTERVAL):
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            try:
+                tick()
+            except Exception as e:
+                print(f"排程器異常: {e}")
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
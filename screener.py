@@ -0,0 +1,306 @@
+"""全市場選股篩選
+
+write_db_tables 結束時以最近 SCREEN_DAYS 個交易日的 日期×股票 面板一次算出每支股票最新一根 K 棒的
+價量與指標欄位，整表寫入 screen_latest；查詢時把該表載入為每欄一個 NumPy 陣列，
+篩選條件（例如 "change_pct > 5 and vol_ratio >= 3"）直接在整欄陣列上運算，不逐支查詢資料庫。
+"""
+import ast
+import operator
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+# 加載 .env 文件中的環境變數
+load_dotenv()
+
+import adjustments
+import bulk_load
+import db_pool
+import db_schema
+import indicators
+import metrics
+import read_db_tables
+
+# 篩選設定（可由 .env 覆蓋）
+SCREEN_DAYS = int(os.getenv('SCREEN_DAYS', 120))  # 面板保留的交易日數（需 >= 60 才能計算 sma_60）
+SCREEN_CACHE_SECONDS = float(os.getenv('SCREEN_CACHE_SECONDS', 30))  # 記憶體中的面板多久檢查一次是否已重新計算
+SCREEN_LIMIT = 50  # 預設返回筆數
+SCREEN_MAX_LIMIT = 1000  # 單次最多返回筆數
+
+# screen_latest 的數值欄位（篩選條件與排序可使用的名稱）
+SCREEN_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'prev_close', 'change_pct',
+                  'vol_avg_20', 'vol_ratio', 'sma_5', 'sma_20', 'sma_60', 'rsi_14', 'macd_hist',
+                  'atr_14', 'high_n', 'low_n', 'pct_from_high', 'bars']
+
+
+def compute_screen(data):
+    """由最近 N 日的長表算出每支股票最新一根 K 棒的篩選欄位
+
+    Args:
+        data (pd.DataFrame): read_db_tables.read_stock_data 的回傳結果（含 open/high/low/close/volume）
+
+    Returns:
+        pd.DataFrame: 欄位為 ticker、date 與 SCREEN_COLUMNS，每支股票一列
+    """
+    if data.empty:
+        return pd.DataFrame(columns=['ticker', 'date'] + SCREEN_COLUMNS)
+
+    panels = indicators.to_panels(data, read_db_tables.PRICE_COLUMNS)
+    close, high, low, volume = panels['close'], panels['high'], panels['low'], panels['volume'].astype('float64')
+    n_dates, n_tickers = close.shape
+    valid = ~np.isnan(close.to_numpy())
+    # 每支股票最後一根 K 棒所在的列（停牌的股票取停牌前最後一天）
+    last = n_dates - 1 - np.argmax(valid[::-1], axis=0)
+    columns = np.arange(n_tickers)
+
+    def at_last(panel):
+        return panel.to_numpy(dtype='float64')[last, columns]
+
+    prev_close = at_last(close.ffill().shift(1))
+    vol_avg_20 = at_last(volume.shift(1).rolling(20, min_periods=10).mean())  # 不含當天的 20 日均量
+    high_n = high.max().to_numpy(dtype='float64')
+    result = {
+        'open': at_last(panels['open']),
+        'high': at_last(high),
+        'low': at_last(low),
+        'close': at_last(close),
+        'volume': at_last(volume),
+        'prev_close': prev_close,
+        'vol_avg_20': vol_avg_20,
+        'sma_5': at_last(indicators.sma(close, 5)),
+        'sma_20': at_last(indicators.sma(close, 20)),
+        'sma_60': at_last(indicators.sma(close, 60)),
+        'rsi_14': at_last(indicators.rsi(close, 14)),
+        'macd_hist': at_last(indicators.macd(close)[2]),
+        'atr_14': at_last(indicators.atr(high, low, close, 14)),
+        'high_n': high_n,
+        'low_n': low.min().to_numpy(dtype='float64'),
+        'bars': valid.sum(axis=0),
+    }
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['change_pct'] = (result['close'] / prev_close - 1) * 100
+        result['vol_ratio'] = result['volume'] / vol_avg_20
+        result['pct_from_high'] = (result['close'] / high_n - 1) * 100
+    for name in ('change_pct', 'vol_ratio', 'pct_from_high'):
+        result[name][~np.isfinite(result[name])] = np.nan  # 前一日或均量為 0 時不列入比較
+
+    frame = pd.DataFrame({'ticker': close.columns.to_numpy(dtype=object),
+                          'date': pd.DatetimeIndex(close.index[last]).date,
+                          **{name: result[name] for name in SCREEN_COLUMNS}})
+    return frame
+
+
+@metrics.timed(metrics.DB_SECONDS, op='refresh_screen')
+def refresh(days=SCREEN_DAYS, log=None):
+    """重新計算 screen_latest（更新流程結束時呼叫）
+
+    只讀取最近 days 個交易日、且最新數據在這段期間內的股票（已下市或長期停牌的股票不列入），
+    價格與成交量先經 adjustments.adjust 調整。
+
+    Args:
+        days (int): 面板的交易日數
+        log (callable): 訊息輸出函數
+
+    Returns:
+        int: 寫入的股票數
+    """
+    log = log or print
+    db_schema.ensure_schema()
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            # 以日期索引找出第 days 個最近的交易日
+            cur.execute("""
+            SELECT MIN(date) FROM (SELECT DISTINCT date FROM stock_data ORDER BY date DESC LIMIT %s) recent
+            """, (days,))
+            cutoff = cur.fetchone()[0]
+            cur.execute("SELECT ticker FROM stock_summary WHERE last_date >= %s ORDER BY ticker", (cutoff,))
+            tickers = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    tickers = adjustments.trusted(tickers)  # 仍是舊版調整後價格的股票重新載入前不列入
+    if cutoff is None or not tickers:
+        return 0
+
+    # 以調整後價格計算，除權息日不會被當成漲跌（例如 1 拆 2 不會變成 -50%）
+    result = compute_screen(adjustments.adjust(read_db_tables.read_stock_data(tickers, start=cutoff)))
+    result['refreshed_at'] = pd.Timestamp.now().floor('s')
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            # 整表替換在同一事務中完成，查詢端不會讀到一半的結果
+            cur.execute("DELETE FROM screen_latest")
+            bulk_load.copy_rows(cur, result, 'screen_latest', ['ticker', 'date', 'refreshed_at'] + SCREEN_COLUMNS)
+        conn.commit()
+    PANEL.invalidate()
+    log(f"選股面板已更新: {len(result)} 支股票，最近 {days} 個交易日（{cutoff} 起）")
+    return len(result)
+
+
+class ScreenPanel:
+    """screen_latest 在記憶體中的欄式副本（每欄一個 NumPy 陣列）
+
+    每 SCREEN_CACHE_SECONDS 秒以 MAX(refreshed_at) 與列數檢查其他進程是否已重新計算
+    （或因除權息因子改變刪除了部分股票），有變化才重新載入。
+    重新載入時整組替換 snapshot，查詢中的請求仍使用取得時的那一組陣列。
+    """
+
+    def __init__(self, ttl=SCREEN_CACHE_SECONDS):
+        self.ttl = ttl
+        self.checked = 0.0  # 上次檢查版本的時間
+        # ((refreshed_at, 列數), 股票代號陣列, 日期陣列, {欄位: 陣列})
+        self.snapshot = (None, np.array([], dtype=object), np.array([], dtype=object),
+                         {name: np.array([], dtype='float64') for name in SCREEN_COLUMNS})
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self.checked = 0.0
+
+    @staticmethod
+    def _load(cur, version):
+        cur.execute(f"SELECT ticker, date, {', '.join(SCREEN_COLUMNS)} FROM screen_latest ORDER BY ticker")
+        rows = cur.fetchall()
+        tickers, dates, *values = zip(*rows) if rows else ((), (), *([()] * len(SCREEN_COLUMNS)))
+        columns = {name: np.array(column, dtype='float64') for name, column in zip(SCREEN_COLUMNS, values)}
+        return version, np.array(tickers, dtype=object), np.array(dates, dtype=object), columns
+
+    @metrics.timed(metrics.DB_SECONDS, op='load_screen')
+    def get(self):
+        """返回最新的 snapshot（必要時重新載入）"""
+        with self._lock:
+            if time.monotonic() - self.checked < self.ttl:
+                return self.snapshot
+            db_schema.ensure_schema()
+            with db_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT MAX(refreshed_at), COUNT(*) FROM screen_latest")
+                    version = cur.fetchone()
+                    if version != self.snapshot[0]:
+                        self.snapshot = self._load(cur, version)
+                conn.commit()
+            self.checked = time.monotonic()
+            return self.snapshot
+
+
+PANEL = ScreenPanel()
+
+# 篩選條件允許的運算子
+_COMPARE = {ast.Gt: operator.gt, ast.GtE: operator.ge, ast.Lt: operator.lt, ast.LtE: operator.le,
+            ast.Eq: operator.eq, ast.NotEq: operator.ne}
+_ARITHMETIC = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+_FUNCTIONS = {'abs': np.abs}
+
+
+def parse_filter(expression):
+    """解析篩選條件，只允許欄位名稱、數字、四則運算、比較、and/or/not 與 abs()
+
+    Raises:
+        ValueError: 語法錯誤或使用了不允許的名稱/運算
+    """
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"篩選條件語法錯誤: {e.msg}")
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id not in SCREEN_COLUMNS and node.id not in _FUNCTIONS:
+            raise ValueError(f"不支援的欄位: {node.id}（可用: {', '.join(SCREEN_COLUMNS)}）")
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS
+                                                and len(node.args) == 1 and not node.keywords):
+            raise ValueError("只支援 abs(欄位或運算式)")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"不支援的常數: {node.value!r}")
+        if not isinstance(node, (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub,
+                                 ast.Compare, ast.BinOp, ast.Name, ast.Load, ast.Constant, ast.Call,
+                                 *_COMPARE, *_ARITHMETIC)):
+            # & | 的優先順序高於比較運算（close > sma_20 & ... 會先算 sma_20 & ...），只接受 and/or
+            raise ValueError(f"不支援的運算: {type(node).__name__}")
+    return tree.body
+
+
+def evaluate(node, columns):
+    """在整欄陣列上計算解析後的條件
+
+    Args:
+        node (ast.AST): parse_filter 的回傳結果
+        columns (dict): {欄位名稱: NumPy 陣列}
+
+    Returns:
+        np.ndarray: 布林遮罩或數值陣列（NaN 的比較結果為 False）
+    """
+    if isinstance(node, ast.Name):
+        if node.id not in columns:
+            raise ValueError(f"不支援的欄位: {node.id}")
+        return columns[node.id]
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.BoolOp):
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        result = evaluate(node.values[0], columns)
+        for value in node.values[1:]:
+            result = combine(result, evaluate(value, columns))
+        return result
+    if isinstance(node, ast.UnaryOp):
+        value = evaluate(node.operand, columns)
+        return np.logical_not(value) if isinstance(node.op, ast.Not) else -value
+    if isinstance(node, ast.Compare):  # a < b < c 拆為 (a < b) and (b < c)
+        left, result = evaluate(node.left, columns), True
+        for op, comparator in zip(node.ops, node.comparators):
+            right = evaluate(comparator, columns)
+            result = np.logical_and(result, _COMPARE[type(op)](left, right))
+            left = right
+        return result
+    if isinstance(node, ast.BinOp):
+        left, right = evaluate(node.left, columns), evaluate(node.right, columns)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return _ARITHMETIC[type(node.op)](left, right)
+    if isinstance(node, ast.Call):
+        return _FUNCTIONS[node.func.id](evaluate(node.args[0], columns))
+    raise ValueError(f"不支援的運算: {type(node).__name__}")
+
+
+def screen(expression=None, sort='change_pct', descending=True, limit=SCREEN_LIMIT, fields=None):
+    """篩選並排序全市場股票
+
+    Args:
+        expression (str): 篩選條件，None 或空字串表示不篩選
+        sort (str): 排序欄位（NaN 排在最後）
+        descending (bool): 是否由大到小
+        limit (int): 返回筆數上限（最多 SCREEN_MAX_LIMIT）
+        fields (list): 結果中包含的欄位，預設為全部
+
+    Returns:
+        dict: {"as_of", "universe", "matched", "results": [{ticker, date, 欄位...}]}
+
+    Raises:
+        ValueError: 條件、排序欄位或輸出欄位不合法
+    """
+    fields = list(fields or SCREEN_COLUMNS)
+    unknown = [name for name in fields + [sort] if name not in SCREEN_COLUMNS]
+    if unknown:
+        raise ValueError(f"不支援的欄位: {', '.join(unknown)}")
+    version, tickers, dates, columns = PANEL.get()
+    mask = np.ones(len(tickers), dtype=bool)
+    if expression:
+        result = evaluate(parse_filter(expression), columns)
+        mask = np.broadcast_to(np.asarray(result, dtype=bool), mask.shape)
+
+    matched = np.flatnonzero(mask)
+    key = columns[sort][matched]
+    if descending:
+        key = -key
+    order = matched[np.argsort(np.where(np.isnan(key), np.inf, key), kind='stable')][:max(0, min(limit, SCREEN_MAX_LIMIT))]
+
+    results = []
+    for idx in order:
+        row = {"ticker": tickers[idx], "date": dates[idx].strftime('%Y-%m-%d')}
+        for name in fields:
+            value = columns[name][idx]
+            row[name] = None if np.isnan(value) else round(float(value), 4)
+        results.append(row)
+    return {
+        "as_of": version[0].strftime('%Y-%m-%d %H:%M:%S') if version and version[0] else None,
+        "universe": len(tickers),
+        "matched": len(matched),
+        "results": results,
+    }
@@ -0,0 +1,173 @@
+import multiprocessing
+import os
+import queue
+import threading
+
+from dotenv import load_dotenv
+# 加載 .env 文件中的環境變數
+load_dotenv()
+
+import db_schema
+
+# 每個分片進程各自的驗證限速（每秒請求數，可由 .env 覆蓋），總速率為 分片數 × 此值
+SHARD_VALIDATION_RATE = float(os.getenv('SHARD_VALIDATION_RATE', os.getenv('VALIDATION_RATE', 5)))
+SHARD_BLOCK = int(os.getenv('SHARD_BLOCK', 50))  # 分配給分片的代號區塊大小
+REPORT_INTERVAL = 0.5  # 子進程回報進度的間隔秒數
+
+
+def split_codes(codes, shards, block=SHARD_BLOCK):
+    """將代號以區塊為單位輪流分配給各分片
+
+    有效代號在範圍內分佈不均（例如 0000-0999 幾乎都無效），
+    交錯分配比切成連續的大段更能平衡各分片的工作量。
+
+    Args:
+        codes (list): 依代號排序的候選代號
+        shards (int): 分片數
+        block (int): 每個區塊的代號數
+
+    Returns:
+        list: 每個分片的代號列表（空分片會被移除）
+    """
+    parts = [[] for _ in range(max(1, shards))]
+    for n, i in enumerate(range(0, len(codes), block)):
+        parts[n % len(parts)].extend(codes[i:i + block])
+    return [part for part in parts if part]
+
+
+def merge_pipeline_stats(stats_lists):
+    """合併各分片的管線統計：計數與吞吐量相加，忙碌比例取平均"""
+    merged = {}
+    for stats in stats_lists:
+        for stage in stats:
+            total = merged.setdefault(stage["stage"], dict(stage, busy_pct=0, shards=0))
+            if total["shards"]:  # 第一個分片的數值已在複製時帶入
+                for key in ("workers", "active", "processed", "emitted", "skipped", "errors", "queue_depth"):
+                    total[key] += stage[key]
+                total["per_sec"] = round(total["per_sec"] + stage["per_sec"], 2)
+            total["busy_pct"] += stage["busy_pct"]
+            total["shards"] += 1
+    for total in merged.values():
+        total["busy_pct"] = round(total["busy_pct"] / total["shards"], 1)
+    return list(merged.values())
+
+
+def _shard_main(shard_id, candidates, incremental, job_id, rate, stop, out, setup=None):
+    """子進程入口：以獨立的連接池與令牌桶執行 app.load_stock_codes，定期回報進度"""
+    if setup:
+        setup()  # 例如基準測試替換資料來源
+    import app  # 在子進程中載入，連接池依進程 ID 重新建立
+
+    app.stop_event = stop  # 共用的跨進程停止信號
+    app.VALIDATION_RATE = rate
+    app.update_progress.update(current_batch=0, codes_per_sec=0, pipeline=[])
+    sent = 0  # 已回報的最後一個訊息序號
+
+    def snapshot():
+        nonlocal sent
+        events, _ = app.update_progress["messages"].since(sent, limit=None)
+        if events:
+            sent = events[-1][0]
+        return {"shard": shard_id,
+                "current_batch": app.update_progress["current_batch"],
+                "codes_per_sec": app.update_progress["codes_per_sec"],
+                "pipeline": app.update_progress["pipeline"],
+                "messages": [message for _, message in events]}
+
+    finished = threading.Event()
+
+    def report():
+        while not finished.wait(REPORT_INTERVAL):
+            out.put(snapshot())
+
+    reporter = threading.Thread(target=report, daemon=True)
+    reporter.start()
+    try:
+        result = {"codes": app.load_stock_codes(candidates, incremental, job_id)}
+    except Exception as e:
+        result = {"error": str(e)}
+    finished.set()
+    reporter.join()
+
+    final = snapshot()
+    final.update(result, finished=True)
+    out.put(final)
+
+
+def run_shards(start_idx, total, shards, incremental=False, job_id=None,
+               progress=None, stop_event=None, setup=None, rate=SHARD_VALIDATION_RATE):
+    """將代號範圍分給多個進程同時驗證與下載，合併結果與進度
+
+    每個子進程有自己的資料庫連接池與限速令牌桶，各自寫入 stock_data；
+    有效代號由本進程合併後返回，CSV 與 stock_codes 由呼叫端一次寫入。
+
+    Args:
+        start_idx (int): 起始代號
+        total (int): 候選代號數
+        shards (int): 子進程數
+        incremental (bool): 是否為增量更新
+        job_id (int): 共用的更新任務編號（各分片代號不重疊，檢查點互不衝突）
+        progress (dict): 進度字典，合併後的 current_batch、codes_per_sec、pipeline 與訊息寫入此處
+        stop_event (threading.Event): 本進程的停止信號，設置後轉發給所有子進程
+        setup (callable): 子進程開始前呼叫的函數（須可被 pickle，即模組層級函數）
+        rate (float): 每個子進程的驗證限速
+
+    Returns:
+        list: 排序後的有效股票代號
+
+    Raises:
+        RuntimeError: 有分片失敗或異常結束時（其他分片已寫入的數據與檢查點會保留）
+    """
+    progress = progress if progress is not None else {}
+    log = progress.setdefault("messages", []).append
+    # 將數字補零至 4 位，並加上台灣股票市場後綴.TW
+    candidates = [f"{num:04d}.TW" for num in range(start_idx, start_idx + total)]
+    parts = split_codes(candidates, shards)
+    db_schema.ensure_schema()  # 先在本進程完成遷移，子進程不必排隊等待遷移鎖
+
+    ctx = multiprocessing.get_context('spawn')  # 不複製父進程的線程與資料庫連接
+    stop = ctx.Event()
+    out = ctx.Queue()
+    processes = [ctx.Process(target=_shard_main, name=f"shard-{i}", daemon=True,
+                             args=(i, part, incremental, job_id, rate, stop, out, setup))
+                 for i, part in enumerate(parts)]
+    for process in processes:
+        process.start()
+    log(f"已啟動 {len(processes)} 個分片進程，每個分片驗證限速 {rate:g} 次/秒")
+
+    states = {}  # 分片編號 -> 最近一次回報
+    codes, errors, finished = [], [], set()
+    while len(finished) < len(processes):
+        if stop_event is not None and stop_event.is_set():
+            stop.set()
+        try:
+            report = out.get(timeout=REPORT_INTERVAL)
+        except queue.Empty:
+            # 子進程已結束但沒有送出最終結果，視為異常終止
+            for i, process in enumerate(processes):
+                if i not in finished and not process.is_alive():
+                    finished.add(i)
+                    errors.append(f"分片 {i} 異常結束 (exitcode {process.exitcode})")
+                    log(errors[-1])
+            continue
+
+        shard = report["shard"]
+        for message in report["messages"]:
+            log(f"[分片 {shard}] {message}")
+        states[shard] = report
+        progress["current_batch"] = sum(state["current_batch"] for state in states.values())
+        progress["codes_per_sec"] = round(sum(state["codes_per_sec"] for state in states.values()), 2)
+        progress["pipeline"] = merge_pipeline_stats([state["pipeline"] for state in states.values()])
+        if report.get("finished"):
+            finished.add(shard)
+            if "error" in report:
+                errors.append(f"分片 {shard} 失敗: {report['error']}")
+                log(errors[-1])
+            else:
+                codes.extend(report["codes"])
+
+    for process in processes:
+        process.join()
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    return sorted(codes)
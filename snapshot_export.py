@@ -0,0 +1,440 @@
+"""stock_data 欄式快照匯出（Parquet + Arrow）
+
+目錄結構（EXPORT_DIR 下）:
+    parquet/year=YYYY/part-*.parquet  依年份分區，檔內依 (ticker, date) 排序，可用 ticker 統計值跳過 row group
+    arrow/year=YYYY.arrow             未壓縮的 Arrow IPC 檔，供 load_table 以記憶體映射零複製載入
+    manifest.json                     最後匯出日期與各年份列數，供增量追加使用
+
+增量匯出除了追加最後匯出日期之後的新交易日，也會重寫 stock_summary.changed_from 標記的年份
+（新股票的早期歷史、回補的年份、被 upsert 修正的數據），快照不會與資料庫逐漸不一致。
+
+用法: python snapshot_export.py [full | append | load]
+"""
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from dotenv import load_dotenv
+# 加載 .env 文件中的環境變數
+load_dotenv()
+
+import db_pool
+import metrics
+
+# 匯出設定（可由 .env 覆蓋）
+EXPORT_DIR = os.getenv('EXPORT_DIR', 'export')  # 匯出根目錄
+EXPORT_AFTER_UPDATE = os.getenv('EXPORT_AFTER_UPDATE', '0') == '1'  # write_db_tables 完成後是否自動匯出
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 200000))  # 每次從資料庫取回的列數（記憶體上限）
+EXPORT_MAX_PARTS = int(os.getenv('EXPORT_MAX_PARTS', 10))  # 單一年份的 Parquet 檔超過此數時合併
+
+SCHEMA = pa.schema([
+    ('ticker', pa.string()),
+    ('date', pa.date32()),
+    ('open', pa.float32()),
+    ('high', pa.float32()),
+    ('low', pa.float32()),
+    ('close', pa.float32()),
+    ('volume', pa.int64()),
+])
+
+
+def _paths(export_dir):
+    return (os.path.join(export_dir, 'parquet'), os.path.join(export_dir, 'arrow'),
+            os.path.join(export_dir, 'manifest.json'))
+
+
+def read_manifest(export_dir=EXPORT_DIR):
+    """讀取匯出紀錄，尚未匯出時返回 None"""
+    path = _paths(export_dir)[2]
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_manifest(export_dir, manifest):
+    path = _paths(export_dir)[2]
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)  # 原子替換，讀取端不會看到寫一半的檔案
+
+
+def _iter_batches(after=None, years=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """以伺服器端游標依 (ticker, date) 順序分段讀取 stock_data，逐段產出 pa.Table
+
+    Args:
+        after (date): 只讀取此日期之後的數據，None 表示全部
+        years (list): 只讀取這些年份的數據，None 表示全部
+    """
+    query = ("SELECT ticker, (date - DATE '1970-01-01') AS day, open, high, low, close, volume "
+             "FROM stock_data")
+    conditions, params = [], []
+    if after is not None:
+        conditions.append("date > %s")
+        params.append(after)
+    if years is not None:  # 以日期範圍表示年份，年份分區時只掃描對應分區
+        conditions.append("(" + " OR ".join(["(date >= %s AND date < %s)"] * len(years)) + ")")
+        for year in sorted(years):
+            params += [date(year, 1, 1), date(year + 1, 1, 1)]
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY ticker, date"
+
+    with db_pool.connection() as conn:
+        with conn.cursor(name='export_stock_data') as cursor:
+            cursor.itersize = chunk_rows
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                tickers, days, *values = zip(*rows)  # 一次轉置為欄
+                arrays = [pa.array(tickers, pa.string()),
+                          pa.array(np.array(days, dtype='int32')).cast(pa.date32())]
+                arrays += [pa.array(column, field.type) for column, field in zip(values, list(SCHEMA)[2:])]
+                yield pa.Table.from_arrays(arrays, schema=SCHEMA)
+        conn.commit()  # 具名游標關閉後才結束事務
+
+
+def _split_years(table):
+    """將一段數據依年份拆開 -> {年份: pa.Table}"""
+    days = table.column('date').cast(pa.int32()).to_numpy()
+    years = days.astype('datetime64[D]').astype('datetime64[Y]').astype('int64') + 1970
+    return {int(year): table.filter(pa.array(years == year)) for year in np.unique(years)}
+
+
+def _write_parts(batches, parquet_dir, part_name):
+    """將分段數據寫入各年份目錄的 Parquet 檔（每個年份同時只開一個寫入器，每段成為一個 row group）
+
+    Returns:
+        tuple: ({年份: 列數}, 最後日期)
+    """
+    writers, counts, last_day = {}, {}, None
+    try:
+        for batch in batches:
+            for year, part in _split_years(batch).items():
+                if year not in writers:
+                    year_dir = os.path.join(parquet_dir, f'year={year}')
+                    os.makedirs(year_dir, exist_ok=True)
+                    writers[year] = pq.ParquetWriter(os.path.join(year_dir, part_name), SCHEMA,
+                                                     compression='zstd')
+                writers[year].write_table(part)
+                counts[year] = counts.get(year, 0) + part.num_rows
+            batch_last = pc.max(batch.column('date')).as_py()
+            last_day = max(last_day, batch_last) if last_day else batch_last
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return counts, last_day
+
+
+def _build_arrow(parquet_dir, arrow_dir, year):
+    """由年份的 Parquet 檔重建該年份的 Arrow IPC 檔；檔案過多時順便合併 Parquet"""
+    year_dir = os.path.join(parquet_dir, f'year={year}')
+    files = sorted(os.path.join(year_dir, name) for name in os.listdir(year_dir) if name.endswith('.parquet'))
+    table = pa.concat_tables([pq.read_table(path, schema=SCHEMA) for path in files])
+    if len(files) > 1:  # 追加的檔案依日期寫入，合併後重新依 (ticker, date) 排序
+        table = table.sort_by([('ticker', 'ascending'), ('date', 'ascending')])
+
+    if len(files) > EXPORT_MAX_PARTS:
+        merged = os.path.join(year_dir, 'part-merged.parquet.tmp')
+        pq.write_table(table, merged, compression='zstd', row_group_size=EXPORT_CHUNK_ROWS)
+        for path in files:
+            os.remove(path)
+        os.replace(merged, os.path.join(year_dir, f'part-{_stamp()}.parquet'))
+
+    os.makedirs(arrow_dir, exist_ok=True)
+    path = os.path.join(arrow_dir, f'year={year}.arrow')
+    with pa.OSFile(path + '.tmp', 'wb') as sink:
+        with ipc.new_file(sink, SCHEMA) as writer:  # 不壓縮，才能直接映射使用
+            writer.write_table(table, max_chunksize=EXPORT_CHUNK_ROWS)
+    os.replace(path + '.tmp', path)
+
+
+def _stamp():
+    return datetime.now().strftime('%Y%m%d%H%M%S%f')
+
+
+def _claim_changes():
+    """取出並清除 stock_summary.changed_from（匯出前呼叫）
+
+    UPDATE 會等待正在寫入同一股票的事務提交，返回後讀取 stock_data 一定包含這些寫入；
+    之後才提交的寫入會重新標記，由下次匯出處理。
+
+    Returns:
+        dict: {股票代號: 上次匯出後最早被寫入的日期}
+    """
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            UPDATE stock_summary SET changed_from = NULL WHERE changed_from IS NOT NULL
+            RETURNING ticker, changed_from
+            """)
+            changes = dict(cur.fetchall())
+        conn.commit()
+    return changes
+
+
+def _restore_changes(changes):
+    """匯出失敗時把取出的 changed_from 放回（與期間新寫入的日期取較早者）"""
+    if not changes:
+        return
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            UPDATE stock_summary s SET changed_from = LEAST(s.changed_from, c.changed_from)
+            FROM unnest(%s::varchar[], %s::date[]) AS c(ticker, changed_from)
+            WHERE s.ticker = c.ticker
+            """, (list(changes), list(changes.values())))
+        conn.commit()
+
+
+def _database_rows():
+    """stock_summary 記錄的 stock_data 總列數（與 manifest 比對，不掃描 stock_data）"""
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COALESCE(SUM(row_count), 0) FROM stock_summary")
+            rows = cur.fetchone()[0]
+        conn.commit()
+    return int(rows)
+
+
+def changed_years(changes, last_date):
+    """快照中需要重寫的年份
+
+    Args:
+        changes (dict): _claim_changes 的回傳結果
+        last_date (date): manifest 的最後匯出日期
+
+    Returns:
+        set: 最早寫入日期不晚於 last_date 的股票，從該年份到 last_date 所在年份（之後的日期由追加處理）
+    """
+    years = set()
+    for changed_from in changes.values():
+        if changed_from <= last_date:
+            years.update(range(changed_from.year, last_date.year + 1))
+    return years
+
+
+def _rewrite_years(export_dir, years):
+    """由資料庫重新匯出指定年份，逐年替換 Parquet 目錄與 Arrow 檔
+
+    Returns:
+        tuple: ({年份: 列數}，資料庫已沒有數據的年份為 0, 最後日期)
+    """
+    parquet_dir, arrow_dir, _ = _paths(export_dir)
+    staging = os.path.join(export_dir, 'staging')
+    shutil.rmtree(staging, ignore_errors=True)
+    staged_parquet = os.path.join(staging, 'parquet')
+    counts, last_day = _write_parts(_iter_batches(years=years), staged_parquet, f'part-{_stamp()}.parquet')
+
+    for year in years:
+        target = os.path.join(parquet_dir, f'year={year}')
+        shutil.rmtree(target, ignore_errors=True)
+        if year in counts:
+            os.makedirs(parquet_dir, exist_ok=True)
+            os.replace(os.path.join(staged_parquet, f'year={year}'), target)
+            _build_arrow(parquet_dir, arrow_dir, year)
+        else:
+            arrow_path = os.path.join(arrow_dir, f'year={year}.arrow')
+            if os.path.exists(arrow_path):
+                os.remove(arrow_path)
+    shutil.rmtree(staging, ignore_errors=True)
+    return {year: counts.get(year, 0) for year in years}, last_day
+
+
+def export_full(export_dir=EXPORT_DIR, log=None):
+    """完整匯出 stock_data（寫入暫存目錄後整批替換，匯出中斷不影響既有快照）
+
+    Returns:
+        int: 匯出的資料列數
+    """
+    log = log or print
+    changes = _claim_changes()  # 完整匯出後所有變更都已包含在快照中
+    try:
+        return _export_full(export_dir, log)
+    except Exception:
+        _restore_changes(changes)
+        raise
+
+
+def _export_full(export_dir, log):
+    parquet_dir, arrow_dir, _ = _paths(export_dir)
+    staging = os.path.join(export_dir, 'staging')
+    shutil.rmtree(staging, ignore_errors=True)
+    staged_parquet, staged_arrow = os.path.join(staging, 'parquet'), os.path.join(staging, 'arrow')
+
+    counts, last_day = _write_parts(_iter_batches(), staged_parquet, f'part-{_stamp()}.parquet')
+    for year in counts:
+        _build_arrow(staged_parquet, staged_arrow, year)
+
+    for target, staged in ((parquet_dir, staged_parquet), (arrow_dir, staged_arrow)):
+        shutil.rmtree(target, ignore_errors=True)
+        if os.path.exists(staged):
+            os.replace(staged, target)
+    shutil.rmtree(staging, ignore_errors=True)
+
+    total = sum(counts.values())
+    _write_manifest(export_dir, {
+        "last_date": last_day.isoformat() if last_day else None,
+        "rows": total,
+        "years": {str(year): rows for year, rows in sorted(counts.items())},
+        "exported_at": datetime.now().isoformat(timespec='seconds'),
+    })
+    log(f"快照已完整匯出: {total} 列，{len(counts)} 個年份")
+    return total
+
+
+def export_append(export_dir=EXPORT_DIR, log=None):
+    """追加上次匯出日期之後的新交易日，並重寫 changed_from 標記的年份；尚未匯出過時改為完整匯出
+
+    完成後以 stock_summary 的總列數核對 manifest，不一致（例如資料表被刪除後重建）時改為完整匯出。
+
+    Returns:
+        int: 追加與重寫的資料列數
+    """
+    log = log or print
+    manifest = read_manifest(export_dir)
+    if not manifest or not manifest.get("last_date"):
+        return export_full(export_dir, log)
+
+    changes = _claim_changes()
+    try:
+        return _export_append(export_dir, manifest, changes, log)
+    except Exception:
+        _restore_changes(changes)  # 下次匯出仍會重寫這些年份
+        raise
+
+
+def _export_append(export_dir, manifest, changes, log):
+    parquet_dir, arrow_dir, _ = _paths(export_dir)
+    last_date = date.fromisoformat(manifest["last_date"])
+    counts, last_day = _write_parts(_iter_batches(after=last_date), parquet_dir, f'part-{_stamp()}.parquet')
+    rewrite = changed_years(changes, last_date)
+    rewritten, rewrite_last = _rewrite_years(export_dir, rewrite) if rewrite else ({}, None)
+
+    years = manifest.get("years", {})
+    for year, rows in counts.items():
+        if year not in rewritten:  # 重寫的年份已包含新交易日
+            _build_arrow(parquet_dir, arrow_dir, year)
+            years[str(year)] = years.get(str(year), 0) + rows
+    for year, rows in rewritten.items():
+        if rows:
+            years[str(year)] = rows
+        else:
+            years.pop(str(year), None)
+    total = sum(years.values())
+    if total != _database_rows():
+        log("快照列數與資料庫不一致，改為完整匯出")
+        return export_full(export_dir, log)
+    if not counts and not rewritten:
+        log(f"快照已是最新 (至 {manifest['last_date']})")
+        return 0
+
+    last_dates = [day for day in (last_date, last_day, rewrite_last) if day]
+    manifest.update(last_date=max(last_dates).isoformat(), rows=total, years=dict(sorted(years.items())),
+                    exported_at=datetime.now().isoformat(timespec='seconds'))
+    _write_manifest(export_dir, manifest)
+    written = sum(rows for year, rows in counts.items() if year not in rewritten) + sum(rewritten.values())
+    if rewritten:
+        log(f"快照已重寫 {len(rewritten)} 個年份並追加新交易日，共 {written} 列 (至 {manifest['last_date']})")
+    else:
+        log(f"快照已追加 {written} 列 (至 {manifest['last_date']})")
+    return written
+
+
+@metrics.timed(metrics.DB_SECONDS, op='export_snapshot')
+def export_snapshot(full=False, export_dir=EXPORT_DIR, log=None):
+    """匯出 stock_data 快照（write_db_tables 完成後呼叫）
+
+    Args:
+        full (bool): True=完整匯出；False=追加新交易日並重寫有變更的年份
+        export_dir (str): 匯出根目錄
+        log (callable): 訊息輸出函數
+
+    Returns:
+        int: 寫入的資料列數，失敗時返回 0
+    """
+    log = log or print
+    try:
+        os.makedirs(export_dir, exist_ok=True)
+        return export_full(export_dir, log) if full else export_append(export_dir, log)
+    except Exception as e:
+        log(f"快照匯出異常: {e}")
+        return 0
+
+
+def load_table(tickers=None, start=None, end=None, columns=None, export_dir=EXPORT_DIR):
+    """以記憶體映射載入 Arrow 快照（未壓縮的 IPC 檔不需解碼與複製）
+
+    Args:
+        tickers (str | list): 股票代碼或代碼列表，None 表示全部
+        start (date | str): 起始日期（含），None 表示不限
+        end (date | str): 結束日期（含），None 表示不限
+        columns (list): 要保留的價格欄位，預設全部
+        export_dir (str): 匯出根目錄
+
+    Returns:
+        pa.Table: 含 ticker、date 與價格欄位，依年份、(ticker, date) 排列
+    """
+    arrow_dir = _paths(export_dir)[1]
+    start = date.fromisoformat(start) if isinstance(start, str) else start
+    end = date.fromisoformat(end) if isinstance(end, str) else end
+
+    tables = []
+    names = sorted(os.listdir(arrow_dir)) if os.path.isdir(arrow_dir) else []
+    for name in names:
+        if not name.endswith('.arrow'):
+            continue
+        year = int(name[len('year='):-len('.arrow')])
+        if (start and year < start.year) or (end and year > end.year):
+            continue  # 以檔名略過範圍外的年份
+        with pa.memory_map(os.path.join(arrow_dir, name), 'r') as source:
+            tables.append(ipc.open_file(source).read_all())
+    table = pa.concat_tables(tables) if tables else SCHEMA.empty_table()
+
+    if tickers is not None:
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        table = table.filter(pc.is_in(table.column('ticker'), pa.array(tickers, pa.string())))
+    if start is not None:
+        table = table.filter(pc.greater_equal(table.column('date'), pa.scalar(start, pa.date32())))
+    if end is not None:
+        table = table.filter(pc.less_equal(table.column('date'), pa.scalar(end, pa.date32())))
+    if columns is not None:
+        table = table.select(['ticker', 'date'] + list(columns))
+    return table
+
+
+def read_snapshot(tickers=None, start=None, end=None, columns=None, export_dir=EXPORT_DIR):
+    """載入快照並轉為與 read_db_tables.read_stock_data 相同格式的 DataFrame
+
+    Returns:
+        pd.DataFrame: 以 date 為 DatetimeIndex、含 ticker 欄位的 DataFrame
+    """
+    frame = load_table(tickers, start, end, columns, export_dir).to_pandas()
+    frame['date'] = frame['date'].astype('datetime64[ns]')
+    return frame.set_index('date')
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'append'
+    if command == 'load':
+        begin = time.perf_counter()
+        table = load_table()
+        print(f"載入 {table.num_rows} 列、{len(pc.unique(table.column('ticker')))} 支股票: "
+              f"{time.perf_counter() - begin:.3f} 秒")
+    else:
+        export_snapshot(full=command == 'full')
+
+
+if __name__ == "__main__":
+    main()
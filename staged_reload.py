@@ -0,0 +1,333 @@
+"""分階段重新載入 stock_data（影子表 + 原子切換）
+
+1. 建立沒有主鍵與索引的 stock_data_shadow，下載結果分段以 COPY 直接寫入（不需 ON CONFLICT 合併）
+2. 載入完成後一次建立主鍵、日期索引與外鍵，並由影子表產生摘要、週線/月線與除權息因子的影子表
+3. 在同一事務中刪除舊表、把影子表改名為正式名稱，讀取端只在切換的瞬間等待鎖，不會看到空表
+中途停止或失敗時只刪除影子表，正式資料表完全不受影響；任何股票下載失敗、或原本有數據卻沒有
+下載到任何一列（空回應、限流），也會放棄切換，避免該股票的歷史數據隨舊表一起被刪除。
+只重新載入部分股票時，其他股票的數據與除權息事件在切換前由正式表複製到影子表。
+
+用法: python staged_reload.py [股票代號 ...]（未指定代號時重新載入 stock_summary 中的全部股票）
+"""
+import os
+import sys
+import time
+
+import pandas as pd
+from psycopg2 import sql
+from dotenv import load_dotenv
+# 加載 .env 文件中的環境變數
+load_dotenv()
+
+import adjustments
+import batch_download
+import bulk_load
+import db_pool
+import db_schema
+import metrics
+import rollups
+
+SHADOW_SUFFIX = '_shadow'
+# 一起重建並切換的資料表（stock_data 之外都由 stock_data 衍生）
+RELOAD_TABLES = ['stock_data', 'stock_summary', 'stock_weekly', 'stock_monthly', 'adjustment_factors']
+SWAP_LOCK_TIMEOUT = os.getenv('RELOAD_LOCK_TIMEOUT', '10s')  # 切換時等待讀取端釋放鎖的上限
+
+
+def shadow(table):
+    return f"{table}{SHADOW_SUFFIX}"
+
+
+def drop_shadows(cur):
+    """刪除所有影子表（分區會隨父表一起刪除）"""
+    cur.execute(sql.SQL("DROP TABLE IF EXISTS {} CASCADE").format(
+        sql.SQL(', ').join(sql.Identifier(shadow(table)) for table in RELOAD_TABLES)))
+
+
+def create_shadows(cur, partitioned):
+    """建立影子表：stock_data 只有欄位（主鍵與索引載入後才建立），衍生表複製完整結構
+
+    Args:
+        cur: psycopg2 游標
+        partitioned (bool): stock_data 是否為年份分區表（影子表沿用相同結構）
+    """
+    drop_shadows(cur)
+    cur.execute(sql.SQL("CREATE TABLE {} (LIKE stock_data INCLUDING DEFAULTS) {}").format(
+        sql.Identifier(shadow('stock_data')),
+        sql.SQL("PARTITION BY RANGE (date)") if partitioned else sql.SQL("")))
+    for table in RELOAD_TABLES[1:]:
+        cur.execute(sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING ALL)").format(
+            sql.Identifier(shadow(table)), sql.Identifier(table)))
+
+
+def create_shadow_partitions(cur, years):
+    """為分區的影子表建立年份分區（命名為 stock_data_shadow_年份，切換時改為 stock_data_年份）"""
+    for year in sorted(years):
+        cur.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)
+        """).format(partition=sql.Identifier(f"{shadow('stock_data')}_{year}"),
+                    table=sql.Identifier(shadow('stock_data'))),
+            (f"{year}-01-01", f"{year + 1}-01-01"))
+
+
+@metrics.timed(metrics.DB_SECONDS, op='carry_over')
+def carry_over(cur, tickers, partitioned, years):
+    """把不在本次重新載入範圍內的股票，由正式表複製到影子表（建立主鍵前，直接附加）
+
+    Args:
+        cur: psycopg2 游標
+        tickers (list): 本次重新載入的股票代號
+        partitioned (bool): 影子表是否為年份分區表
+        years (set): 影子表已建立的分區年份（會加入新建立的年份）
+
+    Returns:
+        int: 複製的 stock_data 列數
+    """
+    if partitioned:
+        cur.execute("""
+        SELECT EXTRACT(YEAR FROM MIN(first_date))::int, EXTRACT(YEAR FROM MAX(last_date))::int
+        FROM stock_summary WHERE NOT (ticker = ANY(%s))
+        """, (list(tickers),))
+        first, last = cur.fetchone()
+        if first is not None:
+            new_years = set(range(first, last + 1)) - years
+            create_shadow_partitions(cur, new_years)
+            years |= new_years
+    copied = 0
+    for table in ('stock_data', 'adjustment_factors'):
+        cur.execute(sql.SQL("INSERT INTO {} SELECT * FROM {} WHERE NOT (ticker = ANY(%s))").format(
+            sql.Identifier(shadow(table)), sql.Identifier(table)), (list(tickers),))
+        if table == 'stock_data':
+            copied = cur.rowcount
+    return copied
+
+
+def missing_history(cur, tickers, loaded):
+    """要求重新載入、目前有歷史數據，但影子表中沒有任何一列的股票
+
+    空回應或被限流時資料來源不會回報失敗，切換後這些股票的歷史會被刪除。
+
+    Args:
+        cur: psycopg2 游標
+        tickers (list): 本次重新載入的股票代號
+        loaded (set): 影子表中有數據的股票代號
+
+    Returns:
+        list: 股票代號（已排序）
+    """
+    missing = [ticker for ticker in tickers if ticker not in loaded]
+    if not missing:
+        return []
+    cur.execute("SELECT ticker FROM stock_summary WHERE ticker = ANY(%s) ORDER BY ticker", (missing,))
+    return [row[0] for row in cur.fetchall()]
+
+
+@metrics.timed(metrics.DB_SECONDS, op='build_shadows')
+def build_shadows(cur, events):
+    """載入完成後建立影子表的主鍵、索引與外鍵，並產生衍生影子表
+
+    Args:
+        cur: psycopg2 游標
+        events (pd.DataFrame): 載入期間收集的除權息事件（frame_to_rows 格式）
+    """
+    data = sql.Identifier(shadow('stock_data'))
+    # 一次排序建立索引，比逐列維護索引快得多
+    cur.execute(sql.SQL("ALTER TABLE {} ADD PRIMARY KEY (ticker, date)").format(data))
+    cur.execute(sql.SQL("CREATE INDEX {} ON {} (date)").format(
+        sql.Identifier(f"{shadow('stock_data')}_date_idx"), data))
+    cur.execute(sql.SQL("""
+    INSERT INTO stock_codes (ticker) SELECT DISTINCT ticker FROM {} ON CONFLICT (ticker) DO NOTHING
+    """).format(data))
+    cur.execute(sql.SQL("ALTER TABLE {} ADD FOREIGN KEY (ticker) REFERENCES stock_codes (ticker)").format(data))
+
+    cur.execute(sql.SQL("""
+    INSERT INTO {} (ticker, row_count, first_date, last_date, changed_from)
+    SELECT ticker, COUNT(*), MIN(date), MAX(date), MIN(date) FROM {} GROUP BY ticker
+    """).format(sql.Identifier(shadow('stock_summary')), data))
+    rollups.refresh_rollups(cur, source=shadow('stock_data'), suffix=SHADOW_SUFFIX)
+    if not events.empty:
+        adjustments.record_actions(cur, events, events.groupby('ticker')['date'].min(),
+                                   table=shadow('adjustment_factors'), source=shadow('stock_data'))
+    for table in RELOAD_TABLES:
+        cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(shadow(table))))  # 切換後查詢計畫立即可用
+
+
+def _rename_shadow_objects(cur, table):
+    """把影子表的分區、索引與約束名稱中的影子前綴改為正式名稱（分區上的索引與約束一併處理）"""
+    prefix = shadow(table)
+
+    def canonical(name):
+        return table + name[len(prefix):]
+
+    cur.execute("""
+    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = %s::regclass AND c.relname LIKE %s
+    """, (table, prefix + '%'))
+    for (name,) in cur.fetchall():
+        cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(
+            sql.Identifier(name), sql.Identifier(canonical(name))))
+
+    # 資料表本身與其分區
+    relations = """(SELECT %(table)s::regclass
+                    UNION ALL SELECT inhrelid FROM pg_inherits WHERE inhparent = %(table)s::regclass)"""
+    params = {"table": table, "prefix": prefix + '%'}
+    # 主鍵與唯一約束隨索引一起改名
+    cur.execute(f"""
+    SELECT c.relname FROM pg_index x JOIN pg_class c ON c.oid = x.indexrelid
+    WHERE x.indrelid IN {relations} AND c.relname LIKE %(prefix)s
+    """, params)
+    for (name,) in cur.fetchall():
+        cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+            sql.Identifier(name), sql.Identifier(canonical(name))))
+    cur.execute(f"""
+    SELECT c.relname, o.conname FROM pg_constraint o JOIN pg_class c ON c.oid = o.conrelid
+    WHERE o.conrelid IN {relations} AND o.conname LIKE %(prefix)s
+    """, params)
+    for relation, name in cur.fetchall():
+        cur.execute(sql.SQL("ALTER TABLE {} RENAME CONSTRAINT {} TO {}").format(
+            sql.Identifier(relation), sql.Identifier(name), sql.Identifier(canonical(name))))
+
+
+@metrics.timed(metrics.DB_SECONDS, op='swap_shadows')
+def swap_shadows(cur, tickers):
+    """刪除舊表並把影子表改名為正式名稱（呼叫端在同一事務中提交）
+
+    重新載入的股票除權息因子整批重建，其以舊因子計算的指標與選股欄位一併刪除，由呼叫端重新計算；
+    這些股票已是原始價格，同時移除 legacy_prices 標記。
+
+    Args:
+        cur: psycopg2 游標
+        tickers (list): 本次重新載入的股票代號
+    """
+    cur.execute("SELECT set_config('lock_timeout', %s, true)", (SWAP_LOCK_TIMEOUT,))
+    for table in RELOAD_TABLES:
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS {} CASCADE").format(sql.Identifier(table)))
+        cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(
+            sql.Identifier(shadow(table)), sql.Identifier(table)))
+        _rename_shadow_objects(cur, table)
+    adjustments.invalidate_derived(cur, tickers)
+    # 重新載入的股票已是原始價格，可以套用因子
+    cur.execute("DELETE FROM legacy_prices WHERE ticker = ANY(%s)", (list(tickers),))
+
+
+def check_failures(failed, reason="下載失敗"):
+    """有股票下載失敗時中止重新載入（影子表中沒有這些股票的數據，切換會刪除其歷史）
+
+    Raises:
+        RuntimeError: failed 不為空
+    """
+    if failed:
+        raise RuntimeError(f"{len(failed)} 支股票{reason}，放棄重新載入: {', '.join(sorted(failed)[:10])}")
+
+
+@metrics.timed(metrics.DB_SECONDS, op='reload_range')
+def current_range():
+    """目前資料的股票代號與最早日期（預設的重新載入範圍，保留既有的歷史深度）
+
+    Returns:
+        tuple: (股票代號列表, 最早日期 datetime 或 None)
+    """
+    db_schema.ensure_schema()
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT ticker FROM stock_summary ORDER BY ticker")
+            tickers = [row[0] for row in cur.fetchall()]
+            cur.execute("SELECT MIN(first_date) FROM stock_summary")
+            first = cur.fetchone()[0]
+        conn.commit()
+    return tickers, first
+
+
+def run_reload(tickers, start_date=None, end_date=None, frames=None, stop_event=None, log=None, on_progress=None):
+    """以影子表重新載入數據，完成後原子切換
+
+    Args:
+        tickers (list): 重新載入的股票代號列表（其他股票保留正式表中的數據）
+        start_date (datetime): 下載起始日期，預設為 batch_download.HISTORY_DAYS 天前
+        end_date (datetime): 下載結束日期，預設為現在
+        frames (iterable): (股票代號, DataFrame) 的可迭代物件，None 表示由資料來源下載
+        stop_event (threading.Event): 停止信號，設置後放棄影子表，正式資料表不變
+        log (callable): 訊息輸出函數
+        on_progress (callable): 每載入一段以 (已完成股票數, 股票總數) 呼叫一次
+
+    Returns:
+        dict: {"rows", "tickers", "load_seconds", "build_seconds", "swap_seconds", "stopped"}
+
+    Raises:
+        RuntimeError: 有股票下載失敗，或原本有數據卻沒有下載到任何一列（已刪除影子表，正式資料表不變）
+    """
+    log = log or print
+    db_schema.ensure_schema()
+    failed = set()
+    if frames is None:
+        frames = batch_download.iter_stock_data_batches(
+            tickers, start_date=start_date, end_date=end_date, retry_empty=False, stop_event=stop_event, log=log,
+            on_failure=failed.update)
+    summary = {"rows": 0, "tickers": 0, "load_seconds": 0, "build_seconds": 0, "swap_seconds": 0,
+               "stopped": False}
+
+    with db_pool.connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                create_shadows(cur, db_schema.is_partitioned(cur, 'stock_data'))
+                conn.commit()
+                partitioned = db_schema.is_partitioned(cur, shadow('stock_data'))
+
+                begin, years, events, loaded = time.monotonic(), set(), [], set()
+                for rows, finished in bulk_load.iter_row_chunks(frames):
+                    check_failures(failed)  # 已確定無法切換，不必再下載其餘股票
+                    if stop_event is not None and stop_event.is_set():
+                        break
+                    if partitioned:
+                        new_years = {day.year for day in rows['date'].unique()} - years
+                        create_shadow_partitions(cur, new_years)
+                        years |= new_years
+                    # 影子表沒有主鍵，同一段內重複的 (ticker, date) 先去除
+                    bulk_load.copy_rows(cur, rows.drop_duplicates(['ticker', 'date'], keep='last'),
+                                        shadow('stock_data'))
+                    conn.commit()
+                    events.append(adjustments.action_rows(rows))
+                    loaded.update(rows['ticker'].unique())
+                    summary["rows"] += len(rows)
+                    summary["tickers"] += len(finished)
+                    if on_progress:
+                        on_progress(summary["tickers"], len(tickers))
+                summary["load_seconds"] = round(time.monotonic() - begin, 2)
+
+                if stop_event is not None and stop_event.is_set():
+                    drop_shadows(cur)
+                    conn.commit()
+                    summary["stopped"] = True
+                    log("重新載入已停止，正式資料表未變更")
+                    return summary
+                check_failures(failed)
+                check_failures(missing_history(cur, tickers, loaded), "沒有下載到任何數據（空回應或被限流）")
+
+                copied = carry_over(cur, tickers, partitioned, years)
+                conn.commit()
+                log(f"已載入 {summary['rows']} 列到影子表（另保留其他股票的 {copied} 列），建立索引與衍生表")
+                begin = time.monotonic()
+                build_shadows(cur, pd.concat(events, ignore_index=True) if events else bulk_load.empty_rows())
+                conn.commit()
+                summary["build_seconds"] = round(time.monotonic() - begin, 2)
+
+                begin = time.monotonic()
+                swap_shadows(cur, tickers)
+                conn.commit()  # 刪除舊表與改名在同一事務中生效
+                summary["swap_seconds"] = round(time.monotonic() - begin, 3)
+        except Exception:
+            conn.rollback()
+            with conn.cursor() as cur:
+                drop_shadows(cur)
+            conn.commit()
+            raise
+    db_schema.reset()  # 分區可能已改變，下次寫入時重新確認
+    log(f"重新載入完成: {summary['tickers']} 支股票 {summary['rows']} 列，載入 {summary['load_seconds']} 秒、"
+        f"建立索引 {summary['build_seconds']} 秒、切換 {summary['swap_seconds']} 秒")
+    return summary
+
+
+if __name__ == "__main__":
+    tickers, first = current_range()
+    tickers = sys.argv[1:] or tickers
+    result = run_reload(tickers, start_date=first)
+    print(f"完成: {result['tickers']} 支股票 {result['rows']} 列")
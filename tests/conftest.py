@@ -0,0 +1,5 @@
+"""測試共用設定：讓測試可以直接 import 專案根目錄的模組（不需要資料庫連接）"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import adjustments
+
+
+def day(value):
+    """日期字串轉為 1970-01-01 起算的天數（與 load_factors 相同）"""
+    return int(np.datetime64(value, 'D').astype('int64'))
+
+
+@pytest.fixture
+def factors(monkeypatch):
+    """以 (日期, 價格因子, 分割比例) 列表直接設定快取，不查詢資料庫"""
+    monkeypatch.setattr(adjustments, '_factors', {})
+    monkeypatch.setattr(adjustments, '_legacy', set())
+
+    def seed(ticker, events):
+        adjustments._factors[ticker] = (
+            np.array([day(d) for d, _, _ in events], dtype='int64'),
+            adjustments._suffix_product(np.array([f for _, f, _ in events], dtype='float64')),
+            adjustments._suffix_product(np.array([s for _, _, s in events], dtype='float64')))
+    return seed
+
+
+def make_data(ticker, closes, volumes):
+    dates = pd.date_range('2024-01-01', periods=len(closes), name='date')
+    return pd.DataFrame({'ticker': ticker, 'close': np.array(closes, dtype='float64'),
+                         'volume': np.array(volumes, dtype='int64')}, index=dates)
+
+
+def test_suffix_product():
+    result = adjustments._suffix_product(np.array([0.5, 0.9, 0.8]))
+    np.testing.assert_allclose(result, [0.36, 0.72, 0.8, 1.0])
+    np.testing.assert_allclose(adjustments._suffix_product(np.array([])), [1.0])
+
+
+def test_adjust_applies_later_factors(factors):
+    # 01-03 一拆二，01-05 除息（因子 0.9）
+    factors('A.TW', [('2024-01-03', 0.5, 2.0), ('2024-01-05', 0.9, 1.0)])
+    data = make_data('A.TW', [100, 100, 50, 50, 45, 45], [10, 10, 20, 20, 20, 20])
+    result = adjustments.adjust(data)
+
+    # 事件當天已是除權息後價格，只乘以之後事件的因子
+    np.testing.assert_allclose(result['close'], [45, 45, 45, 45, 45, 45])
+    assert result['volume'].tolist() == [20, 20, 20, 20, 20, 20]
+    assert result['volume'].dtype == 'int64'
+    assert data['close'].iloc[0] == 100  # 不修改輸入
+
+
+def test_adjust_tickers_without_events_and_mixed_rows(factors):
+    factors('A.TW', [('2024-01-02', 0.5, 2.0)])
+    factors('B.TW', [])
+    data = pd.concat([make_data('A.TW', [10, 5], [1, 2]), make_data('B.TW', [7, 8], [3, 4])])
+    result = adjustments.adjust(data)
+
+    assert result['close'].tolist() == [5, 5, 7, 8]
+    assert result['volume'].tolist() == [2, 2, 3, 4]
+
+
+def test_adjust_leaves_legacy_tickers_unchanged(factors, monkeypatch):
+    # 舊版數據已是 Yahoo 調整後價格，再套用因子會重複調整
+    factors('A.TW', [('2024-01-02', 0.5, 2.0)])
+    monkeypatch.setattr(adjustments, '_legacy', {'A.TW'})
+    data = make_data('A.TW', [5, 5], [2, 2])
+    result = adjustments.adjust(data)
+
+    assert result['close'].tolist() == [5, 5]
+    assert result['volume'].tolist() == [2, 2]
+
+
+def test_adjust_empty():
+    data = make_data('A.TW', [], [])
+    assert adjustments.adjust(data).empty
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta, timezone
+
+import api_cache
+
+
+def test_entry_misses_when_data_version_changes():
+    cache = api_cache.LRUCache(maxsize=4)
+    cache.put(('2330.TW', None), 'old', version=1)
+    assert cache.get(('2330.TW', None), version=1) == 'old'
+
+    # 其他進程寫入後資料庫中的版本改變，本進程沒有收到寫入通知也不會命中
+    assert cache.get(('2330.TW', None), version=2) is None
+    assert cache.get(('2330.TW', None), version=1) is None  # 過期項目已移除
+
+
+def test_put_with_version_read_before_a_concurrent_write():
+    cache = api_cache.LRUCache(maxsize=4)
+    version = 1  # 查詢前取得的版本
+    cache.put(('2330.TW',), 'maybe stale', version)  # 查詢期間有寫入提交，版本變為 2
+    assert cache.get(('2330.TW',), version=2) is None
+
+
+def test_invalidate_tickers_only_drops_that_ticker():
+    cache = api_cache.LRUCache(maxsize=4)
+    cache.put(('2330.TW',), 'a', 1)
+    cache.put(('2317.TW',), 'b', 1)
+    cache.invalidate_tickers(['2317.TW'])
+    assert cache.get(('2330.TW',), 1) == 'a'
+    assert cache.get(('2317.TW',), 1) is None
+
+
+def test_last_modified_prefers_data_version():
+    cache = api_cache.LRUCache(maxsize=4)
+    version = datetime(2024, 1, 2, 9, 30, 15, 123456, tzinfo=timezone(timedelta(hours=8)))
+    assert cache.last_modified('2330.TW', version) == datetime(2024, 1, 2, 1, 30, 15, tzinfo=timezone.utc)
+    assert cache.last_modified('2330.TW').tzinfo == timezone.utc
+
+
+def test_lru_evicts_least_recently_used():
+    cache = api_cache.LRUCache(maxsize=2)
+    cache.put(('a',), 1)
+    cache.put(('b',), 2)
+    cache.get(('a',))
+    cache.put(('c',), 3)
+    assert cache.get(('b',)) is None
+    assert cache.get(('a',)) == 1 and cache.get(('c',)) == 3
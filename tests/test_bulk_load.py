@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+import bulk_load
+
+
+def make_frame(days, start='2024-01-01'):
+    """與 yf.download 單支股票相同格式的 DataFrame（days 個交易日，全部有成交量）"""
+    index = pd.bdate_range(start, periods=days, name='Date')
+    values = np.arange(1, days + 1, dtype='float64')
+    return pd.DataFrame({'Close': values, 'High': values, 'Low': values, 'Open': values,
+                         'Volume': values * 100}, index=index)
+
+
+def chunks_of(frames, chunk_rows):
+    return [(sorted(set(rows['ticker'])), len(rows), done)
+            for rows, done in bulk_load.iter_row_chunks(frames, chunk_rows)]
+
+
+def test_iter_row_chunks_keeps_each_ticker_in_one_chunk():
+    frames = [('A', make_frame(3)), ('B', make_frame(4)), ('C', make_frame(2))]
+    assert chunks_of(frames, chunk_rows=5) == [(['A'], 3, ['A']), (['B'], 4, ['B']), (['C'], 2, ['C'])]
+    assert chunks_of(frames, chunk_rows=7) == [(['A', 'B'], 7, ['A', 'B']), (['C'], 2, ['C'])]
+
+
+def test_iter_row_chunks_oversized_ticker_forms_its_own_chunk():
+    frames = [('A', make_frame(2)), ('BIG', make_frame(12)), ('C', make_frame(1))]
+    assert chunks_of(frames, chunk_rows=5) == [(['A'], 2, ['A']), (['BIG'], 12, ['BIG']), (['C'], 1, ['C'])]
+
+
+def test_iter_row_chunks_marks_done_only_tickers_fully_in_chunk():
+    frames = [('A', make_frame(3)), ('EMPTY', pd.DataFrame()), ('B', make_frame(3))]
+    chunks = list(bulk_load.iter_row_chunks(frames, chunk_rows=4))
+    for rows, done in chunks:  # 標記完成的股票，全部資料列都在同一段
+        assert all((rows['ticker'] == ticker).sum() == 3 for ticker in done if ticker != 'EMPTY')
+    assert [done for _, done in chunks] == [['A', 'EMPTY'], ['B']]
+    assert sum(len(rows) for rows, _ in chunks) == 6
+
+
+def test_iter_row_chunks_empty_input_and_all_empty_frames():
+    assert list(bulk_load.iter_row_chunks([])) == []
+    (rows, done), = bulk_load.iter_row_chunks([('X', pd.DataFrame())])
+    assert rows.empty and list(rows.columns) == bulk_load.ROW_COLUMNS
+    assert done == ['X']
+
+
+def test_frame_to_rows_drops_halted_days():
+    frame = make_frame(3)
+    frame.iloc[1, frame.columns.get_loc('Volume')] = 0
+    rows = bulk_load.frame_to_rows(frame, 'A')
+    assert rows['volume'].tolist() == [100, 300]
+    assert rows['close'].dtype == np.float32
+    assert rows['dividend'].tolist() == [0, 0]
+
+
+def test_inserted_counts_keeps_tickers_with_only_updates():
+    counts = bulk_load._inserted_counts([('A', True), ('B', False), ('A', True), ('B', False), ('A', False)])
+    assert counts.to_dict() == {'A': 2, 'B': 0}
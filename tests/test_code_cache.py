@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta
+
+import code_cache
+
+NOW = datetime(2026, 1, 31, 12, 0)
+
+
+def test_partition_codes_uses_separate_positive_and_negative_ttls():
+    cache = {
+        'fresh_valid': (True, NOW - timedelta(days=10)),
+        'stale_valid': (True, NOW - timedelta(days=31)),
+        'fresh_invalid': (False, NOW - timedelta(days=5)),
+        'stale_invalid': (False, NOW - timedelta(days=15)),
+    }
+    codes = ['unknown', 'stale_invalid', 'fresh_valid', 'fresh_invalid', 'stale_valid']
+    known_valid, to_check = code_cache.partition_codes(
+        codes, cache, now=NOW, positive_ttl=timedelta(days=30), negative_ttl=timedelta(days=14))
+
+    assert known_valid == ['fresh_valid']
+    # 未快取與過期的代號需重新檢查，維持輸入順序；未過期的無效代號直接略過
+    assert to_check == ['unknown', 'stale_invalid', 'stale_valid']
+
+
+def test_partition_codes_expires_strictly_after_ttl():
+    cache = {'edge': (True, NOW - timedelta(days=30))}
+    assert code_cache.partition_codes(['edge'], cache, now=NOW, positive_ttl=timedelta(days=30)) == (['edge'], [])
+    assert code_cache.partition_codes(['edge'], cache, now=NOW + timedelta(seconds=1),
+                                      positive_ttl=timedelta(days=30)) == ([], ['edge'])
+
+
+def test_partition_codes_with_empty_cache_checks_everything():
+    assert code_cache.partition_codes(['a', 'b'], {}, now=NOW) == ([], ['a', 'b'])
@@ -0,0 +1,33 @@
+import pytest
+
+import data_sources
+
+
+class FakeTicker:
+    def __init__(self, info=None, error=None):
+        self._info, self._error = info, error
+
+    @property
+    def info(self):
+        if self._error:
+            raise self._error
+        return self._info
+
+
+def use_ticker(monkeypatch, **kwargs):
+    monkeypatch.setattr(data_sources.yf, 'Ticker', lambda ticker: FakeTicker(**kwargs))
+
+
+def test_is_stock_code_treats_missing_quote_as_invalid(monkeypatch):
+    use_ticker(monkeypatch, info={'trailingPegRatio': None})
+    assert data_sources.YFinanceSource().is_stock_code('9999.TW') is False
+    use_ticker(monkeypatch, info={'regularMarketPrice': 12.5})
+    assert data_sources.YFinanceSource().is_stock_code('2330.TW') is True
+
+
+@pytest.mark.parametrize('error', [ConnectionError('reset'), TimeoutError('slow'),
+                                   data_sources.json.JSONDecodeError('Expecting value', '<html>', 0)])
+def test_is_stock_code_propagates_transient_errors(monkeypatch, error):
+    use_ticker(monkeypatch, error=error)
+    with pytest.raises(type(error)):
+        data_sources.YFinanceSource().is_stock_code('2330.TW')
@@ -0,0 +1,58 @@
+import pytest
+from psycopg2 import sql
+
+import db_schema
+
+
+class FakeCursor:
+    """記錄執行的語句；is_partitioned 的查詢一律回答「是分區表」"""
+
+    def __init__(self):
+        self.created = []
+
+    def execute(self, statement, params=None):
+        if isinstance(statement, sql.Composed):  # CREATE TABLE 分區 PARTITION OF 資料表
+            partition, table = [part.string for part in statement.seq if isinstance(part, sql.Identifier)]
+            self.created.append((table, params[0][:4]))
+
+    def fetchone(self):
+        return (True,)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    db_schema._partition_years.clear()
+    yield
+    db_schema._partition_years.clear()
+
+
+def ensure(cur, years, table):
+    """建立分區並視為已提交"""
+    db_schema.remember_partitions(db_schema.ensure_partitions(cur, years, table))
+
+
+def test_ensure_partitions_caches_per_table():
+    cur = FakeCursor()
+    ensure(cur, {2024, 2025}, 'stock_data')
+    ensure(cur, {2024}, 'stock_data')  # 已快取，不再建立
+    ensure(cur, {2024}, 'stock_data_shadow')  # 同一年份、不同資料表仍需建立
+
+    assert cur.created == [('stock_data', '2024'), ('stock_data', '2025'), ('stock_data_shadow', '2024')]
+    assert db_schema._partition_years == {('stock_data', 2024), ('stock_data', 2025), ('stock_data_shadow', 2024)}
+
+
+def test_reset_forgets_all_partitions():
+    ensure(FakeCursor(), {2024}, 'stock_data')
+    db_schema.reset()
+    cur = FakeCursor()
+    ensure(cur, {2024}, 'stock_data')
+    assert cur.created == [('stock_data', '2024')]
+
+
+def test_uncommitted_partitions_are_not_cached():
+    # 事務回滾時分區並不存在，下次寫入必須重新建立
+    db_schema.ensure_partitions(FakeCursor(), {2024}, 'stock_data')
+    cur = FakeCursor()
+    db_schema.ensure_partitions(cur, {2024}, 'stock_data')
+    assert cur.created == [('stock_data', '2024')]
+    assert db_schema._partition_years == set()
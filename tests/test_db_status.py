@@ -0,0 +1,32 @@
+from datetime import date
+
+import pandas as pd
+
+import db_status
+
+
+class FakeCursor:
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, statement, params=None):
+        self.executed.append((statement, params))
+
+
+def test_refresh_summary_adds_inserted_counts_without_recounting():
+    cur = FakeCursor()
+    since = pd.Series({'A': date(2024, 1, 2), 'B': date(2024, 3, 1)})
+    until = pd.Series({'A': date(2024, 1, 5), 'B': date(2024, 3, 1)})
+    db_status.refresh_summary(cur, since, until, pd.Series({'A': 3}))
+
+    (statement, params), = cur.executed
+    assert 'stock_data' not in statement  # 不掃描股票的歷史數據
+    assert 'stock_summary.row_count + EXCLUDED.row_count' in statement
+    assert params == (['A', 'B'], [3, 0], [date(2024, 1, 2), date(2024, 3, 1)],
+                      [date(2024, 1, 5), date(2024, 3, 1)])
+
+
+def test_refresh_summary_skips_empty_writes():
+    cur = FakeCursor()
+    db_status.refresh_summary(cur, pd.Series(dtype=object), pd.Series(dtype=object), pd.Series(dtype='int64'))
+    assert cur.executed == []
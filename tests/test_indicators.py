@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import indicators
+
+
+def make_data(closes):
+    """{股票代號: 收盤價列表} 轉為 read_stock_data 格式的長表（NaN 表示當天無交易）"""
+    dates = pd.bdate_range('2024-01-01', periods=max(len(values) for values in closes.values()), name='date')
+    frames = []
+    for ticker, values in closes.items():
+        close = pd.Series(values, index=dates[:len(values)], dtype='float64').dropna()
+        frames.append(pd.DataFrame({'ticker': ticker, 'high': close + 1, 'low': close - 1, 'close': close},
+                                   index=close.index))
+    return pd.concat(frames)
+
+
+def test_compute_indicators_per_ticker_rows_and_sma():
+    data = make_data({'A.TW': list(range(1, 8)), 'B.TW': [10, 10, np.nan, 10, 10, 10, 10]})
+    result = indicators.compute_indicators(data)
+
+    assert list(result.columns) == ['ticker'] + indicators.INDICATOR_COLUMNS
+    assert (result['ticker'] == 'A.TW').sum() == 7
+    assert (result['ticker'] == 'B.TW').sum() == 6  # 無交易的日期不產出
+    a = result[result['ticker'] == 'A.TW']
+    assert np.isnan(a['sma_5'].iloc[3])
+    assert a['sma_5'].iloc[4:].tolist() == [3, 4, 5]
+    # 缺值日期在面板上是 NaN，視窗內有缺值時 SMA 為 NaN
+    b = result[result['ticker'] == 'B.TW']
+    assert b['sma_5'].isna().all()
+
+
+def test_rsi_and_atr_on_constant_moves():
+    data = make_data({'UP.TW': [float(i) for i in range(1, 31)]})
+    result = indicators.compute_indicators(data)
+    assert np.isnan(result['rsi_14'].iloc[13])
+    assert result['rsi_14'].iloc[14:].eq(100).all()  # 只漲不跌
+    assert result['atr_14'].iloc[13:].to_numpy() == pytest.approx(2.0)  # 高低差 2，跳空 1 不超過高低差
+    assert result['macd_hist'].notna().all()
+
+
+def test_compute_indicators_empty():
+    result = indicators.compute_indicators(pd.DataFrame(columns=['ticker', 'high', 'low', 'close']))
+    assert result.empty
+    assert list(result.columns) == ['ticker'] + indicators.INDICATOR_COLUMNS
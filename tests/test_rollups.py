@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+import rollups
+
+
+def days(*values):
+    return np.array(values, dtype='datetime64[D]')
+
+
+def test_period_starts_align_weeks_and_months():
+    dates = days('2024-12-30', '2025-01-02', '2025-01-05', '2025-01-06')
+    assert rollups.period_starts(dates, 'week').tolist() == list(days('2024-12-30', '2024-12-30',
+                                                                      '2024-12-30', '2025-01-06'))
+    # 兩週週期以 1970-01-05 起每兩週對齊
+    two_weeks = rollups.period_starts(dates, 'week', 2)
+    assert len(set(two_weeks.tolist())) <= 2
+    assert all((start - np.datetime64('1970-01-05')).astype(int) % 14 == 0 for start in two_weeks)
+
+    months = days('2025-02-15', '2025-05-31', '2025-12-01')
+    assert rollups.period_starts(months, 'month').tolist() == list(days('2025-02-01', '2025-05-01', '2025-12-01'))
+    assert rollups.period_starts(months, 'month', 3).tolist() == list(days('2025-01-01', '2025-04-01', '2025-10-01'))
+    assert rollups.period_starts(months, 'month', 12).tolist() == list(days('2025-01-01', '2025-01-01', '2025-01-01'))
+
+
+def test_resample_bars_aggregates_per_ticker():
+    index = pd.DatetimeIndex(['2025-01-01', '2025-02-01', '2025-03-01', '2025-04-01',
+                              '2025-01-01', '2025-02-01'], name='date')
+    data = pd.DataFrame({'ticker': ['A'] * 4 + ['B'] * 2,
+                         'open': [1.0, 2.0, 3.0, 4.0, 10.0, 11.0],
+                         'high': [5.0, 9.0, 6.0, 7.0, 12.0, 15.0],
+                         'low': [0.5, 1.5, 2.5, 3.5, 9.0, 8.0],
+                         'close': [2.0, 3.0, 4.0, 5.0, 11.0, 12.0],
+                         'volume': [10, 20, 30, 40, 1, 2]}, index=index)
+    result = rollups.resample_bars(data, 'month', 3)
+
+    assert list(result.columns) == ['ticker', 'open', 'high', 'low', 'close', 'volume']
+    a = result[result['ticker'] == 'A']
+    assert a.index.strftime('%Y-%m-%d').tolist() == ['2025-01-01', '2025-04-01']
+    assert a.iloc[0][['open', 'high', 'low', 'close', 'volume']].tolist() == [1.0, 9.0, 0.5, 4.0, 60]
+    b = result[result['ticker'] == 'B'].iloc[0]
+    assert [b['open'], b['high'], b['low'], b['close'], b['volume']] == [10.0, 15.0, 8.0, 12.0, 3]
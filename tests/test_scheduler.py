@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import pytest
+
+import scheduler
+
+
+def test_cron_parses_ranges_lists_and_steps():
+    cron = scheduler.CronExpr('*/15 1-3,22 1 * 7')
+    assert cron.minute == {0, 15, 30, 45}
+    assert cron.hour == {1, 2, 3, 22}
+    assert cron.weekday == {0}  # 7 與 0 都是星期日
+    assert scheduler.CronExpr('5/20 * * * *').minute == {5, 25, 45}
+
+
+@pytest.mark.parametrize('expr', ['* * * *', '60 * * * *', '* 5-2 * * *', '*/0 * * * *'])
+def test_cron_rejects_invalid_expressions(expr):
+    with pytest.raises(ValueError):
+        scheduler.CronExpr(expr)
+
+
+def test_cron_next_and_previous():
+    cron = scheduler.CronExpr('30 1 * * 2-6')  # 週二至週六 01:30
+    friday = datetime(2026, 10, 16, 12, 0)
+    assert cron.next(friday) == datetime(2026, 10, 17, 1, 30)
+    assert cron.next(datetime(2026, 10, 17, 1, 30)) == datetime(2026, 10, 20, 1, 30)  # 不含當下，跳過週日、週一
+    assert cron.previous(friday) == datetime(2026, 10, 16, 1, 30)
+    assert cron.previous(datetime(2026, 10, 16, 1, 30, 45)) == datetime(2026, 10, 16, 1, 30)  # 含當下
+
+
+def test_cron_day_or_weekday_when_both_restricted():
+    cron = scheduler.CronExpr('0 0 13 * 5')  # 每月 13 日或星期五
+    assert cron.matches(datetime(2026, 10, 13))  # 星期二、13 日
+    assert cron.matches(datetime(2026, 10, 16))  # 星期五
+    assert not cron.matches(datetime(2026, 10, 14))
+    assert scheduler.CronExpr('0 2 1 * *').next(datetime(2026, 10, 16)) == datetime(2026, 11, 1, 2, 0)
+
+
+def test_cron_impossible_date_returns_none():
+    assert scheduler.CronExpr('0 0 30 2 *').next(datetime(2026, 1, 1)) is None
+
+
+@pytest.mark.parametrize('moment, expected', [('23:00', True), ('00:30', True), ('05:59', True),
+                                              ('06:00', False), ('21:59', False)])
+def test_in_window_handles_midnight(moment, expected):
+    assert scheduler.in_window('22:00-06:00', datetime.strptime(f'2026-10-16 {moment}', '%Y-%m-%d %H:%M')) is expected
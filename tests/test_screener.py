@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import screener
+
+
+def test_parse_filter_and_evaluate_on_columns():
+    columns = {'change_pct': np.array([6.0, 2.0, np.nan, 8.0]), 'vol_ratio': np.array([3.0, 5.0, 4.0, 1.0]),
+               'close': np.array([10.0, 20.0, 30.0, 40.0]), 'sma_20': np.array([9.0, 21.0, 29.0, 41.0])}
+    mask = screener.evaluate(screener.parse_filter('change_pct > 5 and vol_ratio >= 3'), columns)
+    assert mask.tolist() == [True, False, False, False]  # NaN 的比較結果為 False
+
+    mask = screener.evaluate(screener.parse_filter('not close < sma_20 or abs(change_pct) > 7'), columns)
+    assert mask.tolist() == [True, False, True, True]
+    mask = screener.evaluate(screener.parse_filter('1 < close / 10 <= 3'), columns)
+    assert mask.tolist() == [False, True, True, False]
+
+
+@pytest.mark.parametrize('expression', [
+    '__import__("os").system("true")',  # 不允許的函數
+    'close.__class__',  # 屬性存取
+    'unknown_field > 1',  # 不存在的欄位
+    'close > "1"',  # 字串常數
+    'close > sma_20 & vol_ratio > 1',  # 位元運算
+    'close ** 2 > 1',  # 不允許的運算子
+    'abs(close, 1) > 1',
+    '[close][0] > 1',
+    'close >',  # 語法錯誤
+])
+def test_parse_filter_rejects_disallowed_nodes(expression):
+    with pytest.raises(ValueError):
+        screener.parse_filter(expression)
+
+
+def make_data(closes, volumes):
+    frames = []
+    for ticker, values in closes.items():
+        dates = pd.bdate_range('2024-01-01', periods=len(values), name='date')
+        close = np.array(values, dtype='float64')
+        frames.append(pd.DataFrame({'ticker': ticker, 'open': close, 'high': close + 1, 'low': close - 1,
+                                    'close': close, 'volume': volumes[ticker]}, index=dates))
+    return pd.concat(frames)
+
+
+def test_compute_screen_latest_bar_per_ticker():
+    data = make_data({'A.TW': [10.0] * 20 + [11.0], 'B.TW': [50.0, 40.0]},
+                     {'A.TW': [100] * 20 + [300], 'B.TW': [10, 10]})
+    result = screener.compute_screen(data).set_index('ticker')
+
+    assert list(result.columns) == ['date'] + screener.SCREEN_COLUMNS
+    a, b = result.loc['A.TW'], result.loc['B.TW']
+    assert a['close'] == 11 and a['prev_close'] == 10
+    assert a['change_pct'] == pytest.approx(10.0)
+    assert a['vol_ratio'] == pytest.approx(3.0)  # 不含當天的 20 日均量
+    assert a['bars'] == 21
+    # B 停在第 2 天：取停牌前最後一根 K 棒
+    assert b['date'] == pd.Timestamp('2024-01-02').date()
+    assert b['change_pct'] == pytest.approx(-20.0)
+    assert np.isnan(b['vol_ratio'])  # 均量的資料不足 10 天
+    assert b['pct_from_high'] == pytest.approx((40 / 51 - 1) * 100)
+
+
+def test_compute_screen_empty():
+    result = screener.compute_screen(pd.DataFrame())
+    assert result.empty and list(result.columns) == ['ticker', 'date'] + screener.SCREEN_COLUMNS
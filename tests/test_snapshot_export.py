@@ -0,0 +1,82 @@
+from datetime import date
+
+import pyarrow as pa
+import pytest
+
+import snapshot_export
+
+
+class FakeDatabase:
+    """以 pa.Table 取代 stock_data，並模擬 stock_summary.changed_from"""
+
+    def __init__(self):
+        self.rows = []  # (ticker, date, close)
+        self.changed = {}  # 股票代號 -> changed_from
+
+    def write(self, ticker, days, close=1.0):
+        self.rows = [row for row in self.rows if (row[0], row[1]) not in {(ticker, day) for day in days}]
+        self.rows += [(ticker, day, close) for day in days]
+        self.changed[ticker] = min([self.changed.get(ticker, days[0])] + list(days))
+
+    def iter_batches(self, after=None, years=None, chunk_rows=None):
+        rows = sorted(row for row in self.rows
+                      if (after is None or row[1] > after) and (years is None or row[1].year in years))
+        if rows:
+            tickers, days, closes = zip(*rows)
+            yield pa.table({'ticker': tickers, 'date': pa.array(days, pa.date32()),
+                            'open': pa.array(closes, pa.float32()), 'high': pa.array(closes, pa.float32()),
+                            'low': pa.array(closes, pa.float32()), 'close': pa.array(closes, pa.float32()),
+                            'volume': pa.array([1] * len(rows), pa.int64())}, schema=snapshot_export.SCHEMA)
+
+    def claim(self):
+        changes, self.changed = self.changed, {}
+        return changes
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(snapshot_export, '_iter_batches', db.iter_batches)
+    monkeypatch.setattr(snapshot_export, '_claim_changes', db.claim)
+    monkeypatch.setattr(snapshot_export, '_restore_changes', lambda changes: None)
+    monkeypatch.setattr(snapshot_export, '_database_rows', lambda: len(db.rows))
+    return db
+
+
+def snapshot(export_dir):
+    table = snapshot_export.load_table(export_dir=str(export_dir))
+    return sorted(zip(table.column('ticker').to_pylist(), table.column('date').to_pylist(),
+                      table.column('close').to_pylist()))
+
+
+def test_append_rewrites_years_with_earlier_writes(db, tmp_path):
+    db.write('A.TW', [date(2024, 12, 30), date(2025, 1, 2)])
+    snapshot_export.export_full(str(tmp_path), log=lambda message: None)
+
+    db.write('A.TW', [date(2025, 1, 3)])  # 新交易日：只追加
+    db.write('B.TW', [date(2023, 6, 1), date(2025, 1, 3)])  # 新股票的早期歷史
+    db.write('A.TW', [date(2024, 12, 30)], close=2.0)  # 修正既有數據
+    snapshot_export.export_append(str(tmp_path), log=lambda message: None)
+
+    assert snapshot(tmp_path) == sorted(db.rows)
+    manifest = snapshot_export.read_manifest(str(tmp_path))
+    assert manifest['rows'] == 5
+    assert manifest['years'] == {'2023': 1, '2024': 1, '2025': 3}
+    assert manifest['last_date'] == '2025-01-03'
+
+
+def test_changed_years_only_covers_dates_up_to_last_export():
+    changes = {'A.TW': date(2022, 5, 1), 'B.TW': date(2025, 2, 1)}
+    assert snapshot_export.changed_years(changes, date(2024, 12, 31)) == {2022, 2023, 2024}
+
+
+def test_append_falls_back_to_full_export_when_counts_disagree(db, tmp_path, monkeypatch):
+    db.write('A.TW', [date(2024, 1, 2)])
+    snapshot_export.export_full(str(tmp_path), log=lambda message: None)
+    db.rows = [('C.TW', date(2024, 1, 3), 5.0)]  # 資料表被重建，沒有 changed_from 標記
+    db.changed = {}
+
+    messages = []
+    snapshot_export.export_append(str(tmp_path), log=messages.append)
+    assert snapshot(tmp_path) == [('C.TW', date(2024, 1, 3), 5.0)]
+    assert messages[0] == "快照列數與資料庫不一致，改為完整匯出"
@@ -0,0 +1,116 @@
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import batch_download
+import bulk_load
+import db_pool
+import db_schema
+import staged_reload
+
+
+def make_frame(days):
+    index = pd.bdate_range('2024-01-01', periods=days, name='Date')
+    values = np.arange(1, days + 1, dtype='float64')
+    return pd.DataFrame({'Close': values, 'High': values, 'Low': values, 'Open': values,
+                         'Volume': values * 100}, index=index)
+
+
+class FakeConnection:
+    """記錄執行的 SQL；查詢 stock_summary 時回傳 existing 中的股票（模擬已有歷史數據）"""
+
+    def __init__(self, existing=()):
+        self.existing = set(existing)
+        self.queries = []
+        self.result = []
+        self.rowcount = 0
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, query, params=None):
+        self.queries.append((repr(query), params))
+        if isinstance(query, str) and 'FROM stock_summary' in query:
+            self.result = [(ticker,) for ticker in sorted(self.existing & set(params[0]))]
+
+    def fetchall(self):
+        return self.result
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def reload_env(monkeypatch):
+    """以假的連接與下載執行 run_reload，記錄影子表的刪除與切換"""
+    calls = {'dropped': 0, 'swapped': []}
+    conn = FakeConnection(existing={'A', 'B', 'C', 'OTHER'})
+
+    @contextmanager
+    def connection():
+        yield conn
+
+    monkeypatch.setattr(db_schema, 'ensure_schema', lambda: None)
+    monkeypatch.setattr(db_schema, 'is_partitioned', lambda cur, table: False)
+    monkeypatch.setattr(db_pool, 'connection', connection)
+    monkeypatch.setattr(bulk_load, 'copy_rows', lambda cur, rows, table: None)
+    monkeypatch.setattr(staged_reload, 'build_shadows', lambda cur, events: None)
+    monkeypatch.setattr(staged_reload, 'drop_shadows',
+                        lambda cur: calls.__setitem__('dropped', calls['dropped'] + 1))
+    monkeypatch.setattr(staged_reload, 'swap_shadows', lambda cur, tickers: calls['swapped'].append(tickers))
+
+    def use_download(failing=(), empty=()):
+        def download(tickers, on_failure=None, **kwargs):
+            for ticker in tickers:
+                if ticker in failing:
+                    on_failure([ticker])
+                    yield ticker, pd.DataFrame()
+                elif ticker in empty:
+                    yield ticker, pd.DataFrame()  # 空回應：不回報失敗
+                else:
+                    yield ticker, make_frame(3)
+        monkeypatch.setattr(batch_download, 'iter_stock_data_batches', download)
+    return calls, conn, use_download
+
+
+def test_run_reload_swaps_when_all_downloads_succeed(reload_env):
+    calls, conn, use_download = reload_env
+    use_download()
+    summary = staged_reload.run_reload(['A', 'B'], log=lambda message: None)
+
+    assert summary['tickers'] == 2 and summary['rows'] == 6
+    assert calls['swapped'] == [['A', 'B']]
+    # 其他股票（OTHER）由正式表複製到影子表
+    carried = [params for query, params in conn.queries if 'NOT (ticker = ANY' in query and 'INSERT' in query]
+    assert carried == [(['A', 'B'],), (['A', 'B'],)]
+
+
+def test_run_reload_aborts_before_swap_when_a_download_fails(reload_env):
+    calls, conn, use_download = reload_env
+    use_download(failing={'B'})
+    with pytest.raises(RuntimeError, match='B'):
+        staged_reload.run_reload(['A', 'B', 'C'], log=lambda message: None)
+
+    assert calls['swapped'] == []
+    assert calls['dropped'] == 2  # 建立前清除一次，失敗後刪除影子表一次
+
+
+def test_run_reload_aborts_when_existing_ticker_downloads_nothing(reload_env):
+    calls, conn, use_download = reload_env
+    use_download(empty={'C', 'NEW'})
+    with pytest.raises(RuntimeError, match='C'):
+        staged_reload.run_reload(['A', 'C', 'NEW'], log=lambda message: None)
+    assert calls['swapped'] == []
+
+
+def test_run_reload_allows_empty_ticker_without_history(reload_env):
+    calls, conn, use_download = reload_env
+    use_download(empty={'NEW'})
+    staged_reload.run_reload(['A', 'NEW'], log=lambda message: None)
+    assert calls['swapped'] == [['A', 'NEW']]
@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+import validate_codes
+
+
+class FakeClock:
+    """取代 time.monotonic / time.sleep，sleep 只推進時間"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(validate_codes.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(validate_codes.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_token_bucket_allows_burst_then_waits_for_refill(clock):
+    bucket = validate_codes.TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        assert bucket.acquire()
+    assert clock.now == 100.0  # 初始為滿桶，前 3 次不等待
+
+    assert bucket.acquire()
+    assert clock.now == pytest.approx(100.5)  # 每秒 2 個令牌，第 4 次等待 0.5 秒
+
+
+def test_token_bucket_refill_is_capped_at_capacity(clock):
+    bucket = validate_codes.TokenBucket(rate=1, burst=2)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 60  # 閒置很久也只累積到容量
+    assert bucket.acquire()
+    assert bucket.acquire()
+    start = clock.now
+    assert bucket.acquire()
+    assert clock.now == pytest.approx(start + 1)
+
+
+def test_token_bucket_default_capacity_is_rate():
+    assert validate_codes.TokenBucket(rate=5).capacity == 5
+    assert validate_codes.TokenBucket(rate=0.5).capacity == 1
+
+
+def test_token_bucket_gives_up_when_stopped():
+    bucket = validate_codes.TokenBucket(rate=0.01, burst=1)
+    assert bucket.acquire()
+    stop_event = threading.Event()
+    stop_event.set()
+    assert bucket.acquire(stop_event) is False
+
+
+def test_validate_codes_keeps_input_order_and_does_not_report_failures():
+    def check(code):
+        if code == 'boom':
+            raise RuntimeError('network down')
+        return code.startswith('ok')
+
+    messages, results = [], {}
+    valid = validate_codes.validate_codes(
+        ['ok3', 'bad', 'boom', 'ok1'], check, max_workers=2, rate=1000,
+        on_result=results.__setitem__, log=messages.append)
+
+    assert valid == ['ok3', 'ok1']
+    assert results == {'ok3': True, 'bad': False, 'ok1': True}  # 檢查失敗不回調，不會被快取為無效
+    assert messages == ['代號 boom 檢查失敗: network down']
+
+
+def test_validate_codes_logs_timeouts():
+    release = threading.Event()
+
+    def check(code):
+        release.wait(5)
+        return True
+
+    messages = []
+    try:
+        valid = validate_codes.validate_codes(['slow'], check, rate=1000, timeout=0.05,
+                                              poll_interval=0.01, log=messages.append)
+    finally:
+        release.set()
+    assert valid == []
+    assert messages == ['代號 slow 檢查逾時 (0.05 秒)']
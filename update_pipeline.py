@@ -0,0 +1,148 @@
+import queue
+import threading
+import time
+
+_DONE = object()  # 結束標記，沿著佇列傳給下一階段
+
+
+class Stage:
+    """管線中的一個階段
+
+    func 接收上一階段的一個項目，返回要交給下一階段的項目列表（可為空以過濾）；
+    也可以是生成器函數，逐項產出，下游佇列滿時生成器在 yield 處暫停（記憶體只保留一項）。
+    skip_on_stop=True 的階段在收到停止信號後直接丟棄輸入（例如驗證、下載），
+    其餘階段會把已在佇列中的項目處理完（例如寫入，避免已下載的數據遺失）。
+    """
+
+    def __init__(self, name, func, workers=1, skip_on_stop=False):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.skip_on_stop = skip_on_stop
+        self.lock = threading.Lock()
+        self.active = 0  # 執行中的工作線程數
+        self.processed = 0  # 已處理的項目數
+        self.emitted = 0  # 交給下一階段的項目數
+        self.skipped = 0  # 停止後丟棄的項目數
+        self.errors = 0  # 發生例外的項目數
+        self.busy_seconds = 0.0  # 工作線程實際處理的累計秒數
+
+
+class Pipeline:
+    """以有界佇列串接多個階段的生產者/消費者管線
+
+    - 每個階段有各自的工作線程數，階段之間的佇列有容量上限，
+      下游變慢時上游的 put 會阻塞（背壓），記憶體不會無限增長
+    - stop_event 設置後停止餵入新項目，各階段依 skip_on_stop 丟棄或處理完佇列中的項目，
+      結束標記仍會逐階段傳遞，所有線程都能正常結束
+    """
+
+    def __init__(self, stages, queue_size=4, stop_event=None, log=None):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]  # 第 i 個佇列是第 i 階段的輸入
+        self.stop_event = stop_event or threading.Event()
+        self.log = log or print
+        self.started = None
+
+    def _stopped(self):
+        return self.stop_event.is_set()
+
+    def _worker(self, idx):
+        stage = self.stages[idx]
+        in_queue = self.queues[idx]
+        out_queue = self.queues[idx + 1] if idx + 1 < len(self.stages) else None
+
+        while True:
+            item = in_queue.get()
+            if item is _DONE:
+                break
+            if stage.skip_on_stop and self._stopped():
+                with stage.lock:
+                    stage.skipped += 1
+                continue
+
+            start = time.monotonic()
+            blocked = 0.0  # 等待下游佇列的秒數，不計入忙碌時間
+            emitted = 0
+            try:
+                # func 可返回生成器：每產出一項就交給下游，不必先在本階段累積全部輸出
+                for output in stage.func(item) or []:
+                    if out_queue is not None:
+                        wait = time.monotonic()
+                        out_queue.put(output)  # 下游佇列已滿時在此阻塞（背壓），生成器也隨之暫停
+                        blocked += time.monotonic() - wait
+                        emitted += 1
+            except Exception as e:
+                self.log(f"{stage.name} 階段失敗: {e}")
+                with stage.lock:
+                    stage.errors += 1
+            with stage.lock:
+                stage.processed += 1
+                stage.busy_seconds += time.monotonic() - start - blocked
+                stage.emitted += emitted
+
+        # 本階段最後一個結束的線程，為下一階段的每個線程送出結束標記
+        with stage.lock:
+            stage.active -= 1
+            last = stage.active == 0
+        if last and out_queue is not None:
+            for _ in range(self.stages[idx + 1].workers):
+                out_queue.put(_DONE)
+
+    def _feed(self, items):
+        try:
+            for item in items:
+                if self._stopped():
+                    break
+                self.queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self.queues[0].put(_DONE)
+
+    def stats(self):
+        """各階段的處理數、吞吐量（項目/秒）與輸入佇列深度"""
+        elapsed = max(time.monotonic() - self.started, 1e-9) if self.started else 0
+        result = []
+        for stage, in_queue in zip(self.stages, self.queues):
+            with stage.lock:
+                result.append({
+                    "stage": stage.name,
+                    "workers": stage.workers,
+                    "active": stage.active,
+                    "processed": stage.processed,
+                    "emitted": stage.emitted,
+                    "skipped": stage.skipped,
+                    "errors": stage.errors,
+                    "per_sec": round(stage.processed / elapsed, 2) if elapsed else 0,
+                    "busy_pct": round(100 * stage.busy_seconds / (elapsed * stage.workers), 1) if elapsed else 0,
+                    "queue_depth": in_queue.qsize(),
+                })
+        return result
+
+    def run(self, items, on_stats=None, interval=0.5):
+        """啟動所有階段並等待完成
+
+        Args:
+            items (iterable): 第一階段的輸入項目
+            on_stats (callable): 每 interval 秒以 stats() 結果回調一次（結束時再回調一次）
+            interval (float): 回調間隔秒數
+        """
+        self.started = time.monotonic()
+        threads = []
+        for idx, stage in enumerate(self.stages):
+            stage.active = stage.workers
+            for n in range(stage.workers):
+                thread = threading.Thread(target=self._worker, args=(idx,),
+                                          name=f"{stage.name}-{n}", daemon=True)
+                thread.start()
+                threads.append(thread)
+        feeder = threading.Thread(target=self._feed, args=(items,), name="feeder", daemon=True)
+        feeder.start()
+
+        for thread in [feeder] + threads:
+            while thread.is_alive():
+                thread.join(interval)
+                if on_stats:
+                    on_stats(self.stats())
+        if on_stats:
+            on_stats(self.stats())
@@ -0,0 +1,125 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class TokenBucket:
+    """令牌桶限速器（多線程共用）
+
+    每秒補充 rate 個令牌，最多累積 burst 個；每次請求取走一個令牌。
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)  # 每秒補充的令牌數
+        self.capacity = float(burst if burst is not None else max(1, rate))  # 桶容量
+        self.tokens = self.capacity  # 目前令牌數（初始為滿）
+        self.updated = time.monotonic()  # 上次補充時間
+        self.lock = threading.Lock()
+
+    def acquire(self, stop_event=None):
+        """取得一個令牌，不足時等待
+
+        Args:
+            stop_event (threading.Event): 停止信號，設置後立即放棄等待
+
+        Returns:
+            bool: True=取得令牌, False=等待期間收到停止信號
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # 依經過時間補充令牌，不超過容量
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                delay = (1 - self.tokens) / self.rate  # 距離下一個令牌的秒數
+
+            if stop_event is None:
+                time.sleep(delay)
+            elif stop_event.wait(min(delay, 0.1)):  # 分段等待以便及時響應停止信號
+                return False
+
+
+def validate_codes(codes, check, max_workers=8, rate=5.0, burst=None, timeout=15.0,
+                   stop_event=None, on_progress=None, on_result=None, poll_interval=0.1,
+                   bucket=None, log=None):
+    """以有界線程池並行檢查股票代號是否有效
+
+    Args:
+        codes (list): 待檢查的股票代號（依代號順序）
+        check (callable): 單一代號檢查函數，例如 is_stock_code
+        max_workers (int): 同時進行的最大請求數
+        rate (float): 每秒最多發出的請求數（令牌桶限速）
+        burst (int): 令牌桶容量，預設等於 rate
+        timeout (float): 單一請求逾時秒數，逾時視為無效代號
+        stop_event (threading.Event): 停止信號，設置後於 poll_interval 內返回
+        on_progress (callable): 進度回調 on_progress(已完成數, 總數, 每秒代號數)
+        on_result (callable): 結果回調 on_result(代號, 是否有效)，逾時或檢查失敗的代號不回調
+        poll_interval (float): 檢查停止信號與逾時的間隔秒數
+        bucket (TokenBucket): 共用的令牌桶（多次呼叫共用同一個限速額度），預設依 rate 新建
+        log (callable): 訊息輸出函數（檢查失敗與逾時），預設為 print
+
+    Returns:
+        list: 有效的股票代號，依輸入順序排列（中斷時只含已完成的部分）
+    """
+    log = log or print
+    codes = list(codes)
+    total = len(codes)
+    bucket = bucket or TokenBucket(rate, burst)
+    started = {}  # 代號 -> 實際開始請求的時間（取得令牌之後）
+    valid = {}  # 代號 -> 檢查結果
+    begin = time.monotonic()
+
+    def run(code):
+        if not bucket.acquire(stop_event):
+            return None  # 等待令牌期間收到停止信號
+        started[code] = time.monotonic()
+        return check(code)
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    inflight = {}  # future -> 代號
+    next_idx = 0
+    done_count = 0
+    try:
+        while next_idx < total or inflight:
+            if stop_event is not None and stop_event.is_set():
+                break
+
+            # 補滿進行中的請求，最多 max_workers 個，避免一次提交全部代號
+            while next_idx < total and len(inflight) < max_workers:
+                code = codes[next_idx]
+                inflight[pool.submit(run, code)] = code
+                next_idx += 1
+
+            finished, _ = wait(inflight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in list(inflight):
+                code = inflight[future]
+                if future in finished:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # 暫時性錯誤不代表代號無效：本次不列入有效代號，也不回調（不寫入快取與檢查點）
+                        log(f"代號 {code} 檢查失敗: {e}")
+                        result = None
+                    valid[code] = bool(result)
+                    if on_result and result is not None:  # None 表示未實際發出請求或檢查失敗
+                        on_result(code, valid[code])
+                elif code in started and now - started[code] > timeout:
+                    # 逾時請求不再等待（線程仍會在背景結束），視為無效
+                    log(f"代號 {code} 檢查逾時 ({timeout} 秒)")
+                    valid[code] = False
+                else:
+                    continue
+                del inflight[future]
+                done_count += 1
+                if on_progress:
+                    elapsed = max(time.monotonic() - begin, 1e-9)
+                    on_progress(done_count, total, done_count / elapsed)
+    finally:
+        # 不等待進行中的請求，讓停止信號能立即生效
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return [code for code in codes if valid.get(code)]